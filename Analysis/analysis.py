@@ -1,12 +1,20 @@
+import argparse
 import csv
+import hashlib
 import json
+import os
 import sys
+import time
+from contextlib import contextmanager
 from typing import List, Dict
 
 from tld import get_fld
 
 import fileUtils
 from analysisCounter import AnalysisCounter
+from analysisState import AnalysisState, is_appended_to, read_tail
+from policyResults import PolicyResults
+from siteSampling import Sample, StratifiedEstimator, get_stratum, DEFAULT_SEED
 from ast import literal_eval
 
 # CONSTANTS
@@ -26,6 +34,8 @@ while True:
 
 RESULTS_CSV = fileUtils.get_csv_results_file()
 POLICY_RESULTS_JSON = fileUtils.get_policy_results_file()
+POLICY_RESULTS_JSONL = fileUtils.get_policy_results_stream_file()
+SAMPLE_JSON = fileUtils.get_sample_file()
 TOTAL_COUNTER = AnalysisCounter()
 
 POLICY_COUNTER = AnalysisCounter()
@@ -49,18 +59,100 @@ ENDPOINT_LEAKAGE_COUNTERS = {}
 for e in ENDPOINTS:
     ENDPOINT_LEAKAGE_COUNTERS[e] = AnalysisCounter()
 
+COUNTERS_BY_NAME = {'domain': DOMAIN_LEAKAGE_COUNTER,
+                    'usage': USAGE_COUNTER,
+                    'page': PAGE_LEAKAGE_COUNTER,
+                    'total': TOTAL_COUNTER,
+                    'organisation': ORGANISATION_LEAKAGE_COUNTER,
+                    'cmp': CMP_COUNTER,
+                    'policy': POLICY_COUNTER,
+                    'block': DOMAIN_BLOCK_COUNTER,
+                    'orgblock': ORGANISATION_BLOCK_COUNTER,
+                    **{f'endpoint:{e}': ENDPOINT_LEAKAGE_COUNTERS[e] for e in ENDPOINTS}}
+
 RANK_LIST = []
 
+COUNTER_NAMES = ['domain', 'usage', 'page', 'total', 'organisation', 'cmp', 'policy', 'endpoints', 'block', 'orgblock']
+
+ANALYSIS_STATE_FILE = 'analysis-state.sqlite'
+# Increase when get_site_contribution or the saved state changes, so saved contributions are not used anymore
+ANALYSIS_STATE_VERSION = 3
+
+__analysed = False
+# Whether the rank list and lookups still have to be loaded from the state of an incremental analysis
+__incremental_lookups_pending = False
+domain_mapping: Dict[str, str] = {}
+
 
 def sort_dict(dictionary: dict):
     sorted_dict = sorted(list(dictionary.items()), key=lambda i: i[1])
     return dict(sorted_dict)
 
 
+@contextmanager
+def timed_stage(stage_times: dict, stage: str):
+    """Adds the time spent in the with-block to stage_times[stage], if stage_times is given."""
+    if stage_times is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_times[stage] += time.perf_counter() - start
+
+
+class StageTimer:
+    """
+    Splits the time spent on a sequence of steps over stages: every lap adds the time since the previous lap, or since
+    the timer was created, to stage_times[stage]. Does nothing if stage_times is None. Cheaper than timed_stage for
+    the many short steps of every site.
+    """
+    def __init__(self, stage_times: dict = None):
+        self.stage_times = stage_times
+        self.last = time.perf_counter() if stage_times is not None else 0.0
+
+    def lap(self, stage: str):
+        if self.stage_times is None:
+            return
+        now = time.perf_counter()
+        self.stage_times[stage] += now - self.last
+        self.last = now
+
+
 def get_rank_list():
+    run_analysis()
+    __load_incremental_lookups()
     return RANK_LIST
 
 
+def get_mtime(path: str):
+    return os.path.getmtime(path) if os.path.exists(path) else -1
+
+
+def load_policy_results():
+    """
+    Get the policy results written by postProcessing, from whichever of its two output files was written last.
+    Policy results streamed to the JSON lines file are read lazily, see policyResults.PolicyResults.
+    :return: PolicyResults or dict, both with key=domain, value=policy results of that domain
+    """
+    if get_mtime(POLICY_RESULTS_JSONL) > get_mtime(POLICY_RESULTS_JSON):
+        return PolicyResults(POLICY_RESULTS_JSONL)
+    with open(POLICY_RESULTS_JSON, 'r') as policy_results_json:
+        return json.load(policy_results_json)
+
+
+def check_results_not_sampled():
+    """
+    Raises a ValueError if the results files only contain the sites sampled by postProcessing.py --sample, as their
+    counts would otherwise be taken for the counts of the whole corpus. Estimates for the corpus are made from them
+    with run_sampled_analysis instead.
+    """
+    if os.path.exists(SAMPLE_JSON):
+        raise ValueError(f'The results files only contain the sites of the sample in {SAMPLE_JSON}, made by '
+                         f'postProcessing.py --sample. Use --estimate, or run postProcessing.py without --sample.')
+
+
 def get_domain_map():
     domain_map_full = fileUtils.get_domain_map_file()
     return {k: v['entityName'] for (k, v) in domain_map_full.items()}
@@ -77,6 +169,7 @@ def __domains_to_organisations(domains: List[str]):
 
 
 def get_counters():
+    run_analysis()
     return {'domain': DOMAIN_LEAKAGE_COUNTER,
             'usage': USAGE_COUNTER,
             'page': PAGE_LEAKAGE_COUNTER,
@@ -90,87 +183,503 @@ def get_counters():
 
 
 def get_leak_block_domain_lookup():
+    run_analysis()
+    __load_incremental_lookups()
     return LEAK_BLOCK_DOMAIN_LOOKUP
 
 
 def get_leak_block_org_lookup():
+    run_analysis()
+    __load_incremental_lookups()
     return LEAK_BLOCK_ORG_LOOKUP
 
 
-with open(RESULTS_CSV, 'r', newline='') as leakage_results_csv:
-    csv_reader = csv.reader(leakage_results_csv)
-    domain_mapping: Dict[str, str] = get_domain_map()
-    mapped_domains = {}
-    domain_rank_cmp = {}
-    for row in csv_reader:
-        # Get values from csv
-        domain = row[0]
-        rank = int(row[1])
-        cmp = row[2]
-        leakage_endpoints: List[str] = literal_eval(row[3])
-        third_party_pages_used = literal_eval(row[4])
-        third_party_referrer_leaks = literal_eval(row[5])
-
-        leakage_endpoints = list(map(lambda u: u[4:] if u.startswith('www') else u, leakage_endpoints))
-        leakage_domains: List[str] = list(set(map(lambda u: get_fld(u, fix_protocol=True), leakage_endpoints)))
-        leakage_amounts: List[str] = []
-        amount = 1
-        for leakage in literal_eval(row[3]):
-            leakage_amounts.append(f'≥ {amount}')
-            amount += 1
-
-        domain_rank_cmp[domain] = [rank, cmp]
-
-        def page_used_filter(page: str):
-            return '' if 'yass/' in page else get_fld(page, fix_protocol=True)
-
-        third_party_domains_used: List[str] = list(map(page_used_filter, third_party_pages_used))
-        domain_blocks = set(third_party_domains_used) - set(leakage_domains) - set(third_party_referrer_leaks)
-
-        organisations_used = __domains_to_organisations(third_party_domains_used)
-        organisation_referrer_leaks = __domains_to_organisations(third_party_referrer_leaks)
-        organisation_bypasses = __domains_to_organisations(leakage_domains)
-        organisation_blocks = organisations_used - organisation_bypasses - organisation_referrer_leaks
-
-        RANK_LIST.append(rank)
-        TOTAL_COUNTER.incr_counters(rank, cmp, leakage_amounts, total_counter=True)
-        USAGE_COUNTER.incr_counters(rank, cmp, list(set(third_party_domains_used)), total_counter=True)
-        if cmp:
-            if cmp == 'onetrust1':
-                cmp = 'onetrust-OLD'
-            elif cmp == 'onetrust2':
-                cmp = 'onetrust-LI'
-            CMP_COUNTER.incr_counters(rank, cmp, [cmp])
-
-        PAGE_LEAKAGE_COUNTER.incr_counters(rank, cmp, leakage_endpoints)
-        DOMAIN_LEAKAGE_COUNTER.incr_counters(rank, cmp, leakage_domains)
-        ORGANISATION_LEAKAGE_COUNTER.incr_counters(rank, cmp, list(organisation_bypasses))
-        DOMAIN_BLOCK_COUNTER.incr_counters(rank, cmp, list(domain_blocks))
-        ORGANISATION_BLOCK_COUNTER.incr_counters(rank, cmp, list(organisation_blocks))
-
-        LEAK_BLOCK_DOMAIN_LOOKUP[domain] = {'leak': leakage_domains, 'block': domain_blocks}
-        LEAK_BLOCK_ORG_LOOKUP[domain] = {'leak': list(organisation_bypasses), 'block': organisation_blocks}
-
-        for key in ENDPOINT_LEAKAGE_COUNTERS:
-            # Some endpoint leakages have different, but similar paths, so these are trimmed.
-            if key == 'gstatic.com':
-                trimmed_pages_gstatic = list(set(['/'.join(p.split('/')[:4]) if p.startswith('fonts.gstatic.com/s/')
-                                                  else p for p in leakage_endpoints]))
-                ENDPOINT_LEAKAGE_COUNTERS[key].incr_counters(
-                    rank, cmp, [u for u in trimmed_pages_gstatic if get_fld(u, fix_protocol=True) == key])
-            elif key == 'google.nl':
-                trimmed_pages_googlenl = ['/'.join(p.split('/')[:3]) if 'google.nl/pagead/1p-user-list' in p
-                                                                        or 'google.nl/pagead/1p-conversion' in p
-                                          else p for p in leakage_endpoints]
-                ENDPOINT_LEAKAGE_COUNTERS[key].incr_counters(
-                    rank, cmp, [u for u in trimmed_pages_googlenl if get_fld(u, fix_protocol=True) == key])
+def get_site_contribution(row: List[str], policy_results: dict = None, stage_times: dict = None):
+    """
+    Computes what the results of one site add to the counters and lookups.
+    :param row: row of the results CSV of the site
+    :param policy_results: policy results of the site (see postProcessing), or None if it has none
+    :param stage_times: if given, defaultdict(float) to which the time spent on parsing the row is added as 'parse_row',
+    the time spent on computing the items of every counter as 'counter:<name>' and the rest as 'contributions'. Items
+    that several counters need are timed for the first counter that needs them.
+    :return: dict with 'domain', 'rank', 'counts': list of the arguments of the incr_counters call of every counter
+    (name in COUNTERS_BY_NAME, rank, cmp, items, total_counter), 'cmp' with which the policy is counted, and
+    'domain_lookup' and 'org_lookup' entries
+    """
+    timer = StageTimer(stage_times)
+    # Get values from csv
+    domain = row[0]
+    rank = int(row[1])
+    cmp = row[2]
+    leakage_endpoints: List[str] = literal_eval(row[3])
+    third_party_pages_used = literal_eval(row[4])
+    third_party_referrer_leaks = literal_eval(row[5])
+
+    timer.lap('parse_row')
+
+    leakage_endpoints = list(map(lambda u: u[4:] if u.startswith('www') else u, leakage_endpoints))
+    timer.lap('counter:page')
+    leakage_domains: List[str] = list(set(map(lambda u: get_fld(u, fix_protocol=True), leakage_endpoints)))
+    timer.lap('counter:domain')
+    leakage_amounts: List[str] = []
+    amount = 1
+    for leakage in literal_eval(row[3]):
+        leakage_amounts.append(f'≥ {amount}')
+        amount += 1
+    timer.lap('counter:total')
+
+    def page_used_filter(page: str):
+        return '' if 'yass/' in page else get_fld(page, fix_protocol=True)
+
+    third_party_domains_used: List[str] = list(map(page_used_filter, third_party_pages_used))
+    timer.lap('counter:usage')
+    domain_blocks = set(third_party_domains_used) - set(leakage_domains) - set(third_party_referrer_leaks)
+    timer.lap('counter:block')
+
+    organisation_bypasses = __domains_to_organisations(leakage_domains)
+    timer.lap('counter:organisation')
+    organisations_used = __domains_to_organisations(third_party_domains_used)
+    organisation_referrer_leaks = __domains_to_organisations(third_party_referrer_leaks)
+    organisation_blocks = organisations_used - organisation_bypasses - organisation_referrer_leaks
+    timer.lap('counter:orgblock')
+
+    counts = [('total', rank, cmp, leakage_amounts, True),
+              ('usage', rank, cmp, list(set(third_party_domains_used)), True)]
+    timer.lap('contributions')
+    policy_cmp = cmp
+    if cmp:
+        if cmp == 'onetrust1':
+            cmp = 'onetrust-OLD'
+        elif cmp == 'onetrust2':
+            cmp = 'onetrust-LI'
+        counts.append(('cmp', rank, cmp, [cmp], False))
+    timer.lap('counter:cmp')
+
+    counts += [('page', rank, cmp, leakage_endpoints, False),
+               ('domain', rank, cmp, leakage_domains, False),
+               ('organisation', rank, cmp, list(organisation_bypasses), False),
+               ('block', rank, cmp, list(domain_blocks), False),
+               ('orgblock', rank, cmp, list(organisation_blocks), False)]
+    timer.lap('contributions')
+
+    for key in ENDPOINT_LEAKAGE_COUNTERS:
+        # Some endpoint leakages have different, but similar paths, so these are trimmed.
+        if key == 'gstatic.com':
+            trimmed_pages_gstatic = list(set(['/'.join(p.split('/')[:4]) if p.startswith('fonts.gstatic.com/s/')
+                                              else p for p in leakage_endpoints]))
+            endpoint_items = [u for u in trimmed_pages_gstatic if get_fld(u, fix_protocol=True) == key]
+        elif key == 'google.nl':
+            trimmed_pages_googlenl = ['/'.join(p.split('/')[:3]) if 'google.nl/pagead/1p-user-list' in p
+                                                                    or 'google.nl/pagead/1p-conversion' in p
+                                      else p for p in leakage_endpoints]
+            endpoint_items = [u for u in trimmed_pages_googlenl if get_fld(u, fix_protocol=True) == key]
+        else:
+            endpoint_items = [u for u in leakage_endpoints if get_fld(u, fix_protocol=True) == key]
+        counts.append((f'endpoint:{key}', rank, cmp, endpoint_items, False))
+        timer.lap(f'counter:endpoint:{key}')
+
+    if policy_results is not None and policy_results['set_policy']:
+        counts.append(('policy', rank, policy_cmp, [policy_results['set_policy']], False))
+    timer.lap('counter:policy')
+
+    return {'domain': domain,
+            'rank': rank,
+            'counts': counts,
+            'cmp': policy_cmp,
+            'domain_lookup': {'leak': leakage_domains, 'block': domain_blocks},
+            'org_lookup': {'leak': list(organisation_bypasses), 'block': organisation_blocks}}
+
+
+def __update_counts(counts: list, amount: int, stage_times: dict = None):
+    """
+    Adds counts to the counters, or subtracts them if amount is negative.
+    :param counts: list of the arguments of incr_counters calls, see get_site_contribution
+    :param stage_times: if given, the time spent on every counter is added to stage_times['counter:<name>']
+    """
+    timer = StageTimer(stage_times)
+    for name, rank, cmp, items, total_counter in counts:
+        if amount > 0:
+            COUNTERS_BY_NAME[name].incr_counters(rank, cmp, items, total_counter)
+        else:
+            COUNTERS_BY_NAME[name].decr_counters(rank, cmp, items, total_counter)
+        timer.lap(f'counter:{name}')
+
+
+def get_set_policy(policy_results: dict, domain: str):
+    """Get the policy set by a site according to the policy results of all sites, or None if it sets none."""
+    return policy_results[domain]['set_policy'] or None if domain in policy_results else None
+
+
+def get_policy_counts(rank: int, cmp: str, set_policy: str):
+    """
+    Get what a site adds to the policy counter, which counts every site once, with the rank and CMP of its last row.
+    :return: list of the arguments of the incr_counters call, see get_site_contribution, empty if it sets no policy
+    """
+    return [('policy', rank, cmp, [set_policy], False)] if set_policy else []
+
+
+def __reset_counters():
+    for counter in COUNTERS_BY_NAME.values():
+        counter.__init__()
+    RANK_LIST.clear()
+    LEAK_BLOCK_DOMAIN_LOOKUP.clear()
+    LEAK_BLOCK_ORG_LOOKUP.clear()
+
+
+def __iter_site_results(sites=None, stage_times: dict = None):
+    """
+    Yields the row of the results CSV and the policy results (or None) of every site, or only of the sites in sites.
+    """
+    with timed_stage(stage_times, 'load_policy_results'):
+        policy_results = load_policy_results()
+    try:
+        with open(RESULTS_CSV, 'r', newline='') as leakage_results_csv:
+            for row in csv.reader(leakage_results_csv):
+                if sites is None or row[0] in sites:
+                    yield row, policy_results[row[0]] if row[0] in policy_results else None
+    finally:
+        if isinstance(policy_results, PolicyResults):
+            policy_results.close()
+
+
+def __iter_result_lines(start: int = 0, end: int = None):
+    """
+    Yields the end offset and the row of every complete line of the results CSV from offset start onwards, up to offset
+    end if given. postProcessing writes the results of a site as one line, so a line that is still being written is
+    left for the next incremental analysis.
+    """
+    with open(RESULTS_CSV, 'rb') as leakage_results_csv:
+        leakage_results_csv.seek(start)
+        offset = start
+        for line in leakage_results_csv:
+            if not line.endswith(b'\n') or (end is not None and offset >= end):
+                return
+            offset += len(line)
+            yield offset, next(csv.reader([line.decode('utf-8')]))
+
+
+def get_row_fingerprint(previous: str, row: List[str]):
+    """Get the fingerprint of the rows of a site, from the fingerprint of its earlier rows and its next row."""
+    return hashlib.sha1((previous + json.dumps(row)).encode('utf-8')).hexdigest()
+
+
+def get_state_signature():
+    """Get what the saved state of an incremental analysis depends on besides the results files, see run_analysis."""
+    domain_map_stat = os.stat(fileUtils.DOMAIN_MAP_FILE)
+    return {'version': ANALYSIS_STATE_VERSION,
+            'domain_map': [domain_map_stat.st_size, domain_map_stat.st_mtime_ns],
+            'endpoints': ENDPOINTS}
+
+
+class PolicyChanges:
+    """
+    The policies set by sites according to the policy results file that postProcessing wrote last (see
+    load_policy_results), compared to when an incremental analysis last read it. Streamed policy results are only
+    appended to, so only the lines after the saved offset are read. The JSON file is rewritten as a whole, so when it
+    changed, it is read completely and the policies of all sites are compared.
+    :param position: position saved by the previous incremental analysis, or None
+    """
+    def __init__(self, position: tuple = None, stage_times: dict = None):
+        self.stage_times = stage_times
+        self.policy_results = None
+        # Dict with key=domain, value=set_policy, of the policy results that were written since the position
+        self.changed = {}
+        self.compare_all = False
+
+        saved_path, saved_position = position if position is not None else (None, None)
+        with timed_stage(stage_times, 'load_policy_results'):
+            if get_mtime(POLICY_RESULTS_JSONL) > get_mtime(POLICY_RESULTS_JSON):
+                self.__read_jsonl(saved_path, saved_position)
             else:
-                ENDPOINT_LEAKAGE_COUNTERS[key].incr_counters(
-                    rank, cmp, [u for u in leakage_endpoints if get_fld(u, fix_protocol=True) == key])
+                self.__read_json(saved_path, saved_position)
+
+    def __read_jsonl(self, saved_path: str, saved_position: tuple):
+        start = 0
+        if saved_path == POLICY_RESULTS_JSONL and is_appended_to(POLICY_RESULTS_JSONL, saved_position):
+            start = saved_position[0]
+        else:
+            self.compare_all = True
+        end = start
+        with PolicyResults(POLICY_RESULTS_JSONL) as policy_results:
+            for end, domain, results in policy_results.iter_from(start):
+                self.changed[domain] = results['set_policy'] or None
+        self.position = POLICY_RESULTS_JSONL, (end, read_tail(POLICY_RESULTS_JSONL, end))
+
+    def __read_json(self, saved_path: str, saved_position: tuple):
+        json_stat = os.stat(POLICY_RESULTS_JSON)
+        self.position = POLICY_RESULTS_JSON, (json_stat.st_size, json_stat.st_mtime_ns)
+        if (saved_path, saved_position) != self.position:
+            self.compare_all = True
+            with open(POLICY_RESULTS_JSON, 'r') as policy_results_json:
+                self.changed = {domain: results['set_policy'] or None
+                                for domain, results in json.load(policy_results_json).items()}
+
+    def get_set_policy(self, domain: str, site: dict):
+        """
+        Get the policy a site sets now, or None if it sets none.
+        :param site: saved state of the site, without 'policy' if it is new
+        """
+        if domain in self.changed:
+            return self.changed[domain]
+        if self.compare_all:
+            return None
+        if 'policy' in site:
+            return site['policy']
+        # A new site whose policy results were written before the saved position
+        if self.policy_results is None:
+            with timed_stage(self.stage_times, 'load_policy_results'):
+                self.policy_results = load_policy_results()
+        return get_set_policy(self.policy_results, domain)
+
+    def get_domains(self, state: AnalysisState):
+        """Get the sites whose policy may have changed."""
+        if self.compare_all:
+            return set(state.get_fingerprints()) | set(self.changed)
+        return set(self.changed)
+
+    def close(self):
+        if isinstance(self.policy_results, PolicyResults):
+            self.policy_results.close()
+
+
+def __add_sites(state: AnalysisState, rows, policies: PolicyChanges, stage_times: dict = None):
+    """
+    Adds rows of the results CSV to the counters and the saved state of their sites. The policy count of a site is
+    subtracted before and added after its rows, as it depends on its last row.
+    :param rows: iterable of the rows to add
+    :return: list of the rank of every row
+    """
+    sites = {}
+    ranks = []
+    for row in rows:
+        site = sites.get(row[0])
+        if site is None:
+            site = state.get_site(row[0])
+            if site is None:
+                site = {'fingerprint': '', 'rows': []}
+            else:
+                __update_counts(get_policy_counts(site['rank'], site['cmp'], site['policy']), -1, stage_times)
+            sites[row[0]] = site
+        contribution = get_site_contribution(row, stage_times=stage_times)
+        __update_counts(contribution['counts'], 1, stage_times)
+        ranks.append(contribution['rank'])
+        site['fingerprint'] = get_row_fingerprint(site['fingerprint'], row)
+        site['rows'].append(contribution['counts'])
+        site['rank'], site['cmp'] = contribution['rank'], contribution['cmp']
+        site['lookups'] = contribution['domain_lookup'], contribution['org_lookup']
+
+    for domain, site in sites.items():
+        site['policy'] = policies.get_set_policy(domain, site)
+        __update_counts(get_policy_counts(site['rank'], site['cmp'], site['policy']), 1, stage_times)
+        state.put_site(domain, site)
+    return ranks
+
+
+def __remove_site(state: AnalysisState, domain: str, stage_times: dict = None):
+    """Subtracts what a site added to the counters and removes its saved state."""
+    site = state.get_site(domain)
+    for counts in site['rows']:
+        __update_counts(counts, -1, stage_times)
+    __update_counts(get_policy_counts(site['rank'], site['cmp'], site['policy']), -1, stage_times)
+    state.delete_site(domain)
+
+
+def __update_sites(state: AnalysisState, policies: PolicyChanges, stage_times: dict = None):
+    """
+    Brings the counters and the saved state up to date with the results CSV. If it was only appended to, only the new
+    rows are read. Otherwise, the sites whose rows changed or were removed are subtracted and added again.
+    :return: set of the sites that got new rows
+    """
+    end, tail = state.get('results', (0, b''))
+    if is_appended_to(RESULTS_CSV, (end, tail)):
+        rows = []
+        for end, row in __iter_result_lines(end):
+            rows.append(row)
+        state.append_ranks(__add_sites(state, rows, policies, stage_times))
+        state.put('results', (end, read_tail(RESULTS_CSV, end)))
+        return {row[0] for row in rows}
+
+    fingerprints = {}
+    ranks = []
+    end = 0
+    for end, row in __iter_result_lines():
+        fingerprints[row[0]] = get_row_fingerprint(fingerprints.get(row[0], ''), row)
+        ranks.append(int(row[1]))
+    for domain, fingerprint in state.get_fingerprints().items():
+        if fingerprints.get(domain) == fingerprint:
+            del fingerprints[domain]
+        else:
+            __remove_site(state, domain, stage_times)
+    __add_sites(state, (row for _, row in __iter_result_lines(0, end) if row[0] in fingerprints), policies,
+                stage_times)
+    state.replace_ranks(ranks)
+    state.put('results', (end, read_tail(RESULTS_CSV, end)))
+    return set(fingerprints)
+
+
+def __update_policies(state: AnalysisState, policies: PolicyChanges, skip: set, stage_times: dict = None):
+    """Updates the policy counts of the sites whose policy results changed, except for the sites in skip."""
+    for domain in policies.get_domains(state) - skip:
+        site = state.get_site(domain)
+        if site is None:
+            continue
+        set_policy = policies.get_set_policy(domain, site)
+        if set_policy != site['policy']:
+            __update_counts(get_policy_counts(site['rank'], site['cmp'], site['policy']), -1, stage_times)
+            site['policy'] = set_policy
+            __update_counts(get_policy_counts(site['rank'], site['cmp'], site['policy']), 1, stage_times)
+            state.put_site(domain, site)
+
+
+def __load_incremental_lookups():
+    """Fills the rank list and lookups from the state saved by the last incremental analysis, see run_analysis."""
+    global __incremental_lookups_pending
+    if not __incremental_lookups_pending:
+        return
+    with AnalysisState(ANALYSIS_STATE_FILE, get_state_signature()) as state:
+        RANK_LIST[:] = state.get_ranks()
+        LEAK_BLOCK_DOMAIN_LOOKUP.clear()
+        LEAK_BLOCK_ORG_LOOKUP.clear()
+        for domain, site in state.iter_sites():
+            LEAK_BLOCK_DOMAIN_LOOKUP[domain], LEAK_BLOCK_ORG_LOOKUP[domain] = site['lookups']
+    __incremental_lookups_pending = False
+
+
+def run_analysis(incremental=False, stage_times: dict = None):
+    """
+    Analyses the results files of postProcessing into the counters and lookups above. The analysis runs once, the first
+    time it is needed, so importing this module is cheap.
+    In incremental mode, the counters are saved to ANALYSIS_STATE_FILE together with what every site added to them. A
+    later incremental run starts from the saved counters and only reads the rows appended to the results CSV and the
+    policy results written since, adding the new rows and replacing the policy counts of the sites that changed. If the
+    results CSV was rewritten, the sites whose rows changed are subtracted and added again. Unlike the streamed policy
+    results, a changed policy results JSON file is compared for all sites, so stream them (postProcessing.py
+    --stream-policy-results) for incremental runs. The rank list and lookups are loaded from the state when needed.
+    Every incremental run updates the counters, also when the analysis ran before.
+    :param incremental: whether to run in incremental mode
+    :param stage_times: if given, defaultdict(float) to which the time spent on loading the policy results, parsing the
+    rows, computing the items of every counter and updating it is added, see get_site_contribution and benchmark.py
+    :return: None
+    """
+    global __analysed, __incremental_lookups_pending, domain_mapping
+    if __analysed and not incremental:
+        return
+    check_results_not_sampled()
+    if not __analysed:
+        domain_mapping = get_domain_map()
+    __analysed = True
+
+    if not incremental:
+        # The policy counter counts every site once, with the rank and CMP of its last row
+        last_rank_cmps = {}
+        with open(RESULTS_CSV, 'r', newline='') as leakage_results_csv:
+            for row in csv.reader(leakage_results_csv):
+                contribution = get_site_contribution(row, stage_times=stage_times)
+                RANK_LIST.append(contribution['rank'])
+                __update_counts(contribution['counts'], 1, stage_times)
+                LEAK_BLOCK_DOMAIN_LOOKUP[contribution['domain']] = contribution['domain_lookup']
+                LEAK_BLOCK_ORG_LOOKUP[contribution['domain']] = contribution['org_lookup']
+                last_rank_cmps[contribution['domain']] = contribution['rank'], contribution['cmp']
+        with timed_stage(stage_times, 'load_policy_results'):
+            policy_results = load_policy_results()
+        try:
+            for domain, (rank, cmp) in last_rank_cmps.items():
+                __update_counts(get_policy_counts(rank, cmp, get_set_policy(policy_results, domain)), 1, stage_times)
+        finally:
+            if isinstance(policy_results, PolicyResults):
+                policy_results.close()
+        return
+
+    __reset_counters()
+    with AnalysisState(ANALYSIS_STATE_FILE, get_state_signature()) as state:
+        for name, counter in state.get('counters', {}).items():
+            COUNTERS_BY_NAME[name].__dict__.update(counter)
+        policies = PolicyChanges(state.get('policy'), stage_times)
+        try:
+            added = __update_sites(state, policies, stage_times)
+            __update_policies(state, policies, added, stage_times)
+        finally:
+            policies.close()
+        state.put('policy', policies.position)
+        state.put('counters', {name: counter.__dict__ for name, counter in COUNTERS_BY_NAME.items()})
+        state.commit()
+    __incremental_lookups_pending = True
+
+
+def run_sampled_analysis(sample: Sample = None, fraction: float = None, seed: int = DEFAULT_SEED):
+    """
+    Estimates the percentages of all counters from a stratified sample of the sites, see siteSampling.py. Only the
+    sampled sites are analysed, so this takes a fraction of the time of run_analysis.
+    :param sample: Sample to use, e.g. the one of a sampled postProcessing run. If None, a sample of the sites in the
+    results CSV is selected, stratified on their rank and CMP in the results.
+    :param fraction: fraction of the sites to sample if sample is None
+    :param seed: seed of the sample if sample is None
+    :return: tuple of the Sample and a dict with key=name in COUNTERS_BY_NAME, value=its StratifiedEstimator
+    """
+    global domain_mapping
+    if sample is None:
+        check_results_not_sampled()
+        with open(RESULTS_CSV, 'r', newline='') as leakage_results_csv:
+            site_strata = {row[0]: get_stratum(int(row[1]), bool(row[2])) for row in csv.reader(leakage_results_csv)}
+        sample = Sample.select(site_strata, fraction, seed)
+    if not domain_mapping:
+        domain_mapping = get_domain_map()
+
+    estimators = {name: StratifiedEstimator(sample) for name in COUNTERS_BY_NAME}
+    for row, policy_results in __iter_site_results(sample.sites):
+        site_counts = {name: (items, total_counter)
+                       for name, _, _, items, total_counter in get_site_contribution(row, policy_results)['counts']}
+        for name, estimator in estimators.items():
+            items, total_counter = site_counts.get(name, ([], False))
+            estimator.add_site(sample.sites[row[0]], items, total_counter)
+    return sample, estimators
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description='Analyse the results files of postProcessing and print the counters.')
+    parser.add_argument('counters', nargs='*', metavar='counter',
+                        help=f'counters to print: {", ".join(COUNTER_NAMES)} (default: all)')
+    parser.add_argument('--incremental', action='store_true',
+                        help=f'only analyse sites whose results changed since the previous incremental analysis, '
+                             f'using the state saved in {ANALYSIS_STATE_FILE}')
+    parser.add_argument('--sample', type=float, metavar='FRACTION',
+                        help='estimate the percentages of the counters from a stratified sample of this fraction of '
+                             'the sites of every rank bucket and CMP/no-CMP group')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help='seed of the sample')
+    parser.add_argument('--estimate', action='store_true',
+                        help=f'estimate the percentages of the counters from the sample of postProcessing.py --sample, '
+                             f'saved in {SAMPLE_JSON}')
+    args = parser.parse_args(argv)
+    unknown = set(args.counters) - set(COUNTER_NAMES)
+    if unknown:
+        parser.error(f'unknown counters: {", ".join(sorted(unknown))}')
+
+    if not args.estimate:
+        try:
+            check_results_not_sampled()
+        except ValueError as error:
+            parser.error(str(error))
+    if args.sample is not None or args.estimate:
+        sample, estimators = run_sampled_analysis(Sample.load(SAMPLE_JSON) if args.estimate else None,
+                                                  args.sample, args.seed)
+        print(sample)
+        for name in args.counters or COUNTER_NAMES:
+            if name == 'endpoints':
+                for endpoint in ENDPOINTS:
+                    print(f'== endpoints: {endpoint} (estimated) ==\n{estimators[f"endpoint:{endpoint}"]}')
+            else:
+                print(f'== {name} (estimated) ==\n{estimators[name]}')
+        return
 
-    with open(POLICY_RESULTS_JSON, 'r') as policy_results_json:
-        results_dict = json.load(policy_results_json)
-        for data_domain in results_dict:
-            domain_rank, domain_cmp = domain_rank_cmp[data_domain]
-            if results_dict[data_domain]['set_policy']:
-                POLICY_COUNTER.incr_counters(domain_rank, domain_cmp, [results_dict[data_domain]['set_policy']])
+    run_analysis(args.incremental)
+    counters = get_counters()
+    for name in args.counters or COUNTER_NAMES:
+        if name == 'endpoints':
+            for endpoint, counter in counters[name].items():
+                print(f'== endpoints: {endpoint} ==\n{counter}')
+        else:
+            print(f'== {name} ==\n{counters[name]}')
+
+
+if __name__ == '__main__':
+    main()
@@ -8,7 +8,16 @@ def sort_dict(dictionary: dict):
 
 
 def get_top_10_from_dict(dictionary: dict):
-    return dict(list(sort_dict(dictionary).items())[-10:])
+    # Ties are ordered by item, so the output does not depend on the order in which items were first counted
+    sorted_items = sorted(dictionary.items(), key=lambda i: (i[1], i[0]))
+    return dict(sorted_items[-10:])
+
+
+def add_to_count(counts: defaultdict, item: str, amount: int):
+    """Adds amount to the count of item, removing the item when its count drops to 0."""
+    counts[item] += amount
+    if counts[item] == 0:
+        del counts[item]
 
 
 class AnalysisCounter:
@@ -59,24 +68,31 @@ class AnalysisCounter:
         return output_string
 
     def incr_counters(self, rank: int, cmp: str, items: List[str], total_counter=False):
+        self.__update_counters(rank, cmp, items, total_counter, 1)
+
+    def decr_counters(self, rank: int, cmp: str, items: List[str], total_counter=False):
+        """Undoes an incr_counters call with the same arguments."""
+        self.__update_counters(rank, cmp, items, total_counter, -1)
+
+    def __update_counters(self, rank: int, cmp: str, items: List[str], total_counter: bool, amount: int):
         if not total_counter and not items:
             return
 
-        self.total_entries += 1
+        self.total_entries += amount
         if cmp:
-            self.cmp_entries += 1
+            self.cmp_entries += amount
         else:
-            self.no_cmp_entries += 1
+            self.no_cmp_entries += amount
         for key in self.rank_buckets.keys():
             if self.rank_buckets[key](rank):
-                self.rank_entries[key] += 1
+                self.rank_entries[key] += amount
 
         for item in items:
-            self.total[item] += 1
+            add_to_count(self.total, item, amount)
             if cmp:
-                self.consent['cmp'][item] += 1
+                add_to_count(self.consent['cmp'], item, amount)
             else:
-                self.consent['no-cmp'][item] += 1
+                add_to_count(self.consent['no-cmp'], item, amount)
             for key in self.rank_buckets.keys():
                 if self.rank_buckets[key](rank):
-                    self.rank[key][item] += 1
+                    add_to_count(self.rank[key], item, amount)
@@ -0,0 +1,97 @@
+import json
+import pickle
+import sqlite3
+
+TAIL_SIZE = 256
+
+
+def read_tail(path: str, end: int, size: int = TAIL_SIZE):
+    """Get the (at most size) bytes of the file at path that come before offset end."""
+    with open(path, 'rb') as file:
+        start = max(end - size, 0)
+        file.seek(start)
+        return file.read(end - start)
+
+
+def is_appended_to(path: str, position: tuple):
+    """
+    Checks whether the file at path still starts with the part that was read before, i.e. it was only appended to.
+    :param position: tuple of the offset up to which the file was read and the bytes before it (see read_tail)
+    """
+    end, tail = position
+    try:
+        return read_tail(path, end, len(tail)) == tail
+    except FileNotFoundError:
+        return False
+
+
+class AnalysisState:
+    """
+    The state kept by an incremental analysis (see analysis.run_analysis) in an SQLite database: the counters, what
+    every site contributed to them and how far the results files were read. Sites are read and written one by one, so
+    updating the state only costs time for the sites that changed. Changes are saved when commit is called.
+    """
+    def __init__(self, path: str, signature: dict):
+        self.connection = sqlite3.connect(path)
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value BLOB NOT NULL)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS sites (domain TEXT PRIMARY KEY, '
+                                    'fingerprint TEXT NOT NULL, site BLOB NOT NULL)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS ranks (position INTEGER PRIMARY KEY, '
+                                    'rank INTEGER NOT NULL)')
+        if self.get('signature') != json.dumps(signature, sort_keys=True):
+            with self.connection:
+                for table in ['meta', 'sites', 'ranks']:
+                    self.connection.execute(f'DELETE FROM {table}')
+                self.put('signature', json.dumps(signature, sort_keys=True))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def get(self, name: str, default=None):
+        row = self.connection.execute('SELECT value FROM meta WHERE name = ?', (name,)).fetchone()
+        return pickle.loads(row[0]) if row is not None else default
+
+    def put(self, name: str, value):
+        self.connection.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', (name, pickle.dumps(value)))
+
+    def get_site(self, domain: str):
+        """Get the saved state of a site (see analysis.run_analysis), or None if it has none."""
+        row = self.connection.execute('SELECT site FROM sites WHERE domain = ?', (domain,)).fetchone()
+        return pickle.loads(row[0]) if row is not None else None
+
+    def put_site(self, domain: str, site: dict):
+        self.connection.execute('INSERT OR REPLACE INTO sites VALUES (?, ?, ?)',
+                                (domain, site['fingerprint'], pickle.dumps(site)))
+
+    def delete_site(self, domain: str):
+        self.connection.execute('DELETE FROM sites WHERE domain = ?', (domain,))
+
+    def iter_sites(self):
+        """Yields the domain and saved state of every site."""
+        for domain, site in self.connection.execute('SELECT domain, site FROM sites'):
+            yield domain, pickle.loads(site)
+
+    def get_fingerprints(self):
+        """Get the fingerprint of the rows of every site, without loading the rest of their state."""
+        return dict(self.connection.execute('SELECT domain, fingerprint FROM sites'))
+
+    def append_ranks(self, ranks: [int]):
+        self.connection.executemany('INSERT INTO ranks (rank) VALUES (?)', ((rank,) for rank in ranks))
+
+    def replace_ranks(self, ranks: [int]):
+        self.connection.execute('DELETE FROM ranks')
+        self.append_ranks(ranks)
+
+    def get_ranks(self):
+        """Get the rank of every row of the results CSV, in the order of the rows."""
+        return [rank for rank, in self.connection.execute('SELECT rank FROM ranks ORDER BY position')]
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
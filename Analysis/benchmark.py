@@ -0,0 +1,251 @@
+import argparse
+import bisect
+import csv
+import importlib
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import analysis
+import fileUtils
+from policyResults import PolicyResultsWriter
+
+REFERENCE_PATH = 'benchmark-reference.json'
+# Small enough for a quick check, see --sites for larger corpora
+SCALES = [1000, 10000]
+# Metrics that fail the benchmark when they grow by more than the threshold compared to the reference
+CHECKED_METRICS = ['wall_time_s', 'max_rss_mb', 'traced_peak_mb', 'traced_retained_mb']
+REGRESSION_THRESHOLD = 0.25
+
+# The most popular third parties: the endpoints analysed separately, then others seen on many sites.
+# Synthetic third parties follow them.
+COMMON_THIRD_PARTIES = analysis.ENDPOINTS + ['googletagmanager.com', 'facebook.net', 'googleapis.com', 'hotjar.com',
+                                             'cloudflare.com', 'jsdelivr.net']
+ORGANISATIONS = {'Google LLC': ['google-analytics.com', 'googletagmanager.com', 'doubleclick.net', 'google.com',
+                                'gstatic.com', 'googleapis.com', 'google.nl', 'googleadservices.com',
+                                'googlesyndication.com', 'googlevideo.com'],
+                 'Facebook, Inc.': ['facebook.net', 'facebook.com'],
+                 'Microsoft Corporation': ['bing.com', 'linkedin.com'],
+                 'Twitter, Inc.': ['twitter.com', 't.co']}
+SYNTHETIC_TLDS = ['com', 'net', 'io', 'nl', 'de', 'co.uk']
+SUBDOMAINS = ['www', 'cdn', 'static', 'api', 'px', 'fonts']
+PATHS = ['collect', 'j/collect', 'tr/', 'pagead/1p-user-list/{0}/', 'pagead/1p-conversion/{0}/', 's/roboto/v{0}/a.woff2',
+         'js/{0}.js', 'pixel', 'sync', 'i/{0}.png']
+CMPS = ['onetrust1', 'onetrust2', 'Cookiebot', 'quantcast', 'didomi', 'trustarc']
+CMP_SHARE = 0.15
+POLICIES = ['no-referrer-when-downgrade', 'strict-origin-when-cross-origin', 'same-origin', 'unsafe-url',
+            'strict-origin', 'origin-when-cross-origin', 'no-referrer, strict-origin-when-cross-origin']
+SET_POLICY_SHARE = 0.14
+# Popularity of the n-th third party is proportional to 1 / n^ZIPF_EXPONENT
+ZIPF_EXPONENT = 1.1
+
+
+class SyntheticCorpus:
+    """
+    Generates the results files of postProcessing for a synthetic corpus, with distributions resembling the crawl:
+    a median of about 45 third-party pages per site spread over a Zipf-distributed pool of third parties, a few
+    leaking endpoints per site, rare referrer leaks and a CMP on CMP_SHARE of the sites.
+    """
+    def __init__(self, nr_sites: int, seed: int = 0):
+        self.nr_sites = nr_sites
+        self.random = random.Random(seed)
+        nr_synthetic = max(1000, nr_sites // 10)
+        self.third_parties = COMMON_THIRD_PARTIES + [f'tp{i}.{SYNTHETIC_TLDS[i % len(SYNTHETIC_TLDS)]}'
+                                                     for i in range(nr_synthetic)]
+        self.cum_weights = list(itertools.accumulate(1 / (i + 1) ** ZIPF_EXPONENT
+                                                     for i in range(len(self.third_parties))))
+
+    def __choose_third_parties(self, count: int):
+        """Chooses count different third parties, popular ones being more likely."""
+        chosen = set()
+        total = self.cum_weights[-1]
+        while len(chosen) < count:
+            chosen.add(self.third_parties[bisect.bisect(self.cum_weights, self.random.random() * total)])
+        return list(chosen)
+
+    def __get_page(self, third_party: str):
+        path = self.random.choice(PATHS).format(self.random.randrange(1000))
+        return f'{self.random.choice(SUBDOMAINS)}.{third_party}/{path}'
+
+    def iter_sites(self):
+        """Yields the row of the results CSV and the policy results of every site."""
+        ranks = self.random.sample(range(max(2 * self.nr_sites, 100000)), self.nr_sites)
+        for i, rank in enumerate(ranks):
+            domain = f'site{i}.{SYNTHETIC_TLDS[i % len(SYNTHETIC_TLDS)]}'
+            cmp = self.random.choice(CMPS) if self.random.random() < CMP_SHARE else ''
+            nr_third_parties = min(len(self.third_parties), max(1, round(self.random.lognormvariate(2.6, 0.8))))
+            third_parties = self.__choose_third_parties(nr_third_parties)
+            pages = [self.__get_page(self.random.choice(third_parties))
+                     for _ in range(max(1, round(self.random.lognormvariate(3.8, 0.9))))]
+            leakage_endpoints = list({self.__get_page(self.random.choice(third_parties))
+                                      for _ in range(round(self.random.expovariate(1 / 6)))})
+            referrer_leaks = self.random.sample(third_parties, min(len(third_parties), self.random.randint(1, 5))) \
+                if self.random.random() < 0.05 else []
+            row = [domain, rank if self.random.random() > 0.05 else -1, cmp, leakage_endpoints, pages, referrer_leaks]
+            policy_results = {
+                'set_policy': self.random.choice(POLICIES) if self.random.random() < SET_POLICY_SHARE else '',
+                '1st_party_req': self.random.sample(POLICIES[:2], self.random.randint(1, 2)),
+                '3rd_party_req': {tp: [self.random.choice(POLICIES[:2])] for tp in third_parties},
+                '3rd_party_resp': {tp: [self.random.choice(POLICIES)] for tp in third_parties[:2]}}
+            yield row, policy_results
+
+    def get_domain_map(self):
+        """Get a domain map like TR_domain_map.json, in which most third parties belong to an organisation."""
+        domain_map = {}
+        for organisation, domains in ORGANISATIONS.items():
+            for domain in domains:
+                domain_map[domain] = {'entityName': organisation}
+        for i, domain in enumerate(self.third_parties):
+            if domain not in domain_map and i % 10 < 7:
+                domain_map[domain] = {'entityName': f'Organisation {i // 5}'}
+        return domain_map
+
+    def write(self, folder: str, stream_policy_results=False):
+        """
+        Writes the results CSV, the policy results (JSON, or JSON lines if stream_policy_results) and the domain map
+        to folder, under the names analysis.py reads them by.
+        :return: dict with the sizes of the written files in MB
+        """
+        results_path = os.path.join(folder, fileUtils.get_csv_results_file())
+        json_path = os.path.join(folder, fileUtils.get_policy_results_file())
+        jsonl_path = os.path.join(folder, fileUtils.get_policy_results_stream_file())
+        with open(results_path, 'w', newline='') as results_csv:
+            results_writer = csv.writer(results_csv)
+            if stream_policy_results:
+                with PolicyResultsWriter(jsonl_path, fsync_interval=sys.maxsize) as policy_output:
+                    for row, policy_results in self.iter_sites():
+                        results_writer.writerow(row)
+                        policy_output.write(row[0], policy_results)
+            else:
+                # Written one site at a time, as holding the policy results of a large corpus takes too much memory
+                with open(json_path, 'w') as policy_json:
+                    policy_json.write('{')
+                    for i, (row, policy_results) in enumerate(self.iter_sites()):
+                        results_writer.writerow(row)
+                        policy_json.write(f'{", " if i else ""}{json.dumps(row[0])}: {json.dumps(policy_results)}')
+                    policy_json.write('}')
+        with open(os.path.join(folder, fileUtils.DOMAIN_MAP_FILE), 'w', encoding='utf-8') as domain_map:
+            json.dump(self.get_domain_map(), domain_map)
+        policy_path = jsonl_path if stream_policy_results else json_path
+        return {'results_csv_mb': round(os.path.getsize(results_path) / 1024 / 1024, 1),
+                'policy_results_mb': round(os.path.getsize(policy_path) / 1024 / 1024, 1)}
+
+
+def run_benchmark(folder: str, trace_memory: bool):
+    """
+    Runs the analysis over the results files in folder and returns the measured statistics. Meant to run in a fresh
+    process (see run_benchmark_process), so max_rss_mb is the peak memory use of this analysis only.
+    """
+    working_directory = os.getcwd()
+    os.chdir(folder)
+    try:
+        # A fresh module, so the counters of a previous run are not reused
+        analysis_module = importlib.reload(analysis)
+        stage_times = defaultdict(float)
+        if trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        analysis_module.run_analysis(stage_times=stage_times)
+        wall_time = time.perf_counter() - start
+        stats = {'trace_memory': trace_memory,
+                 'wall_time_s': round(wall_time, 3),
+                 'sites_per_s': round(len(analysis_module.get_rank_list()) / wall_time, 1),
+                 'stage_time_s': {stage: round(seconds, 3) for stage, seconds in sorted(stage_times.items())},
+                 'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+        if trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            stats['traced_peak_mb'] = round(peak / 1024 / 1024, 1)
+            # Memory still held after the analysis, i.e. by the counters and lookups
+            stats['traced_retained_mb'] = round(current / 1024 / 1024, 1)
+            tracemalloc.stop()
+        return stats
+    finally:
+        os.chdir(working_directory)
+
+
+def run_benchmark_process(folder: str, trace_memory: bool):
+    """Runs run_benchmark in a new process, which does not inherit the memory of this one, and returns its result."""
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(run_benchmark, folder, trace_memory).result()
+
+
+def find_regressions(results: dict, reference: dict, threshold: float):
+    """
+    Compares the results of a benchmark run to the reference.
+    Times and the peak memory use are only compared when both runs traced memory or both did not, as tracing slows down
+    the analysis and takes memory itself.
+    :return: list of descriptions of the metrics that grew by more than threshold, as a fraction of the reference
+    """
+    regressions = []
+    for scale, stats in results.items():
+        scale_reference = reference.get(scale, {})
+        for metric in CHECKED_METRICS:
+            if (metric.endswith('_s') or metric == 'max_rss_mb') and \
+                    stats.get('trace_memory') != scale_reference.get('trace_memory'):
+                continue
+            reference_value = scale_reference.get(metric)
+            if metric in stats and reference_value and stats[metric] > reference_value * (1 + threshold):
+                regressions.append(f'{metric} at {scale} sites: {stats[metric]} (reference {reference_value})')
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark analysis.py on synthetic results of growing corpora.')
+    parser.add_argument('--sites', type=int, nargs='+', default=SCALES,
+                        help='numbers of sites of the synthetic corpora, e.g. 100000 1000000 to see how the analysis '
+                             'scales (1M sites takes over half an hour and several GB of disk and memory)')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic corpora')
+    parser.add_argument('--stream-policy-results', action='store_true',
+                        help='write the policy results as JSON lines (see postProcessing.py) instead of JSON')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='also measure the memory allocated by the analysis with tracemalloc, which slows it down '
+                             'about eight times')
+    parser.add_argument('--reference', default=REFERENCE_PATH, help='file with the statistics of an earlier run')
+    parser.add_argument('--write-reference', action='store_true',
+                        help='save the statistics of this run as reference instead of checking them')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                        help=f'fail when one of {", ".join(CHECKED_METRICS)} grows by more than this fraction '
+                             f'of the reference')
+    parser.add_argument('--output', help='save the benchmark statistics as JSON to this file')
+    args = parser.parse_args()
+
+    benchmark_results = {}
+    for nr_sites in args.sites:
+        with tempfile.TemporaryDirectory() as work_folder:
+            generate_start = time.perf_counter()
+            corpus = SyntheticCorpus(nr_sites, args.seed)
+            file_sizes = corpus.write(work_folder, args.stream_policy_results)
+            benchmark_stats = {'sites': nr_sites, 'generate_time_s': round(time.perf_counter() - generate_start, 3),
+                               **file_sizes}
+            benchmark_stats.update(run_benchmark_process(work_folder, args.trace_memory))
+        benchmark_results[str(nr_sites)] = benchmark_stats
+        print(json.dumps(benchmark_stats, indent=4), flush=True)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(benchmark_results, output, indent=4)
+
+    if args.write_reference:
+        with open(args.reference, 'w') as reference_file:
+            json.dump(benchmark_results, reference_file, indent=4)
+        print(f'Saved reference statistics to {args.reference}')
+    elif os.path.exists(args.reference):
+        with open(args.reference, 'r') as reference_file:
+            regressions = find_regressions(benchmark_results, json.load(reference_file), args.threshold)
+        if regressions:
+            print(f'Regressions of more than {args.threshold:.0%} compared to the reference:')
+            for regression in regressions:
+                print(f'\t{regression}')
+            sys.exit(1)
+        print(f'No regressions of more than {args.threshold:.0%} compared to the reference')
+    else:
+        print(f'No reference found at {args.reference}, run with --write-reference to create one')
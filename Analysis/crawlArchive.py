@@ -0,0 +1,122 @@
+import json
+import os
+import tarfile
+
+from crawlCatalog import get_file_kind
+
+
+class ArchiveSite:
+    """
+    A data-folder read from a crawl archive. All its files are kept in memory, and results saved to its admin-file are
+    only written to disk by write_admin.
+    """
+    def __init__(self, directory_name: str):
+        self.directory = directory_name
+        self.files = {}
+        self.admin_data = None
+
+    def __get_file_names(self, kind: str):
+        return [name for name in self.files if get_file_kind(name) == kind]
+
+    def get_data_files(self, first_party=True):
+        """Same as fileUtils.get_data_files, for the files in this data-folder."""
+        total_data_files = [os.path.join(self.directory, name) for name in self.__get_file_names('data')]
+        crawled_domain = self.__get_file_names('admin')[0][6:-5]
+        if first_party:
+            valid_data_files = [f for f in total_data_files if crawled_domain in os.path.basename(f)]
+        else:
+            valid_data_files = total_data_files
+        return {'total': total_data_files, 'valid': valid_data_files}
+
+    def load_data_file(self, file_path: str):
+        """Same as fileUtils.load_data_file, for the files in this data-folder."""
+        return json.loads(self.files[os.path.basename(file_path)])
+
+    def load_admin(self):
+        """Get the contents of the admin-file of this data-folder, including results saved to it."""
+        if self.admin_data is None:
+            self.admin_data = json.loads(self.files[self.__get_file_names('admin')[0]])
+        return self.admin_data
+
+    def save_data_to_admin(self, file_data):
+        """Same as fileUtils.save_data_to_admin, but only updates the admin-file in memory."""
+        admin_data = self.load_admin()
+        try:
+            admin_data['results'].append(file_data)
+        except KeyError:
+            admin_data['results'] = []
+            admin_data['results'].append(file_data)
+
+    def write_admin(self, data_path: str):
+        """
+        Writes the admin-file to the data-folder with the same name in data_path, if results were saved to it.
+        :return: None
+        """
+        if self.admin_data is None or 'results' not in self.admin_data:
+            return
+        directory_path = os.path.join(data_path, self.directory)
+        os.makedirs(directory_path, exist_ok=True)
+        with open(os.path.join(directory_path, self.__get_file_names('admin')[0]), 'w', encoding='utf-8') as admin:
+            json.dump(self.admin_data, admin, indent=4)
+
+
+def get_member_location(member_name: str):
+    """
+    Finds where a member of a crawl archive belongs.
+    :return: tuple of the name of its data-folder ('' for files in the crawl folder itself) and its file name
+    """
+    parts = [part for part in member_name.split('/') if part not in ('', '.')]
+    if len(parts) >= 2 and parts[-2].startswith('data.'):
+        return parts[-2], parts[-1]
+    return '', parts[-1] if parts else ''
+
+
+def read_archive_logs(archive_path: str, handle_log):
+    """
+    Passes the log files in the crawl folder of a tar, tar.gz or tar.xz archive to handle_log, in one sequential read.
+    :param archive_path: path to the archive
+    :param handle_log: function called with the lines of every log file
+    :return: None
+    """
+    handled_logs = set()
+    with tarfile.open(archive_path, 'r|*') as archive:
+        for member in archive:
+            if not member.isfile():
+                continue
+            directory, name = get_member_location(member.name)
+            if directory == '' and name.endswith('.log') and name not in handled_logs:
+                handled_logs.add(name)
+                handle_log(archive.extractfile(member).read().decode('utf-8').splitlines(keepends=True))
+
+
+def iter_archive_sites(archive_path: str, handle_log):
+    """
+    Streams the data-folders out of a tar, tar.gz or tar.xz archive of a crawl folder, without extracting anything to
+    disk. Only the data-folder that is being read is kept in memory.
+    As the log files in the crawl folder are needed to process the data-folders, and they can be stored anywhere in
+    the archive, they are first passed to handle_log in a separate read of the archive (see read_archive_logs).
+    :param archive_path: path to the archive
+    :param handle_log: function called with the lines of every log file
+    :return: generator of ArchiveSite objects, one per data-folder
+    """
+    read_archive_logs(archive_path, handle_log)
+    site = None
+    finished = set()
+    with tarfile.open(archive_path, 'r|*') as archive:
+        for member in archive:
+            if not member.isfile():
+                continue
+            directory, name = get_member_location(member.name)
+            if directory == '':
+                continue
+            if site is None or site.directory != directory:
+                if site is not None:
+                    finished.add(site.directory)
+                    yield site
+                if directory in finished:
+                    raise ValueError(f'Files of {directory} are spread over the archive, it cannot be streamed. '
+                                     f'Create the archive with tar, which stores every folder in one piece.')
+                site = ArchiveSite(directory)
+            site.files[name] = archive.extractfile(member).read()
+    if site is not None:
+        yield site
@@ -0,0 +1,141 @@
+import os
+import sqlite3
+
+from recordPack import PACK_FILE_NAME
+
+CATALOG_FILE = os.path.join('crawl-catalog.sqlite')
+# Seconds to wait for another process that is refreshing the catalog
+LOCK_TIMEOUT = 600
+
+
+def get_file_kind(name: str, top_level: bool = False):
+    """
+    Classifies a file of a crawl the same way the glob patterns in fileUtils did.
+    :param name: file name
+    :param top_level: True for files in the crawl folder itself, False for files in a data-folder
+    :return: one of 'admin', 'data', 'links', 'metadata', 'pack', 'log' or 'other'
+    """
+    if top_level:
+        return 'log' if name.endswith('.log') else 'other'
+    if name == PACK_FILE_NAME:
+        return 'pack'
+    if not name.endswith('.json'):
+        return 'other'
+    # The shortest names matching 'admin.*.json' and 'links.*.json' are 'admin..json' and 'links..json'
+    if name.startswith('admin.') and len(name) >= len('admin..json'):
+        return 'admin'
+    if name.startswith('links.') and len(name) >= len('links..json'):
+        return 'links'
+    if name.startswith(('admin', 'links', 'metadata')):
+        return 'metadata'
+    return 'data'
+
+
+class CrawlCatalog:
+    """
+    Index of the files in a crawl folder, kept in an SQLite database. For every data-folder it records the admin,
+    data, links and metadata files with their sizes and modification times, in the order os.scandir returned them.
+    refresh only rescans the data-folders that were added, removed or changed (i.e. had files added or removed) since
+    the last refresh, so one pass over the crawl folder replaces the globs that every accessor in fileUtils used to do.
+    Several processes can share the catalog: a refresh holds the write lock from before it reads the catalog, so
+    processes refreshing at the same time wait for each other instead of all rescanning the same data-folders.
+    """
+    def __init__(self, data_path: str, path: str = CATALOG_FILE):
+        self.data_path = os.path.normpath(data_path)
+        self.connection = sqlite3.connect(path, timeout=LOCK_TIMEOUT)
+        # Readers do not block the writer, nor the other way around
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS sites ('
+                                'data_path TEXT NOT NULL, directory TEXT NOT NULL, position INTEGER NOT NULL, '
+                                'mtime_ns INTEGER NOT NULL, admin_domain TEXT, '
+                                'PRIMARY KEY (data_path, directory)) WITHOUT ROWID')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS files ('
+                                'data_path TEXT NOT NULL, directory TEXT NOT NULL, name TEXT NOT NULL, '
+                                'position INTEGER NOT NULL, kind TEXT NOT NULL, size INTEGER NOT NULL, '
+                                'mtime_ns INTEGER NOT NULL, PRIMARY KEY (data_path, directory, name)) WITHOUT ROWID')
+
+    def __scan_directory(self, directory: str, entries):
+        """Replaces the catalog entries of one directory ('' for the crawl folder itself) with the given entries."""
+        rows = []
+        for position, entry in enumerate(entries):
+            if entry.name.startswith('.') or not entry.is_file():
+                continue
+            stat = entry.stat()
+            rows.append((self.data_path, directory, entry.name, position, get_file_kind(entry.name, directory == ''),
+                         stat.st_size, stat.st_mtime_ns))
+        self.connection.execute('DELETE FROM files WHERE data_path = ? AND directory = ?', (self.data_path, directory))
+        self.connection.executemany('INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+        return rows
+
+    def refresh(self, full: bool = False):
+        """
+        Brings the catalog up to date with the crawl folder.
+        :param full: if True, rescan every data-folder, to also pick up files that were changed in place
+        :return: number of data-folders that were rescanned
+        """
+        rescanned = 0
+        with self.connection:
+            self.connection.execute('BEGIN IMMEDIATE')
+            stored = {directory: (mtime_ns, position) for directory, mtime_ns, position in self.connection.execute(
+                'SELECT directory, mtime_ns, position FROM sites WHERE data_path = ?', (self.data_path,))}
+            top_level_entries = []
+            seen = set()
+            position = 0
+            for entry in os.scandir(self.data_path):
+                if not (entry.name.startswith('data.') and entry.is_dir()):
+                    top_level_entries.append(entry)
+                    continue
+                seen.add(entry.name)
+                mtime_ns = entry.stat().st_mtime_ns
+                stored_mtime_ns, stored_position = stored.get(entry.name, (None, None))
+                if full or stored_mtime_ns != mtime_ns:
+                    rows = self.__scan_directory(entry.name, os.scandir(entry.path))
+                    admin_files = [row[2] for row in rows if row[4] == 'admin']
+                    admin_domain = admin_files[0][6:-5] if admin_files else None
+                    self.connection.execute('INSERT OR REPLACE INTO sites VALUES (?, ?, ?, ?, ?)',
+                                            (self.data_path, entry.name, position, mtime_ns, admin_domain))
+                    rescanned += 1
+                elif stored_position != position:
+                    self.connection.execute('UPDATE sites SET position = ? WHERE data_path = ? AND directory = ?',
+                                            (position, self.data_path, entry.name))
+                position += 1
+            for directory in set(stored) - seen:
+                self.connection.execute('DELETE FROM sites WHERE data_path = ? AND directory = ?',
+                                        (self.data_path, directory))
+                self.connection.execute('DELETE FROM files WHERE data_path = ? AND directory = ?',
+                                        (self.data_path, directory))
+            self.__scan_directory('', top_level_entries)
+        return rescanned
+
+    def get_directories(self):
+        """Get a list of the names of all data-folders."""
+        return [row[0] for row in self.connection.execute(
+            'SELECT directory FROM sites WHERE data_path = ? ORDER BY position', (self.data_path,))]
+
+    def get_files(self, directory: str, kind: str):
+        """
+        Get the files of one kind (see get_file_kind) in a data-folder, or in the crawl folder itself if directory is ''.
+        :return: list of (name, size, mtime_ns) tuples
+        """
+        return self.connection.execute('SELECT name, size, mtime_ns FROM files WHERE data_path = ? AND directory = ? '
+                                       'AND kind = ? ORDER BY position', (self.data_path, directory, kind)).fetchall()
+
+    def get_admin_domain(self, directory: str):
+        """Get the domain in the name of the admin-file of a data-folder, or None if it has no admin-file."""
+        row = self.connection.execute('SELECT admin_domain FROM sites WHERE data_path = ? AND directory = ?',
+                                      (self.data_path, directory)).fetchone()
+        return row[0] if row else None
+
+    def close(self):
+        self.connection.close()
+
+
+if __name__ == '__main__':
+    import time
+    import fileUtils
+
+    start = time.perf_counter()
+    catalog = CrawlCatalog(fileUtils.get_data_path())
+    nr_rescanned = catalog.refresh(full=True)
+    print(f'Cataloged {nr_rescanned} data-folders in {time.perf_counter() - start:.2f}s')
+    catalog.close()
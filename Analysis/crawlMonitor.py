@@ -0,0 +1,286 @@
+import argparse
+import json
+import math
+import os
+import re
+import sys
+import time
+from collections import defaultdict, deque
+
+from tld import get_fld
+
+import fileUtils
+from workQueue import write_json_atomic
+
+POLL_INTERVAL = 10
+THROUGHPUT_WINDOW = 300
+# A page is a straggler when it has been processed for longer than this multiple of the p90 latency of all pages
+STRAGGLER_FACTOR = 3.0
+MIN_STRAGGLER_SECONDS = 60
+NR_REPORTED_SITES = 10
+
+RE_ANSI_ESCAPE = re.compile(r'\x1b\[[0-9;]*m')
+# Lines logged by crawlerConductor.js and crawl-cli.js, see tracker-radar-collector
+RE_PAGE_START = re.compile(r'Processing entry #\d+ \((.+)\)\.$')
+RE_PAGE_TIME = re.compile(r'Processing "([^"]+)" took ([0-9.]+)s\.')
+RE_PAGE_FAILED = re.compile(r'Max number of retries \(\d+\) exceeded for "([^"]+)"\.')
+RE_URLS_TO_CRAWL = re.compile(r'Number of urls to crawl: (\d+)')
+
+
+def get_site(url: str):
+    """Returns the first level domain of a URL, which crawl-cli uses to name the data-directory of a site."""
+    return get_fld(url, fail_silently=True) or url.split('//')[-1].split('/')[0]
+
+
+def get_percentile(sorted_values: [float], percentile: float):
+    """Get a percentile of a sorted list with the nearest-rank method, or None for an empty list."""
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, math.ceil(percentile / 100 * len(sorted_values)) - 1)]
+
+
+def get_latency_summary(latencies: [float]):
+    sorted_latencies = sorted(latencies)
+    return {'p50': get_percentile(sorted_latencies, 50),
+            'p90': get_percentile(sorted_latencies, 90),
+            'p99': get_percentile(sorted_latencies, 99),
+            'max': sorted_latencies[-1] if sorted_latencies else None}
+
+
+class LogTail:
+    """
+    Follows a growing log file. Every read continues at the offset where the previous read stopped, so no part of the
+    file is read twice. A line that is still being written is left for the next read. If the file shrinks, e.g.
+    because crawl-cli started a new run with the same log path, it is read from the start again.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.offset = 0
+
+    def read_lines(self):
+        """Get the lines that were completed since the previous call."""
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            return []
+        if size < self.offset:
+            self.offset = 0
+        if size == self.offset:
+            return []
+        with open(self.path, 'rb') as log:
+            log.seek(self.offset)
+            data = log.read(size - self.offset)
+        complete = data.rfind(b'\n') + 1
+        self.offset += complete
+        return data[:complete].decode('utf-8', errors='replace').splitlines()
+
+
+class SiteProgress:
+    def __init__(self):
+        self.visited = 0
+        self.tocrawl = 0
+        self.pages = 0
+        self.failed = 0
+        self.latencies = []
+        self.last_progress = None
+
+
+class CrawlMonitor:
+    """
+    Follows a running crawl through its crawl folder. Log files are tailed (see LogTail) for the start, duration and
+    failure of every page. Admin-files are only read again when their mtime changed, to follow the 'visited' and
+    'tocrawl' counts of every site. As the logs have no timestamps, events are timed at the poll that saw them;
+    events already in the logs when monitoring started are counted, but not in the throughput.
+    """
+    def __init__(self, data_path: str, window: float = THROUGHPUT_WINDOW, straggler_factor: float = STRAGGLER_FACTOR):
+        self.data_path = data_path
+        self.window = window
+        self.straggler_factor = straggler_factor
+        self.started = time.time()
+        self.polls = 0
+        self.data_path_mtime = None
+        self.site_dirs = []
+        self.admin_mtimes = {}
+        self.log_tails = {}
+        self.sites = defaultdict(SiteProgress)
+        self.latencies = []
+        self.in_progress = {}
+        self.urls_to_crawl = 0
+        self.page_times = deque()
+        self.visit_times = deque()
+
+    def __scan_data_path(self):
+        """Lists the data-folders and log files again, only if a file was added to or removed from the crawl folder."""
+        mtime = os.stat(self.data_path).st_mtime_ns
+        if mtime == self.data_path_mtime:
+            return
+        self.data_path_mtime = mtime
+        site_dirs = []
+        for entry in os.scandir(self.data_path):
+            if entry.name.startswith('data.') and entry.is_dir():
+                site_dirs.append(entry.name)
+            elif entry.name.endswith('.log') and entry.path not in self.log_tails:
+                self.log_tails[entry.path] = LogTail(entry.path)
+        self.site_dirs = sorted(site_dirs)
+
+    def __read_logs(self, now: float, backlog: bool):
+        for log_tail in self.log_tails.values():
+            for line in log_tail.read_lines():
+                self.__handle_log_line(RE_ANSI_ESCAPE.sub('', line).strip(), now, backlog)
+
+    def __handle_log_line(self, line: str, now: float, backlog: bool):
+        match = RE_PAGE_TIME.search(line)
+        if match:
+            url, seconds = match.group(1), float(match.group(2))
+            site = self.sites[get_site(url)]
+            site.pages += 1
+            site.latencies.append(seconds)
+            site.last_progress = now
+            self.latencies.append(seconds)
+            self.in_progress.pop(url, None)
+            if not backlog:
+                self.page_times.append(now)
+            return
+        match = RE_PAGE_START.search(line)
+        if match:
+            self.in_progress[match.group(1)] = now
+            return
+        match = RE_PAGE_FAILED.search(line)
+        if match:
+            self.sites[get_site(match.group(1))].failed += 1
+            self.in_progress.pop(match.group(1), None)
+            return
+        match = RE_URLS_TO_CRAWL.search(line)
+        if match:
+            self.urls_to_crawl += int(match.group(1))
+
+    def __read_admin_files(self, now: float, backlog: bool):
+        for directory in self.site_dirs:
+            directory_path = os.path.join(self.data_path, directory)
+            admin_path = os.path.join(directory_path, f'admin.{directory[5:]}.json')
+            try:
+                mtime = os.stat(admin_path).st_mtime_ns
+            except FileNotFoundError:
+                continue
+            if self.admin_mtimes.get(admin_path) == mtime:
+                continue
+            try:
+                with open(admin_path, 'r', encoding='utf-8') as admin:
+                    admin_data = json.load(admin)
+            except json.JSONDecodeError:
+                continue  # Being written by the crawler, read it at the next poll
+            self.admin_mtimes[admin_path] = mtime
+            site = self.sites[directory[5:]]
+            newly_visited = len(admin_data.get('visited', {})) - site.visited
+            site.visited += newly_visited
+            site.tocrawl = len(admin_data.get('tocrawl', {}))
+            if newly_visited > 0 and not backlog:
+                site.last_progress = now
+                self.visit_times.extend([now] * newly_visited)
+
+    def poll(self):
+        """Reads what was added to the logs and admin-files since the previous poll."""
+        now = time.time()
+        backlog = self.polls == 0
+        self.__scan_data_path()
+        self.__read_logs(now, backlog)
+        self.__read_admin_files(now, backlog)
+        self.polls += 1
+        for times in (self.page_times, self.visit_times):
+            while times and times[0] < now - self.window:
+                times.popleft()
+
+    def get_metrics(self):
+        """Get a JSON serialisable dict with the throughput, latencies, progress per site and stragglers."""
+        now = time.time()
+        window = min(self.window, max(now - self.started, 1))
+        latency = get_latency_summary(self.latencies)
+        straggler_seconds = max(MIN_STRAGGLER_SECONDS, self.straggler_factor * (latency['p90'] or 0))
+        stragglers = sorted(({'site': get_site(url), 'url': url, 'running': round(now - start, 1)}
+                             for url, start in self.in_progress.items() if now - start > straggler_seconds),
+                            key=lambda s: s['running'], reverse=True)
+        per_site = {name: {'visited': site.visited, 'tocrawl': site.tocrawl, 'pages': site.pages,
+                           'failed': site.failed, 'latency': get_latency_summary(site.latencies),
+                           'seconds_since_progress': None if site.last_progress is None
+                           else round(now - site.last_progress, 1)}
+                    for name, site in sorted(self.sites.items())}
+        return {'time': now,
+                'monitoring_seconds': round(now - self.started, 1),
+                'throughput_window': window,
+                'pages_per_minute': len(self.page_times) / window * 60,
+                'visited_per_minute': len(self.visit_times) / window * 60,
+                'urls_to_crawl': self.urls_to_crawl,
+                'pages': len(self.latencies),
+                'failed': sum(site.failed for site in self.sites.values()),
+                'in_progress': len(self.in_progress),
+                'visited': sum(site.visited for site in self.sites.values()),
+                'tocrawl': sum(site.tocrawl for site in self.sites.values()),
+                'latency': latency,
+                'straggler_seconds': straggler_seconds,
+                'stragglers': stragglers,
+                'sites': per_site}
+
+
+def format_metrics(metrics: dict):
+    """Format metrics of CrawlMonitor.get_metrics as a terminal report."""
+    def seconds(value):
+        return '-' if value is None else f'{value:.1f}s'
+
+    latency = metrics['latency']
+    output_string = f'Monitoring for {metrics["monitoring_seconds"]:.0f}s, ' \
+                    f'throughput over the last {metrics["throughput_window"]:.0f}s\n' \
+                    f'Pages/min: {metrics["pages_per_minute"]:.1f} (logs), ' \
+                    f'{metrics["visited_per_minute"]:.1f} (admin-files)\n' \
+                    f'Pages done: {metrics["pages"]}/{metrics["urls_to_crawl"]}, failed: {metrics["failed"]}, ' \
+                    f'in progress: {metrics["in_progress"]}\n' \
+                    f'Sites: {len(metrics["sites"])}, visited: {metrics["visited"]}, tocrawl: {metrics["tocrawl"]}\n' \
+                    f'Latency: p50 {seconds(latency["p50"])}, p90 {seconds(latency["p90"])}, ' \
+                    f'p99 {seconds(latency["p99"])}, max {seconds(latency["max"])}\n'
+
+    slowest_sites = sorted(((name, site) for name, site in metrics['sites'].items() if site['latency']['p90']),
+                           key=lambda item: item[1]['latency']['p90'], reverse=True)[:NR_REPORTED_SITES]
+    output_string += '\nSlowest sites (p90 latency):\n'
+    for name, site in slowest_sites:
+        output_string += f'\t{name}: p50 {seconds(site["latency"]["p50"])}, p90 {seconds(site["latency"]["p90"])}, ' \
+                         f'{site["pages"]} pages, {site["failed"]} failed, {site["visited"]} visited\n'
+
+    output_string += f'\nStragglers (running over {metrics["straggler_seconds"]:.0f}s):\n'
+    for straggler in metrics['stragglers'][:NR_REPORTED_SITES]:
+        output_string += f'\t{straggler["url"]}: {straggler["running"]:.0f}s\n'
+    if len(metrics['stragglers']) > NR_REPORTED_SITES:
+        output_string += f'\t... and {len(metrics["stragglers"]) - NR_REPORTED_SITES} more\n'
+    return output_string
+
+
+def main(argv: [str] = None):
+    parser = argparse.ArgumentParser(description='Monitor the throughput of a running crawl.')
+    parser.add_argument('--data-path', default=fileUtils.get_data_path(), help='crawl folder to monitor')
+    parser.add_argument('--interval', type=float, default=POLL_INTERVAL, help='seconds between polls')
+    parser.add_argument('--window', type=float, default=THROUGHPUT_WINDOW,
+                        help='seconds over which the throughput is measured')
+    parser.add_argument('--straggler-factor', type=float, default=STRAGGLER_FACTOR,
+                        help='pages running longer than this multiple of the p90 latency are stragglers')
+    parser.add_argument('--json', help='write the metrics to this JSON file instead of the terminal')
+    parser.add_argument('--once', action='store_true', help='poll once and report the totals, without throughput')
+    args = parser.parse_args(argv)
+
+    monitor = CrawlMonitor(args.data_path, args.window, args.straggler_factor)
+    try:
+        while True:
+            monitor.poll()
+            metrics = monitor.get_metrics()
+            if args.json:
+                write_json_atomic(args.json, metrics)
+            else:
+                if sys.stdout.isatty() and not args.once:
+                    print('\x1b[2J\x1b[H', end='')  # Clear the terminal
+                print(format_metrics(metrics), flush=True)
+            if args.once:
+                return
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
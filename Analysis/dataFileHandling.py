@@ -2,8 +2,6 @@ import urllib.parse as parse
 
 from tld import get_fld
 
-import hashlib
-import base64
 import re
 
 
@@ -39,15 +37,22 @@ def __unpack_request_response_policy(request_data: dict):
         return ''
 
 
-def __is_request_url_third_party(page_url: str, alternate_page_url: str, request_url: str):
-    """Given a request url, check whether it requests a resource of a third party relative to (alternate_)page_url"""
+def __get_flds(urls: [str]):
+    """Given a list of urls, return the set of their first level domains, or None if one of them has none."""
+    try:
+        return {get_fld(url, fix_protocol=True) for url in urls}
+    except Exception:
+        return None
+
+
+def __is_request_url_third_party(page_flds: set, request_url: str):
+    """Given a request url, check whether it requests a resource of a third party relative to page_flds"""
+    if page_flds is None:
+        return False
     if request_url.startswith('blob:'):
         request_url = request_url[5:]
     try:
-        request_fld = get_fld(request_url, fix_protocol=True)
-        if request_fld in [get_fld(page_url, fix_protocol=True), get_fld(alternate_page_url, fix_protocol=True)]:
-            return False
-        return True
+        return get_fld(request_url, fix_protocol=True) not in page_flds
     except Exception:
         return False
 
@@ -65,13 +70,12 @@ def __encode_search_dict(to_search: dict[str, str], encoding, encoding_name: str
     return dict(zip(keys, values))
 
 
-def __check_url_in_url(source: str, alternate_source: str, target: str):
+def __get_url_search_items(source: str, alternate_source: str):
     """
-    Searches a target URL for occurrences of (parts of) the source URL in several encodings.
+    Get the (parts of) the source URL to search for in other URLs, in several encodings.
     :param source: URL that needs to be searched for
     :param alternate_source: Alternate version of URL that needs to be searched for (in case of redirect)
-    :param target: URL that needs to be searched through
-    :return: True if (a part of) the source or alternate URL is found, False otherwise
+    :return: list of tuples of the name of the part and encoding, and the string to search for, in search order
     """
     inp = {'source': source, 'alternate': alternate_source}
     path, path_present, schemeless, fragmentless = ({},) * 4
@@ -96,41 +100,48 @@ def __check_url_in_url(source: str, alternate_source: str, target: str):
     search_dict.update(to_search_dict)
     encodings.append(to_search_dict)
     encodings.append(__encode_search_dict(to_search_dict, lambda a: parse.quote(a, safe=''), 'percent'))
-    encodings.append(__encode_search_dict(to_search_dict, lambda a: hashlib.md5(a.encode('utf-8')), 'md5'))
-    encodings.append(__encode_search_dict(to_search_dict, lambda a: hashlib.sha1(a.encode('utf-8')), 'sha1'))
-    encodings.append(
-        __encode_search_dict(to_search_dict, lambda a: base64.urlsafe_b64encode(bytes(a, 'utf-8')), 'base64'))
+    # The md5, sha1 and base64 encodings were compared as str() of hash objects and bytes (e.g. "b'...'"), which never
+    # occurs in a URL, so are left out
 
     for dictionary in encodings:
         search_dict.update(dictionary)
 
+    search_items = []
     for x in search_dict.keys():
         if x.startswith('source_path') and not path_present['source']:
             continue
         if x.startswith('redirected_path') and not path_present['alternate']:
             continue
-        if str(search_dict[x]) in target:
+        search_items.append((x, str(search_dict[x])))
+    return search_items
+
+
+def __check_url_in_url(search_items: list, target: str):
+    """
+    Searches a target URL for occurrences of (parts of) the source URL in several encodings.
+    :param search_items: parts of the source URL to search for, see __get_url_search_items
+    :param target: URL that needs to be searched through
+    :return: name of the part and encoding of the first part found, '' if no part is found
+    """
+    for x, value in search_items:
+        if value in target:
             return x
     return ''
 
 
-def __check_url_leakage(leaked_url: str, alternate_leaked_url: str, target_url: str):
+def __check_url_leakage(page_context, target_url: str):
     """
-    Check whether (part of) a given URL is leaked in the target URL
-    :param leaked_url: URL which is potentially (partially) leaked
-    :param alternate_leaked_url: Alternate URL which is potentially (partially) leaked
-    :param target_url: URL in which (part of) leaked_url could be found
+    Check whether (part of) the URL of a page is leaked in the target URL
+    :param page_context: PageContext of the page whose URL is potentially (partially) leaked
+    :param target_url: URL in which (part of) the page URL could be found
     :return: None if no leakage is found. Dict containing target url, part found and encoding used if leakage is found
     """
-    crawled_domain = parse.urlsplit(leaked_url).netloc
-    redirected_domain = parse.urlsplit(alternate_leaked_url).netloc
-
     # If the current request is to a 1st party domain, skip it
-    if not __is_request_url_third_party(crawled_domain, redirected_domain, target_url):
+    if not __is_request_url_third_party(page_context.netloc_flds, target_url):
         return None
 
     # Check if (parts of) the crawled url appear in the request url
-    check = __check_url_in_url(leaked_url, alternate_leaked_url, target_url)
+    check = __check_url_in_url(page_context.search_items, target_url)
     if check != '':
         try:
             encoding = check.split('-')[1]
@@ -143,27 +154,35 @@ def __check_url_leakage(leaked_url: str, alternate_leaked_url: str, target_url:
     return None
 
 
-def __referrer_leakage_occurs(leaked_url: str, alternate_leaked_url: str, referrer: str):
+def __get_referrer_leakage_forms(leaked_url: str, alternate_leaked_url: str):
     """
-    Determine whether one of two given URLs is leaked in a given referrer. That is, determine whether more than just
-    the domain names of the leaked URLs is present in the referrer.
+    Get the forms of two URLs that, when present in a referrer, mean more than just their domain names is leaked.
     :param leaked_url: URL which is potentially (partially) leaked
     :param alternate_leaked_url: Alternate URL which is potentially (partially) leaked
-    :param referrer: referrer string in which (part of) a leaked url could be found
-    :return: Boolean stating whether a referrer leakage has occurred.
+    :return: list of strings to search for in referrers
     """
     leaked_has_path = not parse.urlsplit(leaked_url).path in ['', '/']
     alternate_has_path = not parse.urlsplit(alternate_leaked_url).path in ['', '/']
     trimmed_leaked = parse.urlunsplit(parse.urlsplit(leaked_url)._replace(scheme='', fragment='', query=''))
     trimmed_alt = parse.urlunsplit(parse.urlsplit(alternate_leaked_url)._replace(scheme='', fragment='', query=''))
 
+    forms = []
     if leaked_has_path:
-        if leaked_url in referrer or trimmed_leaked in referrer:
-            return True
+        forms += [leaked_url, trimmed_leaked]
     if alternate_has_path:
-        if alternate_leaked_url in referrer or trimmed_alt in referrer:
-            return True
-    return False
+        forms += [alternate_leaked_url, trimmed_alt]
+    return forms
+
+
+def __referrer_leakage_occurs(page_context, referrer: str):
+    """
+    Determine whether the URL of a page is leaked in a given referrer. That is, determine whether more than just
+    the domain name of the page URL is present in the referrer.
+    :param page_context: PageContext of the page whose URL is potentially (partially) leaked
+    :param referrer: referrer string in which (part of) the page URL could be found
+    :return: Boolean stating whether a referrer leakage has occurred.
+    """
+    return any(form in referrer for form in page_context.referrer_leakage_forms)
 
 
 def get_leakage_endpoints(leakage_list):
@@ -189,32 +208,65 @@ def set_file_output_redirected_url(file_output, crawled_url, final_url):
     return file_output
 
 
-def get_request_info(request_data: dict, file_results: dict, request_source: str, alt_request_source: str):
+class PageContext:
+    """
+    All forms of the URL of a crawled page that get_request_info needs, derived once per page with get_page_context so
+    that processing a request only depends on the request URL.
+    """
+    def __init__(self, source: str, alternate_source: str, policy_urls: [str], flds: set, netloc_flds: set,
+                 search_items: list, referrer_leakage_forms: [str]):
+        self.source = source
+        self.alternate_source = alternate_source
+        self.policy_urls = policy_urls
+        self.flds = flds
+        self.netloc_flds = netloc_flds
+        self.search_items = search_items
+        self.referrer_leakage_forms = referrer_leakage_forms
+
+
+def get_page_context(request_source: str, alt_request_source: str):
+    """
+    Derives the PageContext of a crawled page.
+    :param request_source: url from which the requests were made
+    :param alt_request_source: alternate (possibly redirected) url from which the requests were made
+    :return: PageContext
+    """
+    request_source = request_source.strip('/')
+    alt_request_source = alt_request_source.strip('/')
+    return PageContext(
+        source=request_source,
+        alternate_source=alt_request_source,
+        # Request urls on which a referrer policy response header sets the policy of the page
+        policy_urls=[request_source, __strip_fragment(request_source), alt_request_source,
+                     __strip_fragment(alt_request_source)],
+        flds=__get_flds([request_source, alt_request_source]),
+        netloc_flds=__get_flds([parse.urlsplit(request_source).netloc, parse.urlsplit(alt_request_source).netloc]),
+        search_items=__get_url_search_items(request_source, alt_request_source),
+        referrer_leakage_forms=__get_referrer_leakage_forms(request_source, alt_request_source))
+
+
+def get_request_info(request_data: dict, file_results: dict, page_context: PageContext):
     """
     Takes a captured HTTP request as dictionary and adds inferred data to the file_results dictionary.
-    Sets 'referrer-policy' field if this request is made to (alt_)request_source and has a response-header policy
-    Adds request to 'request-leakage' list if this request leaked info on the (alt_)request_source
+    Sets 'referrer-policy' field if this request is made to the page and has a response-header policy
+    Adds request to 'request-leakage' list if this request leaked info on the page url
     :param request_data: dictionary containing the data of the request
     :param file_results: dictionary to which data about the request must be saved
-    :param request_source: url from which the request was made
-    :param alt_request_source: alternate (possibly redirected) url from which the request was made
+    :param page_context: PageContext of the page from which the request was made, see get_page_context
     :return:
     """
     request_url = request_data['url'].strip('/')
-    request_source = request_source.strip('/')
-    alt_request_source = alt_request_source.strip('/')
 
     request_ref_policy = request_data['referrerPolicy']
     response_ref_policy = __unpack_request_response_policy(request_data)
 
     # Check whether a referrer policy was set on this page through http, if so, save result.
-    if request_url in [request_source, __strip_fragment(request_source), alt_request_source,
-                       __strip_fragment(alt_request_source)]:
+    if request_url in page_context.policy_urls:
         if response_ref_policy:
             file_results['referrer-policy'] = response_ref_policy
 
     # If the current request is to a third party, save to results.
-    if __is_request_url_third_party(request_source, alt_request_source, request_url):
+    if __is_request_url_third_party(page_context.flds, request_url):
         if request_url.startswith('blob:'):
             request_url = request_url[5:]
         try:
@@ -232,7 +284,7 @@ def get_request_info(request_data: dict, file_results: dict, request_source: str
             third_party_domain = get_fld(third_party_page, fix_protocol=True)
             if 'referer' in request_data:
                 if third_party_domain not in file_results['referrer_leakage'] and \
-                        __referrer_leakage_occurs(request_source, alt_request_source, request_data['referer']):
+                        __referrer_leakage_occurs(page_context, request_data['referer']):
                     file_results['referrer_leakage'].append(third_party_domain)
 
         # Save request policy to list of request policies used by this third party
@@ -245,10 +297,10 @@ def get_request_info(request_data: dict, file_results: dict, request_source: str
         file_results['req_pol_1stparty'].add(request_ref_policy)
 
     # Check if (part of) the page URL is present in the request URL (and request URL is to a third party)
-    leakage_result = __check_url_leakage(request_source, alt_request_source, request_data['url'])
+    leakage_result = __check_url_leakage(page_context, request_data['url'])
     # If we also have a referrer that does not contain the full URL (i.e., it is trimmed), save result as a leakage
     if 'referer' in request_data:
-        if leakage_result and not __referrer_leakage_occurs(request_source, alt_request_source, request_data['referer']):
+        if leakage_result and not __referrer_leakage_occurs(page_context, request_data['referer']):
             file_results['request-leakage'].append(leakage_result)
 
     return file_results
@@ -3,12 +3,22 @@ import os
 import json
 import csv
 
+from crawlCatalog import CrawlCatalog
+from recordPack import RecordPack, get_pack_path
+
 DATA_PATH = os.path.join('Corpus-crawl')
 CSV_RESULTS_FILE = os.path.join('results.csv')
 JSON_POLICY_RESULTS_FILE = os.path.join('policy_results.json')
+JSONL_POLICY_RESULTS_FILE = os.path.join('policy_results.jsonl')
+SAMPLE_FILE = os.path.join('sample.json')
 TRANCO_LIST_FILE = os.path.join('Tranco-P99J-202107.csv')
 DOMAIN_MAP_FILE = os.path.join('TR_domain_map.json')
 
+__catalog = None
+__open_pack = None
+# Path of the data-folder that was last found to have no pack file, see find_pack
+__unpacked_directory = None
+
 
 def get_data_path():
     return DATA_PATH
@@ -22,6 +32,14 @@ def get_policy_results_file():
     return JSON_POLICY_RESULTS_FILE
 
 
+def get_policy_results_stream_file():
+    return JSONL_POLICY_RESULTS_FILE
+
+
+def get_sample_file():
+    return SAMPLE_FILE
+
+
 def get_tranco_ranking():
     with open(TRANCO_LIST_FILE, 'r') as tranco:
         output = []
@@ -30,6 +48,17 @@ def get_tranco_ranking():
         return output
 
 
+def get_tranco_rank_index():
+    """
+    Get a dict with key=domain, value=position of the domain in the Tranco list (starting at 0), so ranks can be
+    looked up without searching the list. If a domain occurs more than once, its first position is kept.
+    """
+    rank_index = {}
+    for position, domain in enumerate(get_tranco_ranking()):
+        rank_index.setdefault(domain, position)
+    return rank_index
+
+
 def get_corpus():
     corpus_path = glob.glob('Corpus')[0]
     with open(corpus_path, 'r') as corpus:
@@ -41,30 +70,56 @@ def get_domain_map_file():
         return json.load(domains)
 
 
+def get_catalog():
+    """
+    Get the catalog of the files in the crawl folder (see crawlCatalog.py). It is refreshed the first time it is used
+    in a run, after which all accessors below are answered from it without touching the file system.
+    """
+    global __catalog
+    if __catalog is None:
+        __catalog = CrawlCatalog(DATA_PATH)
+        __catalog.refresh()
+    return __catalog
+
+
+def close_catalog():
+    """Closes the catalog, e.g. before forking processes, which should each open their own connection."""
+    global __catalog, __unpacked_directory
+    if __catalog is not None:
+        __catalog.close()
+        __catalog = None
+    __unpacked_directory = None
+
+
 def get_data_dirs():
     """
     Get a list of 'data.*' folders located in the folder pointed to by data_path
     """
-    return [x for x in os.listdir(DATA_PATH) if x.startswith('data.')]
+    return get_catalog().get_directories()
 
 
-def get_data_files(directory_name: str, first_party=True):
+def get_data_files(directory_name: str, first_party=True, include_packed=True):
     """
     Get a dict with total list and valid list of files containing crawled data in the data-folder named directory_name
     :param directory_name: name of the folder in which the data files should be found
     :param first_party: if True, data files with a differing domain in the filename from the folder get filtered out.
+    :param include_packed: if True, files stored in the folder's pack file (see recordPack.py) are included. Their
+    paths are the paths they had before they were packed, and can be read with load_data_file.
     :return: dict with 2 entries: 'total' being a list of all data files, 'valid' containing the same list if
     first_party is False, or a filtered version of 'total' if first_party is True.
     """
     directory_path = os.path.join(DATA_PATH, directory_name)
 
-    total_data_files = [x for x in glob.glob(os.path.join(directory_path, '*.json')) if
-                        not (x.startswith(os.path.join(directory_path, 'links'))
-                        or x.startswith(os.path.join(directory_path, 'admin'))
-                        or x.startswith(os.path.join(directory_path, 'metadata')))]
+    catalog = get_catalog()
+    total_data_files = [os.path.join(directory_path, name) for name, _, _ in catalog.get_files(directory_name, 'data')]
+    if include_packed and catalog.get_files(directory_name, 'pack'):
+        loose_files = set(total_data_files)
+        total_data_files += [x for x in (os.path.join(directory_path, name) for name in get_pack(directory_path).names())
+                             if x not in loose_files]
 
-    admin_file = os.path.basename(get_admin_file(os.path.basename(directory_path)))
-    crawled_domain = admin_file[6:-5]
+    crawled_domain = catalog.get_admin_domain(directory_name)
+    if crawled_domain is None:
+        raise IndexError(f'No admin-file found in {directory_path}')
     if first_party:
         valid_data_files = [f for f in total_data_files if crawled_domain in os.path.basename(f)]
     else:
@@ -72,19 +127,62 @@ def get_data_files(directory_name: str, first_party=True):
     return {'total': total_data_files, 'valid': valid_data_files}
 
 
+def get_pack(directory_path: str):
+    """
+    Get the opened pack file of the data-folder at directory_path. Only the pack of the folder that was asked for last
+    is kept open, as data-folders are processed one at a time.
+    """
+    global __open_pack
+    if __open_pack is None or __open_pack.path != get_pack_path(directory_path):
+        if __open_pack is not None:
+            __open_pack.close()
+        __open_pack = RecordPack(get_pack_path(directory_path))
+    return __open_pack
+
+
+def find_pack(directory_path: str):
+    """
+    Get the opened pack file of the data-folder at directory_path like get_pack, or None if it has no pack file.
+    Whether it has one is looked up in the catalog once for every folder, not for every data file.
+    """
+    global __unpacked_directory
+    if __open_pack is not None and __open_pack.path == get_pack_path(directory_path):
+        return __open_pack
+    if __unpacked_directory == directory_path:
+        return None
+    if not get_catalog().get_files(os.path.relpath(directory_path, DATA_PATH), 'pack'):
+        __unpacked_directory = directory_path
+        return None
+    return get_pack(directory_path)
+
+
+def load_data_file(file_path: str):
+    """
+    Load the crawled data in a data file, which is either a record in the pack file of its folder or a file on disk.
+    :param file_path: path of the data file, as returned by get_data_files
+    :return: the parsed JSON data
+    """
+    directory_path, name = os.path.split(file_path)
+    pack = find_pack(directory_path)
+    if pack is not None and name in pack:
+        return pack.load_json(name)
+    with open(file_path, 'r', encoding='utf-8') as data_file:
+        return json.load(data_file)
+
+
 def get_links_files(directory_name: str):
     """
     Get a list of links. files containing scraped links, in the data-folder with name directory_name
     """
     directory_path = os.path.join(DATA_PATH, directory_name)
-    return glob.glob(os.path.join(directory_path, 'links.*.json'))
+    return [os.path.join(directory_path, name) for name, _, _ in get_catalog().get_files(directory_name, 'links')]
 
 
 def get_log_files():
     """
     Get a list of log files in the main crawl-data folder
     """
-    return glob.glob(os.path.join(DATA_PATH, '*.log'))
+    return [os.path.join(DATA_PATH, name) for name, _, _ in get_catalog().get_files('', 'log')]
 
 
 def get_admin_file(directory_name: str):
@@ -92,7 +190,7 @@ def get_admin_file(directory_name: str):
     Get the 'admin.*' file located in the data-folder with name directory_name
     """
     directory_path = os.path.join(DATA_PATH, directory_name)
-    return glob.glob(os.path.join(directory_path, 'admin.*.json'))[0]
+    return os.path.join(directory_path, get_catalog().get_files(directory_name, 'admin')[0][0])
 
 
 def save_data_to_admin(file_data, admin_directory):
@@ -113,3 +211,68 @@ def save_data_to_admin(file_data, admin_directory):
         admin.seek(0)
         json.dump(admin_data, admin, indent=4)
         admin.truncate()
+
+
+class CrawlSite:
+    """
+    A data-folder in the crawl folder on disk. postProcessing reads sites through this interface, which
+    crawlArchive.ArchiveSite also implements for data-folders inside an archive.
+    """
+    def __init__(self, directory_name: str):
+        self.directory = directory_name
+
+    def get_data_files(self):
+        """See get_data_files."""
+        return get_data_files(self.directory)
+
+    def load_data_file(self, file_path: str):
+        """See load_data_file."""
+        return load_data_file(file_path)
+
+    def load_admin(self):
+        """Get the contents of the admin-file of this data-folder."""
+        with open(get_admin_file(self.directory), 'r', encoding='utf-8') as admin:
+            return json.load(admin)
+
+    def save_data_to_admin(self, file_data):
+        """See save_data_to_admin."""
+        save_data_to_admin(file_data, self.directory)
+
+
+class BufferedCrawlSite(CrawlSite):
+    """
+    A CrawlSite that keeps the results saved to its admin-file in memory, until they are all written at once by
+    write_admin. Used by postProcessing workers, so an interrupted worker never leaves half of a site's results behind
+    in its admin-file.
+    """
+    def __init__(self, directory_name: str):
+        super().__init__(directory_name)
+        self.results = []
+
+    def save_data_to_admin(self, file_data):
+        self.results.append(file_data)
+
+    def get_nr_admin_results(self):
+        """Get the number of results that are already in the admin-file."""
+        return len(self.load_admin().get('results', []))
+
+    def write_admin(self, keep_results: int = None):
+        """
+        Adds the saved results to the admin-file.
+        :param keep_results: if given, only the first keep_results results already in the admin-file are kept, which
+        removes the results written by an earlier attempt at processing this site
+        :return: None
+        """
+        with open(get_admin_file(self.directory), 'r+', encoding='utf-8') as admin:
+            admin_data = json.load(admin)
+            changed = bool(self.results)
+            if keep_results is not None and len(admin_data.get('results', [])) > keep_results:
+                admin_data['results'] = admin_data['results'][:keep_results]
+                changed = True
+            if not changed:
+                return
+            if self.results:
+                admin_data.setdefault('results', []).extend(self.results)
+            admin.seek(0)
+            json.dump(admin_data, admin, indent=4)
+            admin.truncate()
@@ -0,0 +1,165 @@
+import json
+import os
+
+FSYNC_INTERVAL = 50
+INDEX_SUFFIX = '.index'
+
+
+def get_index_path(results_path: str):
+    """Get the path of the offset index of the policy results stream at results_path."""
+    return results_path + INDEX_SUFFIX
+
+
+class PolicyResultsWriter:
+    """
+    Appends the policy results of sites to a JSON lines file, one line per site, as soon as each site is done.
+    The file is synced to disk every fsync_interval sites, so a crash loses at most the last few sites.
+    """
+    def __init__(self, results_path: str, fsync_interval: int = FSYNC_INTERVAL):
+        self.path = results_path
+        self.fsync_interval = fsync_interval
+        self.__truncate_partial_line()
+        self.file = open(results_path, 'a', encoding='utf-8')
+        self.unsynced = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __truncate_partial_line(self):
+        """Removes a line left half-written by a crash, which would otherwise be joined with the next line."""
+        try:
+            with open(self.path, 'rb+') as results:
+                size = end = results.seek(0, os.SEEK_END)
+                while end > 0:
+                    start = max(end - 4096, 0)
+                    results.seek(start)
+                    newline = results.read(end - start).rfind(b'\n')
+                    if newline >= 0:
+                        end = start + newline + 1
+                        break
+                    end = start
+                if end != size:
+                    results.truncate(end)
+        except FileNotFoundError:
+            pass
+
+    def write(self, domain: str, policy_results: dict):
+        self.file.write(json.dumps({'domain': domain, 'policy': policy_results}) + '\n')
+        self.unsynced += 1
+        if self.unsynced >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+
+    def close(self):
+        self.sync()
+        self.file.close()
+
+
+class PolicyResults:
+    """
+    Read access to a policy results stream written by PolicyResultsWriter. Iterating reads the file lazily, one site at
+    a time. Sites can be looked up directly through an index of line offsets, which is saved next to the stream and
+    only extended with the lines added since it was last saved.
+    A line that is not complete yet, e.g. because postProcessing is still running, is left out.
+    If a site occurs more than once, e.g. after postProcessing was run again, only its last line counts, both for
+    lookups and when iterating.
+    """
+    def __init__(self, results_path: str):
+        self.path = results_path
+        self.file = open(results_path, 'rb')
+        self.index = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __iter_lines(self, start: int = 0):
+        """Yields the offset and contents of every complete line from start onwards."""
+        self.file.seek(start)
+        offset = start
+        for line in self.file:
+            if not line.endswith(b'\n'):
+                return
+            yield offset, line
+            offset += len(line)
+
+    def __iter__(self):
+        """
+        Yields tuples of domain and policy results, one per site in the index, in the order in which their last lines
+        were written.
+        """
+        index = self.get_index()
+        for offset, line in self.__iter_lines():
+            entry = json.loads(line)
+            if index.get(entry['domain']) == offset:
+                yield entry['domain'], entry['policy']
+
+    def items(self):
+        return iter(self)
+
+    def iter_from(self, start: int):
+        """
+        Yields the end offset, domain and policy results of every complete line from offset start onwards, e.g. of the
+        lines added since the stream was read up to start.
+        """
+        for offset, line in self.__iter_lines(start):
+            entry = json.loads(line)
+            yield offset + len(line), entry['domain'], entry['policy']
+
+    def get_index(self):
+        """Get the dict with key=domain, value=offset of its line, loading and updating the saved index."""
+        if self.index is not None:
+            return self.index
+        index_path = get_index_path(self.path)
+        try:
+            with open(index_path, 'r', encoding='utf-8') as inp:
+                saved = json.load(inp)
+        except (FileNotFoundError, json.JSONDecodeError):
+            saved = None
+        size = os.fstat(self.file.fileno()).st_size
+        if saved is not None and saved['size'] <= size and self.__is_line_start(saved['size']):
+            offsets, indexed_size = saved['offsets'], saved['size']
+        else:
+            offsets, indexed_size = {}, 0
+        for offset, line in self.__iter_lines(indexed_size):
+            offsets[json.loads(line)['domain']] = offset
+            indexed_size = offset + len(line)
+        if saved is None or indexed_size != saved['size']:
+            temp_path = index_path + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as out:
+                json.dump({'size': indexed_size, 'offsets': offsets}, out)
+            os.replace(temp_path, index_path)
+        self.index = offsets
+        return self.index
+
+    def __is_line_start(self, offset: int):
+        """Checks whether a line starts at offset, i.e. the stream was not rewritten since the index was saved."""
+        if offset == 0:
+            return True
+        self.file.seek(offset - 1)
+        return self.file.read(1) == b'\n'
+
+    def __contains__(self, domain: str):
+        return domain in self.get_index()
+
+    def __getitem__(self, domain: str):
+        self.file.seek(self.get_index()[domain])
+        return json.loads(self.file.readline())['policy']
+
+    def __len__(self):
+        return len(self.get_index())
+
+    def keys(self):
+        return self.get_index().keys()
+
+    def close(self):
+        self.file.close()
@@ -1,6 +1,11 @@
+import argparse
 import csv
+import io
 import json
+import multiprocessing
 import os.path
+import random
+import sys
 
 import urllib.parse as parse
 from tld import get_fld
@@ -10,12 +15,35 @@ from collections import defaultdict
 from tqdm import tqdm
 
 from sanityCheck import SanityCheck
+from siteSampling import Sample, get_stratum, DEFAULT_SEED
+from policyResults import PolicyResultsWriter
+from workQueue import LeaseQueue, LEASE_TIMEOUT
 import fileUtils
-from dataFileHandling import set_file_output_redirected_url, get_request_info, get_leakage_endpoints
+from crawlArchive import iter_archive_sites
+from dataFileHandling import set_file_output_redirected_url, get_request_info, get_leakage_endpoints, get_page_context
 
 RESULTS_CSV = fileUtils.get_csv_results_file()
 POLICY_RESULTS_JSON = fileUtils.get_policy_results_file()
-TRANCO_RANKING = fileUtils.get_tranco_ranking()
+POLICY_RESULTS_JSONL = fileUtils.get_policy_results_stream_file()
+SAMPLE_JSON = fileUtils.get_sample_file()
+QUEUE_DIR = os.path.join(fileUtils.get_data_path(), '.postprocessing-queue')
+
+__tranco_rank_index = None
+
+
+def find_cmp_occurrences(lines, cmp_occurrences: dict):
+    """
+    Scans lines of a log file for CMPs detected when websites were visited.
+    :param lines: iterable of lines of a log file
+    :param cmp_occurrences: dictionary with keys=websites and values=CMPs, to which found CMPs are added
+    :return: None
+    """
+    for line in lines:
+        # Line structure: "[...] CMP detected on https://www.example.com/: {"cmpName":"exampleCMP"}"
+        if 'CMP detected on' in line:
+            found_url = line.split('CMP detected on ')[1].split(' ')[0][:-1]
+            found_cmp = line.split('{')[-1].split(':"')[1].split('"}')[0]
+            cmp_occurrences[parse.urlunsplit(parse.urlsplit(found_url))] = found_cmp
 
 
 def find_cmp_occurrences_in_logs():
@@ -27,13 +55,7 @@ def find_cmp_occurrences_in_logs():
     cmp_occurrences = {}
     for log_file in log_files:
         with open(log_file, 'r', encoding='utf-8') as log_inp:
-            lines = log_inp.readlines()
-            for line in lines:
-                # Line structure: "[...] CMP detected on https://www.example.com/: {"cmpName":"exampleCMP"}"
-                if 'CMP detected on' in line:
-                    found_url = line.split('CMP detected on ')[1].split(' ')[0][:-1]
-                    found_cmp = line.split('{')[-1].split(':"')[1].split('"}')[0]
-                    cmp_occurrences[parse.urlunsplit(parse.urlsplit(found_url))] = found_cmp
+            find_cmp_occurrences(log_inp.readlines(), cmp_occurrences)
     return cmp_occurrences
 
 
@@ -67,21 +89,43 @@ def verify_data(sanity_counter: SanityCheck, data_object: dict):
     return True, sanity_counter
 
 
+def format_results_row(csv_results_row: list):
+    """Format a row of the results CSV as a line, the way csv.writer writes it."""
+    line = io.StringIO()
+    csv.writer(line).writerow(csv_results_row)
+    return line.getvalue()
+
+
 def get_domain_rank(domain: str):
-    try:
-        return TRANCO_RANKING.index(domain)
-    except ValueError:
-        return -1
+    global __tranco_rank_index
+    if __tranco_rank_index is None:
+        # Read when first needed, so importing this module does not read the Tranco list
+        __tranco_rank_index = fileUtils.get_tranco_rank_index()
+    return __tranco_rank_index.get(domain, -1)
 
 
-# Find all directories which have data saved to them
-data_directories = fileUtils.get_data_dirs()
-cmp_lookup_dict = find_cmp_occurrences_in_logs()
-sanity_check = SanityCheck()
-policy_output_dict = {}
-for directory in tqdm(data_directories):
+def get_site_strata(directories: [str], cmp_lookup_dict: dict):
+    """
+    Get the stratum (see siteSampling.get_stratum) of the website of every data-folder, from the rank of its domain and
+    whether a CMP was detected on any page of its domain.
+    :return: dict with key=crawled domain, value=its stratum
+    """
+    cmp_domains = {get_fld(url, fail_silently=True) for url in cmp_lookup_dict}
+    return {directory[5:]: get_stratum(get_domain_rank(directory[5:]), directory[5:] in cmp_domains)
+            for directory in directories}
+
+
+def process_site(site, sanity_check: SanityCheck, cmp_lookup_dict: dict):
+    """
+    Processes the crawled data of one website. Results per page are saved to the admin-file of the site.
+    :param site: the data-folder of the website, either a fileUtils.CrawlSite or a crawlArchive.ArchiveSite
+    :param sanity_check: SanityCheck counter object that is updated with the checks done on the data
+    :param cmp_lookup_dict: dictionary with keys=websites and values=CMPs found on each website
+    :return: tuple of the crawled domain, its row of the results CSV and its policy results, or None if the data-folder
+    had too few valid files
+    """
     # Get the crawled website and init variables.
-    dir_name = os.path.basename(directory)[5:]
+    dir_name = os.path.basename(site.directory)[5:]
     csv_results_row = [dir_name, get_domain_rank(dir_name), None]
 
     # Variables to save policy data to
@@ -98,102 +142,265 @@ for directory in tqdm(data_directories):
     sanity_check.incr_nr_dirs()
 
     # Find all .json files that contain crawled data
-    results_files = fileUtils.get_data_files(directory)
+    results_files = site.get_data_files()
     sanity_check.incr_nr_outside_requests(amt=(len(results_files['total'])-len(results_files['valid'])))
     files = results_files['valid']
     # If the directory has too few valid files, skip the directory
     if len(files) < 2:
         sanity_check.incr_nr_invalid_dirs()
-        continue
+        return None
     sanity_check.add_to_page_counts(len(files))
 
     # Add number of visited websites in admin file to sanity check.
-    with open(fileUtils.get_admin_file(directory), 'r', encoding='utf-8') as admin_file:
-        nr_visited = len(list(json.load(admin_file)['visited']))
-        sanity_check.add_to_results_ratio(len(files), nr_visited)
+    nr_visited = len(list(site.load_admin()['visited']))
+    sanity_check.add_to_results_ratio(len(files), nr_visited)
 
     for file in files:
         sanity_check.incr_nr_files()
-        with open(file, 'r', encoding='utf-8') as data_file:
-            # Load the data gathered from a page visit
-            data: dict = json.load(data_file)
-
-            # Get the visited url (intended and actual)
-            crawled_url = parse.urlunparse(parse.urlparse(data['initialUrl']))
-            final_url = data['finalUrl']
-
-            # Verify if gathered data is valid
-            verified, sanity_check = verify_data(sanity_check, data)
-            if not verified:
+        # Load the data gathered from a page visit
+        data: dict = site.load_data_file(file)
+
+        # Get the visited url (intended and actual)
+        crawled_url = parse.urlunparse(parse.urlparse(data['initialUrl']))
+        final_url = data['finalUrl']
+
+        # Verify if gathered data is valid
+        verified, sanity_check = verify_data(sanity_check, data)
+        if not verified:
+            continue
+
+        # Create file_output object, containing all results that need to be saved to the admin-file later
+        file_output = {'crawled-url': crawled_url,
+                       'CMP-encountered': '',
+                       'redirected-url': '',
+                       'referrer-policy': '',
+                       'req_pol_1stparty': set(),
+                       'req_pol_3rdparty': defaultdict(set),
+                       'resp_pol_3rdparty': defaultdict(set),
+                       'request-leakage': [],
+                       'referrer_leakage': [],
+                       'third-parties': []}
+
+        # Set 'redirected-url' value
+        file_output = set_file_output_redirected_url(file_output, crawled_url, final_url)
+
+        # Add CMP to csv output
+        if final_url in cmp_lookup_dict:
+            file_output['CMP-encountered'] = cmp_lookup_dict[final_url]
+            # If a CMP was not already set for this domain, set it now
+            if csv_results_row[2] is None:
+                csv_results_row[2] = cmp_lookup_dict[final_url]
+
+        # Derive all forms of the page url used to check its requests only once
+        page_context = get_page_context(crawled_url, final_url)
+        for request in list(data['data']['requests']):
+            if request['type'] == 'WebSocket':
                 continue
-
-            # Create file_output object, containing all results that need to be saved to the admin-file later
-            file_output = {'crawled-url': crawled_url,
-                           'CMP-encountered': '',
-                           'redirected-url': '',
-                           'referrer-policy': '',
-                           'req_pol_1stparty': set(),
-                           'req_pol_3rdparty': defaultdict(set),
-                           'resp_pol_3rdparty': defaultdict(set),
-                           'request-leakage': [],
-                           'referrer_leakage': [],
-                           'third-parties': []}
-
-            # Set 'redirected-url' value
-            file_output = set_file_output_redirected_url(file_output, crawled_url, final_url)
-
-            # Add CMP to csv output
-            if final_url in cmp_lookup_dict:
-                file_output['CMP-encountered'] = cmp_lookup_dict[final_url]
-                # If a CMP was not already set for this domain, set it now
-                if csv_results_row[2] is None:
-                    csv_results_row[2] = cmp_lookup_dict[final_url]
-
-            for request in list(data['data']['requests']):
-                if request['type'] == 'WebSocket':
-                    continue
-                # Add to referrer-policy, policy sets/dictionaries, third-parties, request-leakage entries
-                file_output = get_request_info(request, file_output, crawled_url, final_url)
-
-            if not set_policy:
-                set_policy = file_output['referrer-policy']
-            elif file_output['referrer-policy'] and file_output['referrer-policy'] not in set_policy.split(';'):
-                set_policy = f'{set_policy};{file_output["referrer-policy"]}'
-
-            # Add encountered referrer policies to set and dicts keeping track of them
-            req_pol_1stparty.update(file_output['req_pol_1stparty'])
-            for key in file_output['req_pol_3rdparty']:
-                req_pol_3rdparty[key].update(file_output['req_pol_3rdparty'][key])
-            for key in file_output['resp_pol_3rdparty']:
-                resp_pol_3rdparty[key].update(file_output['resp_pol_3rdparty'][key])
-
-            leakage_to_endpoints.update(get_leakage_endpoints(file_output['request-leakage']))
-            third_parties_on_domain.update(file_output['third-parties'])
-            referrer_leakage_to_domains.update(file_output['referrer_leakage'])
-
-            # Remove items for which values have not been set
-            file_output = {k: v for k, v in file_output.items() if v}
-            # Remove dictionaries with policy data. These are saved elsewhere, so they don't clog admin files.
-            file_output = {k: v for k, v in file_output.items() if
-                           k not in ['req_pol_1stparty', 'req_pol_3rdparty', 'resp_pol_3rdparty']}
-            fileUtils.save_data_to_admin(file_output, directory)
+            # Add to referrer-policy, policy sets/dictionaries, third-parties, request-leakage entries
+            file_output = get_request_info(request, file_output, page_context)
+
+        if not set_policy:
+            set_policy = file_output['referrer-policy']
+        elif file_output['referrer-policy'] and file_output['referrer-policy'] not in set_policy.split(';'):
+            set_policy = f'{set_policy};{file_output["referrer-policy"]}'
+
+        # Add encountered referrer policies to set and dicts keeping track of them
+        req_pol_1stparty.update(file_output['req_pol_1stparty'])
+        for key in file_output['req_pol_3rdparty']:
+            req_pol_3rdparty[key].update(file_output['req_pol_3rdparty'][key])
+        for key in file_output['resp_pol_3rdparty']:
+            resp_pol_3rdparty[key].update(file_output['resp_pol_3rdparty'][key])
+
+        leakage_to_endpoints.update(get_leakage_endpoints(file_output['request-leakage']))
+        third_parties_on_domain.update(file_output['third-parties'])
+        referrer_leakage_to_domains.update(file_output['referrer_leakage'])
+
+        # Remove items for which values have not been set
+        file_output = {k: v for k, v in file_output.items() if v}
+        # Remove dictionaries with policy data. These are saved elsewhere, so they don't clog admin files.
+        file_output = {k: v for k, v in file_output.items() if
+                       k not in ['req_pol_1stparty', 'req_pol_3rdparty', 'resp_pol_3rdparty']}
+        site.save_data_to_admin(file_output)
 
     csv_results_row.append(list(leakage_to_endpoints))  # Add list of endpoints being leaked to on this domain to result
     csv_results_row.append(list(third_parties_on_domain))  # Add list of third parties this domain makes requests to
     csv_results_row.append(list(referrer_leakage_to_domains))  # Add list of domains being leaked to through referrers
-    with open(RESULTS_CSV, 'a', newline='') as leakage_results_csv:
-        results_writer = csv.writer(leakage_results_csv)
-        results_writer.writerow(csv_results_row)  # When done with this data folder, add its results to results file
 
-    # Gather policy results into single dict, save in output list
-    policy_output_dict[dir_name] = {
+    # Gather policy results into single dict
+    return dir_name, csv_results_row, {
         'set_policy': set_policy,
         '1st_party_req': list(req_pol_1stparty),
         '3rd_party_req': {k: list(v) for k, v in req_pol_3rdparty.items()},
         '3rd_party_resp': {k: list(v) for k, v in resp_pol_3rdparty.items()}
     }
 
-# Save policy results to output file
-with open(POLICY_RESULTS_JSON, 'w') as policy_results_json:
-    json.dump(policy_output_dict, policy_results_json, indent=4)
-print(sanity_check)
+
+class PolicyOutputDict:
+    """
+    Collects the policy results of all sites in memory, and writes them to the policy results JSON file when closed.
+    Has the same interface as policyResults.PolicyResultsWriter, which writes every site as soon as it is done.
+    """
+    def __init__(self, results_path: str):
+        self.path = results_path
+        self.policy_output_dict = {}
+
+    def write(self, domain: str, policy_results: dict):
+        self.policy_output_dict[domain] = policy_results
+
+    def close(self):
+        with open(self.path, 'w') as policy_results_json:
+            json.dump(self.policy_output_dict, policy_results_json, indent=4)
+
+
+def open_policy_output(stream_policy_results: bool):
+    """Get the output for policy results: streamed to the JSON lines file, or collected into the JSON file."""
+    if stream_policy_results:
+        return PolicyResultsWriter(POLICY_RESULTS_JSONL)
+    return PolicyOutputDict(POLICY_RESULTS_JSON)
+
+
+def run_worker(queue_dir: str, lease_timeout: float = LEASE_TIMEOUT):
+    """
+    Processes data-folders as a worker of a work queue shared with other workers, possibly on other machines sharing
+    the crawl folder. Every data-folder is claimed through a lease (see workQueue.py) and its results are saved as a
+    partial output, which reduce_partials combines into the results files.
+    """
+    queue = LeaseQueue(queue_dir, lease_timeout=lease_timeout)
+    cmp_lookup_dict = find_cmp_occurrences_in_logs()
+    data_directories = fileUtils.get_data_dirs()
+    # Start at a random data-folder, so workers do not all compete for the same folders
+    start = random.randrange(len(data_directories)) if data_directories else 0
+    for directory in tqdm(data_directories[start:] + data_directories[:start]):
+        if queue.is_done(directory):
+            continue
+        claimed, previous_lease = queue.claim(directory)
+        if not claimed:
+            continue
+        if queue.is_done(directory):  # Completed by another worker just before it was claimed
+            queue.release(directory)
+            continue
+        site = fileUtils.BufferedCrawlSite(directory)
+        try:
+            # After taking over an expired lease, drop admin-file results written by the worker that held it
+            keep_results = (previous_lease or {}).get('admin_results')
+            queue.annotate(directory, {'admin_results': keep_results if keep_results is not None
+                                       else site.get_nr_admin_results()})
+            site_sanity_check = SanityCheck()
+            site_results = process_site(site, site_sanity_check, cmp_lookup_dict)
+        except Exception as e:
+            queue.complete(directory, {'error': f'{type(e).__name__}: {e}'})
+            continue
+        if not queue.holds(directory):  # The lease expired and another worker is processing the folder again
+            continue
+        site.write_admin(keep_results)
+        partial = {'sanity': site_sanity_check.to_dict(), 'domain': None, 'results_row': None, 'policy': None}
+        if site_results is not None:
+            partial.update(domain=site_results[0], results_row=format_results_row(site_results[1]),
+                           policy=site_results[2])
+        queue.complete(directory, partial)
+    queue.close()
+
+
+def reduce_partials(queue_dir: str, stream_policy_results=False):
+    """
+    Combines the partial outputs of all data-folders into the results CSV, the policy results file and the sanity
+    check, in the same order as a single postProcessing run. Exits if a data-folder was not (successfully) processed.
+    """
+    queue = LeaseQueue(queue_dir)
+    partials = {directory: queue.load_partial(directory) for directory in fileUtils.get_data_dirs()}
+    queue.close()
+    missing = [directory for directory, partial in partials.items() if partial is None]
+    failed = {directory: partial['error'] for directory, partial in partials.items() if partial and 'error' in partial}
+    if missing or failed:
+        print(f'Cannot combine results: {len(missing)} data-folders were not processed yet, e.g. {missing[:5]}, '
+              f'and {len(failed)} failed, e.g. {list(failed.items())[:5]}')
+        sys.exit(1)
+
+    sanity_check = SanityCheck()
+    policy_output = open_policy_output(stream_policy_results)
+    with open(RESULTS_CSV, 'a', newline='') as leakage_results_csv:
+        for partial in partials.values():
+            sanity_check.merge(SanityCheck.from_dict(partial['sanity']))
+            if partial['results_row'] is not None:
+                leakage_results_csv.write(partial['results_row'])
+                policy_output.write(partial['domain'], partial['policy'])
+    policy_output.close()
+    print(sanity_check)
+
+
+def main(argv: [str] = None):
+    parser = argparse.ArgumentParser(description='Process the crawled data of every website into the results files.')
+    parser.add_argument('--archive', help='tar, tar.gz or tar.xz archive of a crawl folder, processed without '
+                                          'extracting it. Admin-files with results are written to the data path.')
+    parser.add_argument('--worker', action='store_true',
+                        help='process data-folders as one of several workers sharing the crawl folder')
+    parser.add_argument('--reduce', action='store_true',
+                        help='combine the outputs of the workers into the results files once they are all done')
+    parser.add_argument('--workers', type=int, help='run this many local worker processes, then combine their outputs')
+    parser.add_argument('--queue-dir', default=QUEUE_DIR, help='folder shared by the workers')
+    parser.add_argument('--stream-policy-results', action='store_true',
+                        help=f'append the policy results of every site to {POLICY_RESULTS_JSONL} as soon as it is done, '
+                             f'instead of writing {POLICY_RESULTS_JSON} at the end')
+    parser.add_argument('--sample', type=float, metavar='FRACTION',
+                        help=f'only process a stratified sample of this fraction of the websites of every rank bucket '
+                             f'and CMP/no-CMP group, saved to {SAMPLE_JSON} for estimates by analysis.py --estimate')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help='seed of the sample')
+    parser.add_argument('--lease-timeout', type=float, default=LEASE_TIMEOUT,
+                        help='seconds after which the data-folder of an unresponsive worker is given to another one')
+    args = parser.parse_args(argv)
+    if args.sample is not None and (args.archive or args.worker or args.reduce or args.workers):
+        parser.error('--sample can only be used when processing the crawl folder in a single process')
+    if args.sample is None and not args.worker and os.path.exists(SAMPLE_JSON):
+        # The sample of an earlier run no longer describes the sites in the results files, see analysis.py
+        os.remove(SAMPLE_JSON)
+
+    if args.worker:
+        run_worker(args.queue_dir, args.lease_timeout)
+        return
+    if args.workers:
+        # Brought up to date once here, so the workers do not all rescan the crawl folder at the same time
+        fileUtils.get_catalog()
+        fileUtils.close_catalog()
+        workers = [multiprocessing.Process(target=run_worker, args=(args.queue_dir, args.lease_timeout))
+                   for _ in range(args.workers)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+    if args.reduce or args.workers:
+        reduce_partials(args.queue_dir, args.stream_policy_results)
+        return
+
+    sanity_check = SanityCheck()
+    policy_output = open_policy_output(args.stream_policy_results)
+    if args.archive:
+        # Filled from the log files in the archive before its first data-folder is yielded
+        cmp_lookup_dict = {}
+        sites = iter_archive_sites(args.archive, lambda lines: find_cmp_occurrences(lines, cmp_lookup_dict))
+    else:
+        # Find all directories which have data saved to them
+        directories = fileUtils.get_data_dirs()
+        cmp_lookup_dict = find_cmp_occurrences_in_logs()
+        if args.sample is not None:
+            sample = Sample.select(get_site_strata(directories, cmp_lookup_dict), args.sample, args.seed)
+            sample.save(SAMPLE_JSON)
+            print(sample)
+            directories = [directory for directory in directories if directory[5:] in sample]
+        sites = (fileUtils.CrawlSite(directory) for directory in directories)
+    for site in tqdm(sites):
+        site_results = process_site(site, sanity_check, cmp_lookup_dict)
+        if site_results is not None:
+            with open(RESULTS_CSV, 'a', newline='') as leakage_results_csv:
+                # When done with this data folder, add its results to results file
+                leakage_results_csv.write(format_results_row(site_results[1]))
+            policy_output.write(site_results[0], site_results[2])
+        if args.archive:
+            site.write_admin(fileUtils.get_data_path())
+
+    # Save policy results to output file
+    policy_output.close()
+    print(sanity_check)
+
+
+if __name__ == '__main__':
+    main()
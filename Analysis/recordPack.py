@@ -0,0 +1,140 @@
+import argparse
+import json
+import os
+import struct
+import zlib
+
+PACK_FILE_NAME = 'data.pack'
+PACK_MAGIC = b'CRAWLPACK1\n'
+FOOTER_MAGIC = b'PACKIDX1'
+COMPRESSION_LEVEL = 6
+
+# Every record, including the index, is stored as a 4-byte length followed by that many bytes of zlib data
+RECORD_LENGTH = struct.Struct('>I')
+# The file ends with the offset of the index record and FOOTER_MAGIC
+FOOTER = struct.Struct('>Q8s')
+
+
+def get_pack_path(directory_path: str):
+    """Get the path of the pack file of the data-folder at directory_path."""
+    return os.path.join(directory_path, PACK_FILE_NAME)
+
+
+def write_pack(pack_path: str, file_paths: [str]):
+    """
+    Packs files into a single pack file. Every file becomes one compressed record, which can be read on its own
+    through the index at the end of the pack file. The pack is written to a temporary file first, so an interrupted
+    run never leaves a truncated pack behind.
+    :param pack_path: path of the pack file to write
+    :param file_paths: list of paths of the files to pack. Records are named after the base names of the files.
+    :return: dict with key=record name, value=offset of the record in the pack file
+    """
+    index = {}
+    temp_path = pack_path + '.tmp'
+    with open(temp_path, 'wb') as pack:
+        pack.write(PACK_MAGIC)
+        for file_path in file_paths:
+            with open(file_path, 'rb') as inp:
+                record = zlib.compress(inp.read(), COMPRESSION_LEVEL)
+            index[os.path.basename(file_path)] = pack.tell()
+            pack.write(RECORD_LENGTH.pack(len(record)) + record)
+        index_offset = pack.tell()
+        index_record = zlib.compress(json.dumps(index).encode('utf-8'), COMPRESSION_LEVEL)
+        pack.write(RECORD_LENGTH.pack(len(index_record)) + index_record)
+        pack.write(FOOTER.pack(index_offset, FOOTER_MAGIC))
+        pack.flush()
+        os.fsync(pack.fileno())
+    os.replace(temp_path, pack_path)
+    return index
+
+
+class RecordPack:
+    """
+    Read access to a pack file written by write_pack. The file is opened once and every record is read with a single
+    seek, so reading all pages of a site costs one open instead of one per page.
+    """
+    def __init__(self, pack_path: str):
+        self.path = pack_path
+        self.file = open(pack_path, 'rb')
+        if self.file.read(len(PACK_MAGIC)) != PACK_MAGIC:
+            self.file.close()
+            raise ValueError(f'{pack_path} is not a pack file')
+        self.file.seek(-FOOTER.size, os.SEEK_END)
+        index_offset, footer_magic = FOOTER.unpack(self.file.read(FOOTER.size))
+        if footer_magic != FOOTER_MAGIC:
+            self.file.close()
+            raise ValueError(f'{pack_path} is truncated or damaged')
+        self.index = json.loads(self.__read_record(index_offset))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __contains__(self, name: str):
+        return name in self.index
+
+    def __read_record(self, offset: int):
+        self.file.seek(offset)
+        length, = RECORD_LENGTH.unpack(self.file.read(RECORD_LENGTH.size))
+        return zlib.decompress(self.file.read(length))
+
+    def names(self):
+        """Get a list of the names of all records, in the order they were packed."""
+        return list(self.index)
+
+    def read(self, name: str):
+        """Get the original contents of the file packed under the given name, as bytes."""
+        return self.__read_record(self.index[name])
+
+    def load_json(self, name: str):
+        """Parse the record with the given name as JSON."""
+        return json.loads(self.read(name))
+
+    def close(self):
+        self.file.close()
+
+
+def pack_directory(directory_path: str, file_paths: [str], remove_files: bool = False):
+    """
+    Packs the given data files of a data-folder into its pack file. If remove_files is True, the files are removed
+    after every record has been read back and compared to the original file.
+    :return: number of packed files
+    """
+    pack_path = get_pack_path(directory_path)
+    write_pack(pack_path, file_paths)
+    if remove_files:
+        with RecordPack(pack_path) as pack:
+            for file_path in file_paths:
+                with open(file_path, 'rb') as inp:
+                    if pack.read(os.path.basename(file_path)) != inp.read():
+                        raise ValueError(f'Packed copy of {file_path} differs from the original, not removing it')
+        for file_path in file_paths:
+            os.remove(file_path)
+    return len(file_paths)
+
+
+if __name__ == '__main__':
+    import fileUtils
+    from tqdm import tqdm
+
+    parser = argparse.ArgumentParser(description='Pack the page data files of every data-folder into one file.')
+    parser.add_argument('--remove', action='store_true', help='remove the data files once they have been packed')
+    args = parser.parse_args()
+
+    nr_packed = 0
+    for directory in tqdm(fileUtils.get_data_dirs()):
+        directory_path = os.path.join(fileUtils.get_data_path(), directory)
+        loose_files = fileUtils.get_data_files(directory, first_party=False, include_packed=False)['total']
+        if not loose_files:
+            continue
+        if os.path.exists(get_pack_path(directory_path)):
+            # A pack written without --remove only holds copies of the loose files, so it can be rewritten
+            with RecordPack(get_pack_path(directory_path)) as old_pack:
+                packed_names = old_pack.names()
+            if set(packed_names) - {os.path.basename(f) for f in loose_files}:
+                print(f'Skipping {directory}: its pack holds data files that are no longer on disk')
+                continue
+        nr_packed += pack_directory(directory_path, sorted(loose_files), args.remove)
+    print(f'Packed {nr_packed} data files')
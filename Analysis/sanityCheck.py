@@ -15,7 +15,7 @@ class ResultsRatio:
 
 class SanityCheck(object):
     def __init__(self, nr_dirs=0, nr_invalid_dirs=0, nr_files=0, nr_redirects=0, nr_outside_requests=0, page_counts: defaultdict = None, requestless_data=0,
-                 nr_invalid_urls=0, results_visited_ratio=ResultsRatio()):
+                 nr_invalid_urls=0, results_visited_ratio: ResultsRatio = None):
         self.nr_dirs = nr_dirs
         self.nr_invalid_dirs = nr_invalid_dirs
         self.nr_files = nr_files
@@ -27,7 +27,11 @@ class SanityCheck(object):
             self.page_counts = page_counts
         self.requestless_data = requestless_data
         self.nr_invalid_urls = nr_invalid_urls
-        self.results_visited_ratio = results_visited_ratio
+        if results_visited_ratio is None:
+            # A ResultsRatio default argument would be shared by all SanityCheck objects
+            self.results_visited_ratio = ResultsRatio()
+        else:
+            self.results_visited_ratio = results_visited_ratio
 
     def __str__(self):
         return f'Number of data directories: {self.nr_dirs}\n' \
@@ -43,6 +47,44 @@ class SanityCheck(object):
                f'\t #results < #visited: {self.results_visited_ratio.fewer_results}\n' \
                f'\t #results > #visited: {self.results_visited_ratio.more_results}\n'
 
+    def to_dict(self):
+        """Get the counters as a JSON serialisable dict, which can be turned back into a SanityCheck by from_dict."""
+        return {'nr_dirs': self.nr_dirs,
+                'nr_invalid_dirs': self.nr_invalid_dirs,
+                'nr_files': self.nr_files,
+                'nr_redirects': self.nr_redirects,
+                'nr_outside_requests': self.nr_outside_requests,
+                'page_counts': list(self.page_counts.items()),
+                'requestless_data': self.requestless_data,
+                'nr_invalid_urls': self.nr_invalid_urls,
+                'results_visited_ratio': [self.results_visited_ratio.fewer_results,
+                                          self.results_visited_ratio.more_results]}
+
+    @staticmethod
+    def from_dict(counters: dict):
+        """Create a SanityCheck from the output of to_dict."""
+        return SanityCheck(nr_dirs=counters['nr_dirs'], nr_invalid_dirs=counters['nr_invalid_dirs'],
+                           nr_files=counters['nr_files'], nr_redirects=counters['nr_redirects'],
+                           nr_outside_requests=counters['nr_outside_requests'],
+                           page_counts=defaultdict(int, counters['page_counts']),
+                           requestless_data=counters['requestless_data'],
+                           nr_invalid_urls=counters['nr_invalid_urls'],
+                           results_visited_ratio=ResultsRatio(*counters['results_visited_ratio']))
+
+    def merge(self, other):
+        """Add the counters of another SanityCheck to this one, e.g. to combine the checks of separate workers."""
+        self.nr_dirs += other.nr_dirs
+        self.nr_invalid_dirs += other.nr_invalid_dirs
+        self.nr_files += other.nr_files
+        self.nr_redirects += other.nr_redirects
+        self.nr_outside_requests += other.nr_outside_requests
+        for page_count, nr_domains in other.page_counts.items():
+            self.page_counts[page_count] += nr_domains
+        self.requestless_data += other.requestless_data
+        self.nr_invalid_urls += other.nr_invalid_urls
+        self.results_visited_ratio.fewer_results += other.results_visited_ratio.fewer_results
+        self.results_visited_ratio.more_results += other.results_visited_ratio.more_results
+
     def incr_nr_dirs(self):
         self.nr_dirs += 1
 
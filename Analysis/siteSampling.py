@@ -0,0 +1,186 @@
+import hashlib
+import json
+import math
+from collections import defaultdict
+
+from analysisCounter import AnalysisCounter, sort_dict
+
+DEFAULT_SEED = 0
+# At least two sites are sampled per stratum, as the variance within a stratum cannot be estimated from one site
+MIN_SITES_PER_STRATUM = 2
+# Multiplier of the standard error for a 95% confidence interval
+CONFIDENCE_Z = 1.96
+UNRANKED_BUCKET = 'unranked'
+
+
+def get_stratum(rank: int, has_cmp: bool):
+    """Get the stratum of a site: its rank bucket of AnalysisCounter.rank_buckets and whether it has a CMP."""
+    bucket = UNRANKED_BUCKET
+    for key, in_bucket in AnalysisCounter.rank_buckets.items():
+        if in_bucket(rank):
+            bucket = key
+            break
+    return f'{bucket}/{"cmp" if has_cmp else "no-cmp"}'
+
+
+def get_sample_key(seed: int, site: str):
+    """Get the key by which sites are ordered for sampling. Depends only on the seed and the site itself, so the
+    selection of a site does not change when other sites are added to or removed from its stratum."""
+    return hashlib.sha1(f'{seed}:{site}'.encode('utf-8')).hexdigest()
+
+
+class Sample:
+    """
+    A stratified sample of sites: in every stratum (see get_stratum), the same fraction of sites is selected.
+    The population size of every stratum is kept, to weigh the sampled sites in estimates.
+    """
+    def __init__(self, fraction: float, seed: int, population: dict, sites: dict):
+        """
+        :param fraction: fraction of the sites of every stratum that is sampled
+        :param seed: seed of the selection
+        :param population: dict with key=stratum, value=number of sites in the stratum
+        :param sites: dict with key=sampled site, value=its stratum
+        """
+        self.fraction = fraction
+        self.seed = seed
+        self.population = population
+        self.sites = sites
+
+    def __contains__(self, site: str):
+        return site in self.sites
+
+    def __len__(self):
+        return len(self.sites)
+
+    def __str__(self):
+        sample_sizes = defaultdict(int)
+        for stratum in self.sites.values():
+            sample_sizes[stratum] += 1
+        output_string = f'Sample of {len(self.sites)}/{sum(self.population.values())} sites ' \
+                        f'(fraction {self.fraction}, seed {self.seed}):\n'
+        for stratum, population_size in sorted(self.population.items()):
+            output_string += f'\t{stratum}: {sample_sizes[stratum]}/{population_size}\n'
+        return output_string
+
+    @staticmethod
+    def select(site_strata: dict, fraction: float, seed: int = DEFAULT_SEED,
+               min_per_stratum: int = MIN_SITES_PER_STRATUM):
+        """
+        Selects a reproducible stratified sample.
+        :param site_strata: dict with key=site, value=its stratum, of all sites in the population
+        :param fraction: fraction of the sites of every stratum to sample
+        :param seed: seed of the selection, the same seed and population always give the same sample
+        :param min_per_stratum: minimum number of sites sampled per stratum, if it has that many
+        :return: Sample
+        """
+        strata = defaultdict(list)
+        for site, stratum in site_strata.items():
+            strata[stratum].append(site)
+        sites = {}
+        for stratum, stratum_sites in strata.items():
+            sample_size = min(len(stratum_sites), max(min_per_stratum, round(fraction * len(stratum_sites))))
+            for site in sorted(stratum_sites, key=lambda s: get_sample_key(seed, s))[:sample_size]:
+                sites[site] = stratum
+        return Sample(fraction, seed, {stratum: len(s) for stratum, s in strata.items()}, sites)
+
+    def to_dict(self):
+        return {'fraction': self.fraction, 'seed': self.seed, 'population': self.population, 'sites': self.sites}
+
+    @staticmethod
+    def from_dict(sample: dict):
+        return Sample(sample['fraction'], sample['seed'], sample['population'], sample['sites'])
+
+    def save(self, path: str):
+        with open(path, 'w', encoding='utf-8') as out:
+            json.dump(self.to_dict(), out, indent=4)
+
+    @staticmethod
+    def load(path: str):
+        with open(path, 'r', encoding='utf-8') as inp:
+            return Sample.from_dict(json.load(inp))
+
+
+class StratifiedEstimator:
+    """
+    Estimates the percentages of an AnalysisCounter for the whole population from the sites of a Sample.
+    Like in AnalysisCounter, the percentage of an item is the number of times it is counted, relative to the number of
+    counted sites (the entries). It is estimated as the ratio of the weighted totals of both, where a site in stratum h
+    stands for population[h] / (number of sampled sites of h) sites. The confidence interval uses the variance of this ratio
+    estimator for stratified sampling without replacement, linearised around the estimate.
+    Sampled sites without results count as non-response: the other sites of their stratum stand for them.
+    """
+    def __init__(self, sample: Sample):
+        self.sample = sample
+        self.sites = defaultdict(int)
+        self.entries = defaultdict(int)
+        self.items = defaultdict(lambda: defaultdict(int))
+        # Sum of the squared number of times a site has an item, for the variance of items counted more than once
+        self.item_squares = defaultdict(lambda: defaultdict(int))
+
+    def add_site(self, stratum: str, items: [str], total_counter=False):
+        """
+        Adds a sampled site, with the same items and total_counter as it would be counted with in an AnalysisCounter.
+        Must be called for every sampled site with results, also if it has no items.
+        """
+        self.sites[stratum] += 1
+        if not total_counter and not items:
+            return
+        self.entries[stratum] += 1
+        site_items = defaultdict(int)
+        for item in items:
+            site_items[item] += 1
+        for item, count in site_items.items():
+            self.items[stratum][item] += count
+            self.item_squares[stratum][item] += count ** 2
+
+    def __get_weights(self):
+        return {stratum: self.sample.population[stratum] / nr_sites for stratum, nr_sites in self.sites.items()}
+
+    def get_nr_entries(self):
+        """Get the estimated number of entries in the population."""
+        weights = self.__get_weights()
+        return sum(weights[stratum] * nr_entries for stratum, nr_entries in self.entries.items())
+
+    def estimate(self, item: str):
+        """
+        Estimates the percentage of an item in the population, as AnalysisCounter would count it.
+        :return: tuple of the estimated percentage and the bounds of its confidence interval, or None if there are no
+        entries in the sample
+        """
+        weights = self.__get_weights()
+        entries_total = self.get_nr_entries()
+        if entries_total == 0:
+            return None
+        item_total = sum(weights[stratum] * counts.get(item, 0) for stratum, counts in self.items.items())
+        ratio = item_total / entries_total
+
+        variance = 0.0
+        for stratum, nr_sites in self.sites.items():
+            if nr_sites < 2:
+                continue
+            # Residuals of the linearised ratio: the number of times an entry has the item, minus the ratio
+            item_count = self.items[stratum].get(item, 0) if stratum in self.items else 0
+            item_squares = self.item_squares[stratum].get(item, 0) if stratum in self.item_squares else 0
+            nr_entries = self.entries[stratum]
+            residual_sum = item_count - ratio * nr_entries
+            residual_squares = item_squares - 2 * ratio * item_count + ratio ** 2 * nr_entries
+            residual_variance = (residual_squares - residual_sum ** 2 / nr_sites) / (nr_sites - 1)
+            population_size = self.sample.population[stratum]
+            variance += population_size ** 2 * (1 - nr_sites / population_size) * residual_variance / nr_sites
+        margin = CONFIDENCE_Z * math.sqrt(max(variance, 0.0)) / entries_total
+        return ratio * 100, max(ratio - margin, 0.0) * 100, (ratio + margin) * 100
+
+    def get_estimates(self):
+        """Get a dict with key=item, value=estimate (see estimate) of every item in the sample, sorted ascending."""
+        items = set()
+        for counts in self.items.values():
+            items.update(counts)
+        return sort_dict({item: self.estimate(item) for item in items})
+
+    def __str__(self):
+        estimates = list(self.get_estimates().items())[-10:]
+        output_string = f'Estimated entries: {self.get_nr_entries():.0f} ' \
+                        f'(from {sum(self.entries.values())} of {sum(self.sites.values())} sampled sites)\n'
+        for item, (percentage, low, high) in estimates:
+            output_string += f'{item}: {percentage:.1f}% (95% CI {low:.1f}-{high:.1f}%),\n'
+        return output_string
@@ -0,0 +1,150 @@
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+LEASE_TIMEOUT = 300
+HEARTBEAT_INTERVAL = 30
+
+
+def write_json_atomic(path: str, data):
+    """Writes data as JSON to a temporary file that is then renamed to path, so readers never see a partial file."""
+    temp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as temp:
+        json.dump(data, temp)
+        temp.flush()
+        os.fsync(temp.fileno())
+    os.replace(temp_path, path)
+
+
+def read_json(path: str):
+    """Reads a JSON file, returning None if it does not exist and {} if it cannot be parsed."""
+    try:
+        with open(path, 'r', encoding='utf-8') as inp:
+            return json.load(inp)
+    except FileNotFoundError:
+        return None
+    except json.JSONDecodeError:
+        return {}
+
+
+class LeaseQueue:
+    """
+    Work queue shared by workers on one or more machines through a (network) folder. A worker claims an item by
+    creating its lease file, which only one worker can do, and keeps the lease alive by touching the file every
+    heartbeat_interval seconds. A lease that was not touched for lease_timeout seconds has expired and can be taken over,
+    e.g. after its worker crashed. Completed items get a partial output file, which marks them as done.
+    The lease timeout must be well above the clock difference between the machines.
+    """
+    def __init__(self, queue_dir: str, lease_timeout: float = LEASE_TIMEOUT,
+                 heartbeat_interval: float = HEARTBEAT_INTERVAL):
+        self.lease_dir = os.path.join(queue_dir, 'leases')
+        self.partial_dir = os.path.join(queue_dir, 'partials')
+        os.makedirs(self.lease_dir, exist_ok=True)
+        os.makedirs(self.partial_dir, exist_ok=True)
+        self.lease_timeout = lease_timeout
+        self.heartbeat_interval = heartbeat_interval
+        self.worker_id = f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        self.held = set()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.heartbeat_thread = threading.Thread(target=self.__heartbeat, daemon=True)
+        self.heartbeat_thread.start()
+
+    def __lease_path(self, name: str):
+        return os.path.join(self.lease_dir, f'{name}.lease')
+
+    def __partial_path(self, name: str):
+        return os.path.join(self.partial_dir, f'{name}.json')
+
+    def __heartbeat(self):
+        while not self.stopped.wait(self.heartbeat_interval):
+            with self.lock:
+                for name in list(self.held):
+                    try:
+                        os.utime(self.__lease_path(name))
+                    except FileNotFoundError:
+                        self.held.discard(name)
+
+    def __create_lease(self, name: str):
+        """Atomically creates the lease file of an item. Returns False if it already exists."""
+        try:
+            fd = os.open(self.__lease_path(name), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w', encoding='utf-8') as lease:
+            json.dump({'worker': self.worker_id, 'acquired': time.time()}, lease)
+        return True
+
+    def is_done(self, name: str):
+        return os.path.exists(self.__partial_path(name))
+
+    def claim(self, name: str):
+        """
+        Tries to claim an item.
+        :return: tuple of whether the item was claimed and, if it was taken over from an expired lease, the data of
+        that lease (see annotate), else None
+        """
+        lease_path = self.__lease_path(name)
+        previous = None
+        if not self.__create_lease(name):
+            try:
+                if time.time() - os.stat(lease_path).st_mtime < self.lease_timeout:
+                    return False, None
+                # Move the expired lease aside. Only one worker can rename it, the others get FileNotFoundError.
+                expired_path = f'{lease_path}.{self.worker_id}.expired'
+                os.rename(lease_path, expired_path)
+            except FileNotFoundError:
+                return False, None
+            if time.time() - os.stat(expired_path).st_mtime < self.lease_timeout:
+                # Another worker took over the lease between the stat and the rename: put its lease back
+                try:
+                    os.link(expired_path, lease_path)
+                except FileExistsError:
+                    pass
+                os.remove(expired_path)
+                return False, None
+            previous = read_json(expired_path) or {}
+            os.remove(expired_path)
+            if not self.__create_lease(name):
+                return False, None
+        with self.lock:
+            self.held.add(name)
+        return True, previous
+
+    def annotate(self, name: str, data: dict):
+        """Saves data in the lease of a claimed item, to be used by a worker that takes over the lease if it expires."""
+        write_json_atomic(self.__lease_path(name), {'worker': self.worker_id, 'acquired': time.time(), **data})
+
+    def holds(self, name: str):
+        """Checks whether this worker still holds the lease of an item, i.e. it did not expire and get taken over."""
+        lease = read_json(self.__lease_path(name))
+        return name in self.held and lease is not None and lease.get('worker') == self.worker_id
+
+    def complete(self, name: str, partial: dict):
+        """Saves the partial output of a claimed item, marking it as done, and releases its lease."""
+        write_json_atomic(self.__partial_path(name), partial)
+        self.release(name)
+
+    def release(self, name: str):
+        """Releases the lease of a claimed item, unless it was taken over by another worker."""
+        with self.lock:
+            self.held.discard(name)
+        lease = read_json(self.__lease_path(name))
+        if lease is not None and lease.get('worker') == self.worker_id:
+            try:
+                os.remove(self.__lease_path(name))
+            except FileNotFoundError:
+                pass
+
+    def load_partial(self, name: str):
+        """Get the partial output of an item, or None if it is not done."""
+        return read_json(self.__partial_path(name))
+
+    def close(self):
+        self.stopped.set()
+        self.heartbeat_thread.join()
+        for name in list(self.held):
+            self.release(name)
@@ -0,0 +1,123 @@
+import asyncio
+import logging
+from html.parser import HTMLParser
+
+import aiohttp
+
+REQUEST_TIMEOUT = 20
+MAX_HTML_BYTES = 2 * 1024 * 1024
+HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:94.0) Gecko/20100101 Firefox/94.0',
+           'Accept': 'text/html,application/xhtml+xml;q=0.9,*/*;q=0.8',
+           'Accept-Language': 'en-US,en;q=0.5'}
+
+# Elements whose contents are never rendered as text
+INVISIBLE_TAGS = {'head', 'script', 'style', 'noscript', 'template', 'svg', 'iframe', 'object', 'canvas'}
+# Elements that start on a new line, like they do in the innerText of a rendered page
+BLOCK_TAGS = {'address', 'article', 'aside', 'blockquote', 'br', 'dd', 'div', 'dl', 'dt', 'fieldset', 'figcaption',
+              'figure', 'footer', 'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header', 'hr', 'li', 'main', 'nav',
+              'ol', 'p', 'pre', 'section', 'table', 'td', 'th', 'tr', 'ul'}
+VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param', 'source', 'track',
+             'wbr'}
+
+
+class VisibleTextParser(HTMLParser):
+    """Collects the text of an HTML document that would be visible on the page, approximating body.innerText."""
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        # Names of the elements opened since the element that started the current invisible region, that one included
+        self.invisible_stack = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in VOID_TAGS:
+            if tag in BLOCK_TAGS and not self.invisible_stack:
+                self.parts.append('\n')
+            return
+        if self.invisible_stack or tag in INVISIBLE_TAGS or any(name == 'hidden' for name, _ in attrs):
+            self.invisible_stack.append(tag)
+        elif tag in BLOCK_TAGS:
+            self.parts.append('\n')
+
+    def handle_endtag(self, tag):
+        if tag in VOID_TAGS:
+            return
+        if self.invisible_stack:
+            # Elements left open inside the invisible region, like <p> or <li>, are closed along with it
+            if tag in self.invisible_stack:
+                while self.invisible_stack.pop() != tag:
+                    pass
+        elif tag in BLOCK_TAGS:
+            self.parts.append('\n')
+
+    def handle_data(self, data):
+        if not self.invisible_stack:
+            self.parts.append(data)
+
+    def get_text(self):
+        lines = (' '.join(line.split()) for line in ''.join(self.parts).split('\n'))
+        return '\n'.join(line for line in lines if line)
+
+
+def extract_visible_text(html: str):
+    """Return the visible text of an HTML document."""
+    parser = VisibleTextParser()
+    parser.feed(html)
+    parser.close()
+    return parser.get_text()
+
+
+async def fetch_text(session: aiohttp.ClientSession, site: str):
+    """Retrieve the visible text off of a given website using a plain HTTP request.
+    returns the text, or '' if the website did not return usable HTML
+    """
+    async with session.get(site, allow_redirects=True) as response:
+        if str(response.url).rstrip('/') != site.rstrip('/'):
+            logging.info(' - Retrieving: Redirect detected - {0} TO {1}'.format(site, response.url))
+        if response.status >= 400 or 'html' not in response.headers.get('Content-Type', 'text/html'):
+            return ''
+        chunks = []
+        size = 0
+        async for chunk in response.content.iter_chunked(1 << 16):
+            chunks.append(chunk)
+            size += len(chunk)
+            if size >= MAX_HTML_BYTES:
+                break
+        body = b''.join(chunks)
+    try:
+        html = body.decode(response.charset or 'utf-8', errors='replace')
+    except LookupError:  # Unknown charset in the Content-Type header
+        html = body.decode('utf-8', errors='replace')
+    return extract_visible_text(html)
+
+
+async def fetch_texts(sites: [str], handle_text, concurrency: int = 64):
+    """Retrieve the visible text off of each of the given websites, reusing connections through a shared pool.
+    :param sites: list of website URLs
+    :param handle_text: function called with (site, text) for every website, text being '' if retrieving it failed.
+    If it is a coroutine function, its result is awaited before the worker that fetched the text fetches another one.
+    :param concurrency: maximum number of requests in flight at the same time
+    :return: None
+    """
+    queue = asyncio.Queue()
+    for site in sites:
+        queue.put_nowait(site)
+
+    async def worker(session):
+        while not queue.empty():
+            site = queue.get_nowait()
+            try:
+                text = await fetch_text(session, site)
+            except Exception as e:  # Catch problems like timeouts, TLS errors or broken websites.
+                logging.info(' - Retrieving: HTTP request failed ({0}) - {1}'.format(type(e).__name__, site))
+                text = ''
+            handled = handle_text(site, text)
+            if asyncio.iscoroutine(handled):
+                await handled
+
+    connector = aiohttp.TCPConnector(limit=concurrency, ttl_dns_cache=300)
+    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers=HEADERS) as session:
+        # A worker stopped by an exception of handle_text must not stop the others, which fetch its remaining sites
+        for result in await asyncio.gather(*(worker(session) for _ in range(concurrency)), return_exceptions=True):
+            if isinstance(result, Exception):
+                logging.error(' - Retrieving: handling a text failed ({0}: {1})'.format(type(result).__name__, result))
@@ -1,11 +1,18 @@
+import asyncio
+import hashlib
+import os
+import queue
+import threading
 import time
 import random
 import logging
 import regex
 
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from csv import reader
 from csv import writer
-from multiprocessing import Pool, Lock
+from multiprocessing import Manager, Process, Queue
 
 from selenium import webdriver
 from selenium.common.exceptions import TimeoutException
@@ -15,6 +22,8 @@ import pycld2
 from polyglot.detect import Detector
 from polyglot.detect.base import UnknownLanguage
 
+from HttpTextFetching import fetch_texts
+
 driver_path = GeckoDriverManager().install()
 options = webdriver.FirefoxOptions()
 options.headless = True
@@ -25,6 +34,39 @@ logging.basicConfig(filename=logname, level=logging.INFO)
 
 RE_BAD_CHARS = regex.compile(r"\p{Cc}|\p{Cs}")
 
+OUTPUT_FILE = 'CRUX-McAfee-Cat_Lan.csv'
+FAILURES_FILE = 'CRUX-McAfee-Cat_Lan-failures.csv'
+# Websites that failed this many times in earlier runs are not tried again
+MAX_FAILED_ATTEMPTS = 2
+WRITE_BATCH_SIZE = 100
+FLUSH_INTERVAL = 5
+
+# Websites are fetched and their language is detected in separate stages, each with its own number of processes.
+# Fetching waits on the network and browser, detection on the CPU. Bounded queues keep either stage from running
+# far ahead of the other.
+NR_FETCH_WORKERS = 8
+NR_DETECT_WORKERS = 2
+ROW_QUEUE_SIZE = 64
+TEXT_QUEUE_SIZE = 32
+# Seconds between checks whether all worker processes are still running, while waiting on a queue
+LIVENESS_CHECK_INTERVAL = 5
+
+# Each fetch worker keeps one browser and reuses it for this many pages before starting a fresh one.
+# Setting this to 1 starts a new browser for every row.
+MAX_PAGES_PER_DRIVER = 50
+# 'http' first tries to tag every website using plain HTTP requests, 'browser' always uses a browser
+FETCH_MODE = 'http'
+HTTP_CONCURRENCY = 64
+
+# Pages are polled until their text and network activity settle, for at most READY_TIMEOUT seconds
+READY_TIMEOUT = 10
+READY_POLL_INTERVAL = 0.25
+TEXT_STABLE_PERIOD = 1
+NETWORK_IDLE_PERIOD = 0.5
+
+driver = None
+driver_page_count = 0
+
 
 # Sanitation code provided by:
 # https://github.com/mikemccand/chromium-compact-language-detector/issues/22#issuecomment-707999784
@@ -50,82 +92,367 @@ def get_inner_text(driver):
     return driver.execute_script('return (!!document.body && document.body.innerText)')
 
 
+def quit_driver():
+    """Quit this worker's browser, if it has one. The next call to get_driver will start a new one."""
+    global driver
+    if driver is None:
+        return
+    try:
+        driver.quit()
+    except Exception:
+        logging.exception(' - Browser: Failed to quit browser')
+    driver = None
+
+
+def start_driver():
+    """Start a new browser for this worker."""
+    global driver, driver_page_count
+    driver = webdriver.Firefox(executable_path=driver_path, firefox_options=options)
+    driver_page_count = 0
+
+
+def get_driver():
+    """Return this worker's browser, starting a new one if there is none or the current one has hit its page limit."""
+    global driver_page_count
+    if driver is not None and driver_page_count >= MAX_PAGES_PER_DRIVER:
+        quit_driver()
+    if driver is None:
+        start_driver()
+    driver_page_count += 1
+    return driver
+
+
+def get_page_state(driver):
+    """Run some JavaScript in order to get the load state, text length and number of loaded resources of a webpage."""
+    return driver.execute_script('return [document.readyState, '
+                                 '(!!document.body && document.body.innerText.length) || 0, '
+                                 'performance.getEntriesByType("resource").length]')
+
+
+def wait_until_ready(site, driver, timeout=READY_TIMEOUT):
+    """Wait until a webpage is ready to have its text retrieved. A page is considered ready once the document has
+    loaded, it contains text, and both its text length and its number of loaded resources have stopped changing.
+    Gives up after timeout seconds, after which the text is retrieved regardless.
+    """
+    start = time.monotonic()
+    last_text_length, last_resource_count = -1, -1
+    text_stable_since = network_idle_since = start
+    while True:
+        now = time.monotonic()
+        ready_state, text_length, resource_count = get_page_state(driver)
+        if text_length != last_text_length:
+            last_text_length, text_stable_since = text_length, now
+        if resource_count != last_resource_count:
+            last_resource_count, network_idle_since = resource_count, now
+        if ready_state == 'complete' and text_length > 0 and now - text_stable_since >= TEXT_STABLE_PERIOD \
+                and now - network_idle_since >= NETWORK_IDLE_PERIOD:
+            return
+        if now - start >= timeout:
+            logging.info(' - Retrieving: Not ready after {0}s - {1}'.format(timeout, site))
+            return
+        time.sleep(READY_POLL_INTERVAL)
+
+
 def get_text(site, driver):
     """Retrieve the text off of a given website."""
     logging.info(' - Retrieving - ' + site)
     driver.get(site)
     if driver.current_url != site:
         logging.info(' - Retrieving: Redirect detected - {0} TO {1}'.format(site, driver.current_url))
-    time.sleep(5)
+    wait_until_ready(site, driver)
     text = get_inner_text(driver)
-    if text == '':
-        time.sleep(5)
-        logging.info(' - Retrieving: Retry - ' + site)
-        text = get_inner_text(driver)
     if text == '':
         logging.warning(' - Retrieving: Empty text - ' + site)
         return None
     return 0, text
 
 
-def tag_row(row):
-    """Given a row from the .csv containing the websites that need to be tagged,
-    add a language tag to it and write the result to the output file.
+def detect_language(site, text):
+    """Run language detection on the text retrieved from a given website.
+    returns a tuple of the detected language code and None, or of None and the reason no reliable language could be
+    detected (which is logged)
     """
-    driver = webdriver.Firefox(executable_path=driver_path, firefox_options=options)
     try:
-        return_code, value = get_text(row[0], driver)
-        driver.quit()
-    except TimeoutException:
-        logging.exception(' - Retrieving: Timeout - ' + row[0])
-        return
-    except Exception:  # Catch problems like CAPTCHA or broken websites.
-        logging.exception('- Retrieving - ' + row[0])
-        # logging.exception already logs the exception's information, so no further handling is necessary.
-        driver.quit()
-        return
-    if return_code is None:
-        return
-
-    try:
-        lan_code = get_lan_code(value)
+        lan_code = get_lan_code(text)
     except pycld2.error:
-        logging.warning(' - Retrieving: Unicode error, retrying - ' + row[0])
-        lan_code = get_lan_code(remove_bad_chars(value))
+        logging.warning(' - Retrieving: Unicode error, retrying - ' + site)
+        lan_code = get_lan_code(remove_bad_chars(text))
     except UnknownLanguage:
         lan_code = 'Unknown'
     except Exception:  # Catch unexpected problems in detecting languages like unknown characters.
-        logging.exception('- Tagging - ' + row[0])
+        logging.exception('- Tagging - ' + site)
         # logging.exception already logs the exception's information, so no further handling is necessary.
-        driver.quit()
-        return
+        return None, 'Detection error'
     if lan_code == 'Empty':
-        logging.error('Tagging: Empty text - ' + row[0])
-        return
+        logging.error('Tagging: Empty text - ' + site)
+        return None, 'Empty text'
     if lan_code in ['Unknown', 'un', '']:
-        logging.error('Tagging: Unknown language - ' + row[0])
-        return
+        logging.error('Tagging: Unknown language - ' + site)
+        return None, 'Unknown language'
     if lan_code == 'Unreliable':
-        logging.error('Tagging: Low confidence - ' + row[0])
-        return
+        logging.error('Tagging: Low confidence - ' + site)
+        return None, 'Low confidence'
+    return lan_code, None
+
+
+class TaggingWriter:
+    """Single writer for the results of all workers. Results are put on a queue and written by one thread, which
+    flushes the output files once per batch of rows or once per flush interval, whichever comes first.
+    """
+    def __init__(self, output_path=OUTPUT_FILE, failures_path=FAILURES_FILE):
+        self.queue = queue.Queue()
+        self.output = open(output_path, 'a', newline='')
+        self.failures = open(failures_path, 'a', newline='')
+        self.thread = threading.Thread(target=self.__write_results, daemon=True)
+        self.thread.start()
+
+    def add_result(self, row, lan_code, failure):
+        """Queue the result of tagging a row: the tagged row if lan_code is set, the failure reason otherwise."""
+        self.queue.put((row, lan_code, failure))
+
+    def __write_results(self):
+        output_writer, failures_writer = writer(self.output), writer(self.failures)
+        nr_unflushed, last_flush = 0, time.monotonic()
+        while True:
+            try:
+                result = self.queue.get(timeout=FLUSH_INTERVAL)
+            except queue.Empty:
+                result = ()
+            if result is None:
+                break
+            if result:
+                row, lan_code, failure = result
+                if lan_code is not None:
+                    output_writer.writerow([row[0]] + [lan_code] + row[1:])
+                else:
+                    failures_writer.writerow([row[0], failure])
+                nr_unflushed += 1
+            if nr_unflushed >= WRITE_BATCH_SIZE or (nr_unflushed and time.monotonic() - last_flush >= FLUSH_INTERVAL):
+                self.output.flush()
+                self.failures.flush()
+                nr_unflushed, last_flush = 0, time.monotonic()
+        self.output.close()
+        self.failures.close()
 
-    row = [row[0]] + [lan_code] + row[1:]
-    with Lock():
-        with open('CRUX-McAfee-Cat_Lan.csv', 'a', newline='') as tagged:
-            csv_writer = writer(tagged)
-            csv_writer.writerow(row)
+    def close(self):
+        """Write all queued results and close the output files."""
+        self.queue.put(None)
+        self.thread.join()
+
+
+def load_progress(output_path=OUTPUT_FILE, failures_path=FAILURES_FILE):
+    """Load the websites that were already handled in an earlier run.
+    returns the set of websites that are already tagged or have failed MAX_FAILED_ATTEMPTS times
+    """
+    done = set()
+    if os.path.exists(output_path):
+        with open(output_path, 'r', newline='') as tagged:
+            done.update(row[0] for row in reader(tagged) if row)
+    if os.path.exists(failures_path):
+        with open(failures_path, 'r', newline='') as failures:
+            failure_counts = Counter(row[0] for row in reader(failures) if row)
+        done.update(site for site, count in failure_counts.items() if count >= MAX_FAILED_ATTEMPTS)
+    return done
+
+
+def get_text_hash(text):
+    """Hash the normalised text of a webpage, so identical pages such as mirror sites and parked domains match."""
+    return hashlib.sha1(' '.join(text.lower().split()).encode('utf-8')).hexdigest()
+
+
+def detect_language_cached(site, text, cache):
+    """Run detect_language, reusing the result for a text with the same normalised content if it is in cache.
+    returns a tuple of the detected language code and the reason detection failed, like detect_language
+    """
+    text_hash = get_text_hash(text)
+    cached = cache.get(text_hash)
+    if cached is not None:
+        logging.info(' - Tagging: Reusing result of identical text - ' + site)
+        return tuple(cached)
+    result = detect_language(site, text)
+    cache[text_hash] = result
+    return result
+
+
+def fetch_row(row):
+    """Given a row from the .csv containing the websites that need to be tagged, retrieve the text of its website.
+    returns a tuple of the row, the text (None if retrieving failed) and the reason retrieving failed
+    """
+    try:
+        result = get_text(row[0], get_driver())
+    except TimeoutException:
+        logging.exception(' - Retrieving: Timeout - ' + row[0])
+        # The browser may still be busy with the timed out page, so replace it before the next row
+        quit_driver()
+        return row, None, 'Timeout'
+    except Exception:  # Catch problems like CAPTCHA or broken websites.
+        logging.exception('- Retrieving - ' + row[0])
+        # logging.exception already logs the exception's information, so no further handling is necessary.
+        # The browser may have crashed, so replace it before the next row
+        quit_driver()
+        return row, None, 'Retrieving error'
+    if result is None:
+        return row, None, 'Empty text'
+    return_code, value = result
+    return row, value, None
+
+
+def fetch_worker(row_queue, text_queue):
+    """Fetch stage: retrieve the text of every row taken from row_queue using this process' browser, and put it on
+    text_queue. Stops when it takes None from row_queue.
+    """
+    start_driver()
+    try:
+        while True:
+            row = row_queue.get()
+            if row is None:
+                break
+            text_queue.put(fetch_row(row))
+    finally:
+        quit_driver()
+
+
+def detect_worker(text_queue, result_queue, cache):
+    """Detection stage: detect the language of every text taken from text_queue and put the result on result_queue.
+    Stops when it takes None from text_queue, after putting None on result_queue.
+    """
+    while True:
+        fetched = text_queue.get()
+        if fetched is None:
+            break
+        row, text, failure = fetched
+        if text is not None:
+            lan_code, failure = detect_language_cached(row[0], text, cache)
+        else:
+            lan_code = None
+        result_queue.put((row, lan_code, failure))
+    result_queue.put(None)
+
+
+def get_failed_workers(processes):
+    """Return the processes that stopped because of an error, e.g. a browser that could not be started."""
+    return [process for process in processes if process.exitcode not in (None, 0)]
+
+
+def put_while_workers_run(item_queue, item, processes):
+    """Put item on item_queue, waiting while the queue is full, unless one of processes failed in the meantime.
+    returns whether item was put on the queue
+    """
+    while True:
+        try:
+            item_queue.put(item, timeout=LIVENESS_CHECK_INTERVAL)
+            return True
+        except queue.Full:
+            if get_failed_workers(processes):
+                return False
+
+
+def feed_rows(rows, row_queue, text_queue, fetchers, detectors):
+    """Put all rows on row_queue, and stop the detection stage once all fetch workers have finished.
+    Stops early if a worker failed, which tag_rows_browser reports.
+    """
+    workers = fetchers + detectors
+    for row in rows:
+        if not put_while_workers_run(row_queue, row, workers):
+            return
+    for _ in fetchers:
+        if not put_while_workers_run(row_queue, None, workers):
+            return
+    for fetcher in fetchers:
+        fetcher.join()
+    for _ in detectors:
+        if not put_while_workers_run(text_queue, None, workers):
+            return
+
+
+def tag_rows_browser(rows, tagging_writer, cache):
+    """Tag rows using a browser, running the fetch and detection stages in their own processes.
+    Raises a RuntimeError if a worker process fails, after stopping the others.
+    """
+    row_queue, text_queue, result_queue = Queue(ROW_QUEUE_SIZE), Queue(TEXT_QUEUE_SIZE), Queue()
+    fetchers = [Process(target=fetch_worker, args=(row_queue, text_queue)) for _ in range(NR_FETCH_WORKERS)]
+    detectors = [Process(target=detect_worker, args=(text_queue, result_queue, cache))
+                 for _ in range(NR_DETECT_WORKERS)]
+    workers = fetchers + detectors
+    for process in workers:
+        process.start()
+    feeder = threading.Thread(target=feed_rows, args=(rows, row_queue, text_queue, fetchers, detectors), daemon=True)
+    feeder.start()
+
+    nr_finished_detectors = 0
+    while nr_finished_detectors < NR_DETECT_WORKERS:
+        try:
+            result = result_queue.get(timeout=LIVENESS_CHECK_INTERVAL)
+        except queue.Empty:
+            result = ()
+        failed = get_failed_workers(workers)
+        if failed:
+            for process in workers:
+                process.terminate()
+            exit_codes = ', '.join(str(process.exitcode) for process in failed)
+            raise RuntimeError('{0} worker process(es) failed with exit code {1}'.format(len(failed), exit_codes))
+        if result is None:
+            nr_finished_detectors += 1
+        elif result:
+            tagging_writer.add_result(*result)
+    feeder.join()
+    for detector in detectors:
+        detector.join()
+
+
+async def tag_rows_http(rows, tagging_writer, cache):
+    """Tag rows using plain HTTP requests instead of a browser, for websites whose server-rendered HTML holds enough
+    text to detect their language.
+    returns the list of rows for which this failed, which still need to be tagged using the browser
+    """
+    rows_by_site = {row[0]: row for row in rows}
+    browser_rows = []
+    loop = asyncio.get_running_loop()
+
+    async def handle_text(site, text):
+        # Detection is CPU-bound, so it runs in other processes while the event loop keeps fetching
+        try:
+            lan_code = (await loop.run_in_executor(detectors, detect_language_cached, site, text, cache))[0] \
+                if text else None
+        except Exception as e:  # Catch problems like a second Unicode error or a broken detection process.
+            logging.warning(' - Retrieving: HTTP text detection failed ({0}), falling back to browser - {1}'
+                            .format(type(e).__name__, site))
+            lan_code = None
+        if lan_code is None:
+            logging.info(' - Retrieving: HTTP text not usable, falling back to browser - ' + site)
+            browser_rows.append(rows_by_site[site])
+            return
+        tagging_writer.add_result(rows_by_site[site], lan_code, None)
+
+    with ProcessPoolExecutor(NR_DETECT_WORKERS) as detectors:
+        await fetch_texts(list(rows_by_site), handle_text, concurrency=HTTP_CONCURRENCY)
+    return browser_rows
 
 
 if __name__ == '__main__':
     logging.info('Current time: ' + time.strftime('%d-%b-%Y_%H%M', time.localtime()))
-    nr_runners = 8
     sample_size = 0
     with open('CRUX-McAfee-Cat.csv', 'r', newline='') as read_obj:
         inp_list = [x for x in list(reader(read_obj)) if x is not None]
-        if sample_size <= 0:
-            to_tag = inp_list
-        else:
-            to_tag = random.sample(inp_list, sample_size)
-        with Pool(nr_runners) as pool:
-            pool.map(tag_row, to_tag)
+    # Skip websites handled in an earlier run, so a restart after a crash only processes the remaining rows
+    already_done = load_progress()
+    inp_list = [x for x in inp_list if x and x[0] not in already_done]
+    logging.info('Skipping {0} websites handled in an earlier run'.format(len(already_done)))
+    if sample_size <= 0:
+        to_tag = inp_list
+    else:
+        to_tag = random.sample(inp_list, min(sample_size, len(inp_list)))
+
+    results_writer = TaggingWriter()
+    # Detected languages by hash of the normalised page text, shared by all detection processes
+    cache_manager = Manager()
+    language_cache = cache_manager.dict()
+    try:
+        if FETCH_MODE == 'http':
+            # Only use a browser for the websites of which plain HTTP did not give a reliable language
+            to_tag = asyncio.run(tag_rows_http(to_tag, results_writer, language_cache))
+        tag_rows_browser(to_tag, results_writer, language_cache)
+    finally:
+        # Also after a failure, so the next run resumes after the results written so far
+        results_writer.close()
     logging.info('Current time: ' + time.strftime('%d-%b-%Y_%H%M', time.localtime()))
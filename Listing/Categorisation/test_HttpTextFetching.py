@@ -0,0 +1,75 @@
+import asyncio
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from HttpTextFetching import extract_visible_text, fetch_texts
+
+PAGE = '''<html><head><title>Title</title><style>p { color: red; }</style></head>
+<body>
+<p>Visible text</p>
+<div hidden><p>Hidden<div><span>nested hidden</span></div> text</p></div>
+<script>var text = "script text";</script>
+<ul><li>First item<li>Second item</ul>
+<div hidden><ul><li>Unclosed hidden item</ul></div>
+<p>After hidden</p>
+</body></html>'''
+PAGE_TEXT = 'Visible text\nFirst item\nSecond item\nAfter hidden'
+
+# Path on the stand-in server: (status, Content-Type, body)
+RESPONSES = {'/page': (200, 'text/html; charset=utf-8', PAGE),
+             '/json': (200, 'application/json', '{"text": "not html"}'),
+             '/missing': (404, 'text/html', '<p>Not found</p>')}
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        status, content_type, body = RESPONSES[self.path]
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.end_headers()
+        self.wfile.write(body.encode('utf-8'))
+
+    def log_message(self, format, *args):
+        pass
+
+
+class VisibleTextParserTest(unittest.TestCase):
+    def test_skips_invisible_elements(self):
+        self.assertEqual(extract_visible_text(PAGE), PAGE_TEXT)
+
+
+class FetchTextsTest(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = 'http://127.0.0.1:{0}'.format(self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def fetch(self, paths, handle_text):
+        asyncio.run(fetch_texts([self.base_url + path for path in paths], handle_text, concurrency=2))
+
+    def test_fetches_visible_text(self):
+        texts = {}
+        self.fetch(['/page', '/json', '/missing'], lambda site, text: texts.update({site: text}))
+        self.assertEqual(texts, {self.base_url + '/page': PAGE_TEXT,
+                                 self.base_url + '/json': '',
+                                 self.base_url + '/missing': ''})
+
+    def test_failing_handler_does_not_stop_other_sites(self):
+        texts = {}
+
+        async def handle_text(site, text):
+            if site.endswith('/json'):
+                raise ValueError('handler failed')
+            texts[site] = text
+
+        self.fetch(['/json', '/page', '/missing'], handle_text)
+        self.assertEqual(set(texts), {self.base_url + '/page', self.base_url + '/missing'})
+
+
+if __name__ == '__main__':
+    unittest.main()
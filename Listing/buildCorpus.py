@@ -0,0 +1,198 @@
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sqlite3
+from multiprocessing import Pool
+
+from matchEntries import rank_origins, write_ranked_corpus
+from originNormalisation import iter_deduplicated, iter_normalised, split_host
+
+CACHE_DIR = '.corpus-cache'
+INDEX_DB = os.path.join(CACHE_DIR, 'indexes.sqlite')
+
+CRUX_FILE = 'BigQuery-Top170k-NL.csv'
+CATEGORIES_FILE = os.path.join('Categorisation', 'Tranco-202106-site_categories.csv')
+LANGUAGES_FILE = os.path.join('Categorisation', 'CRUX-McAfee-Cat_Lan.csv')
+TRANCO_FILE = 'Tranco-P99J-202107.csv'
+CORPUS_FILE = 'Corpus'
+# Part of the signature of every index, increased when the rows read from a source change so old indexes are rebuilt
+INDEX_FORMAT = 2
+
+# McAfee categories selected in CategoryTagging.py. ' Fashion/Beauty,' never matches a single tag, but is kept as-is
+# so the published corpus can be reproduced.
+ACCEPTED_CATEGORIES = [' Auctions/Classifieds', ' Fashion/Beauty,', ' Gambling', ' Online Shopping']
+ACCEPTED_LANGUAGES = ['en', 'nl']
+
+
+def get_file_signature(path: str):
+    """Returns a string that changes whenever the file at path is modified."""
+    stat = os.stat(path)
+    return f'{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}'
+
+
+def iter_category_rows(path: str):
+    """Reads the McAfee categories file, yielding (first level domain, comma-separated tags) tuples."""
+    with open(path, 'r') as categories:
+        for line in categories:
+            clear = line.split('\n')[0]
+            if '\t' in clear:
+                yield clear.split('\t')[0], clear.split('\t')[1]
+
+
+def iter_language_rows(path: str):
+    """Reads the output of LanguageTagging.py, yielding (origin, language code) tuples."""
+    with open(path, 'r', newline='') as languages:
+        for row in csv.reader(languages):
+            if len(row) >= 2:
+                yield row[0], row[1]
+
+
+def iter_tranco_rows(path: str):
+    """Reads a Tranco list, yielding (domain, rank) tuples. The first domain in the list has rank 0."""
+    with open(path, 'r') as tranco:
+        for rank, line in enumerate(tranco):
+            domain = line.strip()
+            if domain:
+                yield domain, rank
+
+
+# When a key occurs more than once, the last category and language entry counts, as in the dicts of
+# CategoryTagging.py, while a domain keeps its first (best) Tranco rank, as in matchEntries.get_rank_index
+INDEXES = {'categories': ('domain TEXT PRIMARY KEY, tags TEXT NOT NULL', iter_category_rows, 'REPLACE'),
+           'languages': ('origin TEXT PRIMARY KEY, language TEXT NOT NULL', iter_language_rows, 'REPLACE'),
+           'tranco': ('domain TEXT PRIMARY KEY, rank INTEGER NOT NULL', iter_tranco_rows, 'IGNORE')}
+
+
+class CorpusIndexes:
+    """
+    On-disk SQLite indexes over the category, language and Tranco files used to build the corpus. An index is only
+    rebuilt when the file it was built from has changed.
+    """
+    def __init__(self, sources: dict, path: str = INDEX_DB):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS sources (name TEXT PRIMARY KEY, signature TEXT NOT NULL)')
+        self.signatures = {}
+        for name, source_path in sources.items():
+            self.signatures[name] = f'{get_file_signature(source_path)}:{INDEX_FORMAT}:{INDEXES[name][2]}'
+            self.__build_index(name, source_path)
+
+    def __build_index(self, name: str, source_path: str):
+        columns, read_rows, on_conflict = INDEXES[name]
+        stored = self.connection.execute('SELECT signature FROM sources WHERE name = ?', (name,)).fetchone()
+        if stored is not None and stored[0] == self.signatures[name]:
+            return
+        print(f'Building {name} index from {source_path}')
+        with self.connection:
+            self.connection.execute(f'DROP TABLE IF EXISTS {name}')
+            self.connection.execute(f'CREATE TABLE {name} ({columns}) WITHOUT ROWID')
+            self.connection.executemany(f'INSERT OR {on_conflict} INTO {name} VALUES (?, ?)', read_rows(source_path))
+            self.connection.execute('INSERT OR REPLACE INTO sources VALUES (?, ?)', (name, self.signatures[name]))
+
+    def lookup(self, name: str, keys: [str]):
+        """Looks up many keys in one of the indexes, returning a dict with the keys that were found."""
+        found = {}
+        for i in range(0, len(keys), 500):
+            key_slice = keys[i:i + 500]
+            key_column = INDEXES[name][0].split(' ')[0]
+            rows = self.connection.execute(
+                f'SELECT * FROM {name} WHERE {key_column} IN ({",".join("?" * len(key_slice))})', key_slice)
+            found.update(rows)
+        return found
+
+
+def normalise_stage(records, params: dict, indexes: CorpusIndexes):
+    """Normalise and deduplicate the origins of the CrUX export, see originNormalisation.py."""
+    with open(params['crux'], 'r') as crux, Pool(params['processes']) as pool:
+        return [[origin] for origin in iter_deduplicated(iter_normalised(crux, pool))]
+
+
+def category_stage(records, params: dict, indexes: CorpusIndexes):
+    """Join origins with their McAfee categories and keep those in an accepted category, like CategoryTagging.py."""
+    domains = [split_host(record[0].split('//')[1])[1] for record in records]
+    categories = indexes.lookup('categories', list(set(domains)))
+    output = []
+    for record, domain in zip(records, domains):
+        if domain not in categories:
+            continue
+        tags = categories[domain].split(',')
+        if any(x in tags for x in params['categories']):
+            output.append([record[0]] + tags)
+    return output
+
+
+def language_stage(records, params: dict, indexes: CorpusIndexes):
+    """Join origins with the language tags found by LanguageTagging.py, dropping origins without a tag."""
+    languages = indexes.lookup('languages', [record[0] for record in records])
+    return [[record[0], languages[record[0]]] + record[1:] for record in records if record[0] in languages]
+
+
+def selection_stage(records, params: dict, indexes: CorpusIndexes):
+    """Keep origins written in one of the accepted languages, like SelectCorpus.py."""
+    return [[record[0]] for record in records if record[1] in params['languages']]
+
+
+def ranking_stage(records, params: dict, indexes: CorpusIndexes):
+    """Order origins by their rank in the Tranco list, see matchEntries.rank_origins."""
+    hosts = [record[0].split('//')[1] for record in records]
+    ranks = indexes.lookup('tranco', list(set(hosts) | {h[4:] for h in hosts if h.startswith('www.')}))
+    return [[origin, rank] for origin, rank in rank_origins([record[0] for record in records], ranks)]
+
+
+STAGES = [('normalise', normalise_stage, ['crux'], []),
+          ('category', category_stage, ['categories'], ['categories']),
+          ('language', language_stage, [], ['languages']),
+          ('selection', selection_stage, ['languages'], []),
+          ('ranking', ranking_stage, [], ['tranco'])]
+
+
+def run_pipeline(params: dict):
+    """
+    Runs all stages in order. The output of every stage is cached under a key derived from the key of the previous
+    stage, the stage's parameters and the signatures of the files it reads, so after changing one parameter only
+    the stages from that point on are recomputed.
+    :return: dict with key=stage name, value=list of records output by that stage
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    indexes = CorpusIndexes({'categories': params['categories_file'],
+                             'languages': params['languages_file'],
+                             'tranco': params['tranco_file']})
+    outputs = {}
+    records = []
+    key = ''
+    for name, stage, param_names, index_names in STAGES:
+        key_data = {'previous': key, 'stage': name,
+                    'params': {p: params[p] if p != 'crux' else get_file_signature(params[p]) for p in param_names},
+                    'indexes': {i: indexes.signatures[i] for i in index_names}}
+        key = hashlib.sha256(json.dumps(key_data, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+        cache_path = os.path.join(CACHE_DIR, f'{name}-{key}.csv')
+        if os.path.exists(cache_path):
+            with open(cache_path, 'r', newline='') as cached:
+                records = list(csv.reader(cached))
+            print(f'{name}: {len(records)} records (cached)')
+        else:
+            records = stage(records, params, indexes)
+            with open(cache_path + '.tmp', 'w', newline='') as cached:
+                csv.writer(cached).writerows(records)
+            os.replace(cache_path + '.tmp', cache_path)
+            print(f'{name}: {len(records)} records')
+        outputs[name] = records
+    return outputs
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the ranked corpus of e-commerce websites from a CrUX export.')
+    parser.add_argument('--crux', default=CRUX_FILE, help='CrUX BigQuery export with one origin per line')
+    parser.add_argument('--categories-file', default=CATEGORIES_FILE, help='tab-separated McAfee categories file')
+    parser.add_argument('--languages-file', default=LANGUAGES_FILE, help='output of LanguageTagging.py')
+    parser.add_argument('--tranco-file', default=TRANCO_FILE, help='Tranco list with one domain per line')
+    parser.add_argument('--categories', nargs='+', default=ACCEPTED_CATEGORIES, help='McAfee categories to keep')
+    parser.add_argument('--languages', nargs='+', default=ACCEPTED_LANGUAGES, help='language codes to keep')
+    parser.add_argument('--processes', type=int, default=os.cpu_count(), help='processes used for normalisation')
+    args = parser.parse_args()
+
+    stage_outputs = run_pipeline(vars(args))
+    with open(CORPUS_FILE, 'w') as corpus:
+        corpus.writelines(record[0] + '\n' for record in stage_outputs['selection'])
+    write_ranked_corpus([(origin, rank) for origin, rank in stage_outputs['ranking']])
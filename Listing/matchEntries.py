@@ -1,11 +1,54 @@
-with open('Corpus', 'r') as inp:
-    with open('Tranco-P99J-202107.csv', 'r') as tranco:
-        dictInput = {}
-        for line in inp:
-            dictInput[line.split('//')[1]] = line
-        with open('Corpus-ranked', 'w') as output:
-            for line in tranco:
-                if line in dictInput:
-                    output.write(dictInput[line])
-                if f'www.{line}' in dictInput:
-                    output.write(dictInput[f'www.{line}'])
+CORPUS_FILE = 'Corpus'
+TRANCO_FILE = 'Tranco-P99J-202107.csv'
+RANKED_CORPUS_FILE = 'Corpus-ranked'
+RANKS_FILE = 'Corpus-ranked.csv'
+
+
+def get_rank_index(tranco_path: str):
+    """
+    Reads a Tranco list into a rank index.
+    :param tranco_path: path to a Tranco list with one domain per line
+    :return: dict with key=domain, value=rank of the domain, the first domain in the list having rank 0 like in
+    Analysis/fileUtils.get_tranco_rank_index
+    """
+    ranks = {}
+    with open(tranco_path, 'r') as tranco:
+        for rank, line in enumerate(tranco):
+            ranks.setdefault(line.strip(), rank)
+    return ranks
+
+
+def rank_origins(origins: [str], ranks: dict):
+    """
+    Orders origins by their rank in the Tranco list. Origins are matched on their host, or on their host without
+    'www.'; when both 'domain' and 'www.domain' are in origins, 'domain' comes first. Origins that are not in the
+    list are dropped.
+    :param origins: list of origins such as 'https://www.example.com'
+    :param ranks: rank index, see get_rank_index. Only needs to contain the hosts of origins.
+    :return: list of (origin, rank) tuples, in rank order
+    """
+    ranked = []
+    for origin in origins:
+        host = origin.split('//')[1]
+        if host in ranks:
+            ranked.append((ranks[host], 0, origin))
+        elif host.startswith('www.') and host[4:] in ranks:
+            ranked.append((ranks[host[4:]], 1, origin))
+    return [(origin, rank) for rank, _, origin in sorted(ranked)]
+
+
+def write_ranked_corpus(ranked: [tuple]):
+    """
+    Writes the ranked corpus, as crawler input with one origin per line and as 'url,rank' pairs. Ranks start at 0, like
+    the ranks in the results of Analysis/postProcessing.py.
+    """
+    with open(RANKED_CORPUS_FILE, 'w') as output:
+        output.writelines(f'{origin}\n' for origin, _ in ranked)
+    with open(RANKS_FILE, 'w') as output:
+        output.writelines(f'{origin},{rank}\n' for origin, rank in ranked)
+
+
+if __name__ == '__main__':
+    with open(CORPUS_FILE, 'r') as inp:
+        corpus = [line.strip() for line in inp if '//' in line]
+    write_ranked_corpus(rank_origins(corpus, get_rank_index(TRANCO_FILE)))
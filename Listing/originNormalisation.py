@@ -0,0 +1,104 @@
+import os
+import sys
+from collections import deque
+from itertools import islice
+
+import tld
+
+# The fingerprint set is shared with the deduplication of scraped links in ProductUrls, through the shared package in
+# the root of the repository
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_PATH not in sys.path:
+    sys.path.append(REPO_PATH)
+from shared.fingerprintSet import FingerprintSet, get_fingerprint
+
+CHUNK_SIZE = 10000
+MAX_PENDING_CHUNKS = 32
+
+
+def split_host(host: str):
+    """
+    Splits a host name into its subdomain and first level domain.
+    :return: tuple of subdomain and first level domain
+    """
+    url = tld.get_tld(host, fix_protocol=True, as_object=True)
+    return url.subdomain, url.fld
+
+
+def normalise_origin(line: str):
+    """
+    Normalises an origin from the CrUX BigQuery export: the subdomain is dropped, except for a 'www.' prefix and
+    language subdomains such as 'en.' or 'nl.' (together with the label in front of them).
+    :param line: line from the export, containing an origin such as 'https://www.shop.example.com'
+    :return: tuple of the normalised origin and fingerprints of the two domains it is deduplicated on (its first level
+    domain and the domain including the kept subdomain), or None if the line does not contain a valid origin
+    """
+    if len(line.split('//')) < 2:
+        print(f'found url without "//", skipping it: {line.strip()}')
+        return None
+    scheme = line.split('//')[0] + '//'
+    host = line.split('//')[1].split('/')[0].strip()
+    try:
+        subdomain, fl_domain = split_host(host)
+    except (tld.exceptions.TldBadUrl, tld.exceptions.TldDomainNotFound):
+        return None
+    prefix = ''
+    if 'www' in line.split('//')[1].split('.'):
+        prefix = 'www.'
+    sliced_subdomain = ''
+    subdomain_labels = subdomain.split('.')
+    for x in ['en', 'nl']:
+        if x in subdomain_labels:
+            # 'en' was always looked up here originally, so it is still preferred when both are present
+            index = subdomain_labels.index('en' if 'en' in subdomain_labels else x)
+            sliced_subdomain = '.'.join(subdomain_labels[index - 1:])
+    return scheme + prefix + sliced_subdomain + fl_domain, get_fingerprint(fl_domain), \
+        get_fingerprint(sliced_subdomain + fl_domain)
+
+
+def normalise_chunk(lines: [str]):
+    """Normalises a chunk of lines from the CrUX BigQuery export. See normalise_origin."""
+    return [normalise_origin(line) for line in lines]
+
+
+def iter_normalised(lines, pool=None):
+    """
+    Normalises lines from the CrUX BigQuery export in chunks, spread over a process pool if one is given.
+    Results are yielded in input order and at most MAX_PENDING_CHUNKS chunks are in flight, so memory use does not
+    depend on the size of the input.
+    :param lines: iterable of lines
+    :param pool: optional multiprocessing.Pool
+    :return: generator of the results of normalise_origin, one per line
+    """
+    lines = iter(lines)
+    pending = deque()
+    while True:
+        chunk = list(islice(lines, CHUNK_SIZE))
+        if not chunk:
+            break
+        if pool is None:
+            yield from normalise_chunk(chunk)
+            continue
+        pending.append(pool.apply_async(normalise_chunk, (chunk,)))
+        if len(pending) >= MAX_PENDING_CHUNKS:
+            yield from pending.popleft().get()
+    while pending:
+        yield from pending.popleft().get()
+
+
+def iter_deduplicated(normalised):
+    """
+    Drops origins whose first level domain was seen before. The first occurrence in input order wins, so the output
+    does not depend on how the input was split over processes.
+    :param normalised: iterable of results of normalise_origin
+    :return: generator of normalised origins
+    """
+    seen = FingerprintSet()
+    for result in normalised:
+        if result is None:
+            continue
+        origin, fl_domain, sliced_domain = result  # Fingerprints, computed by the worker processes
+        if fl_domain not in seen:
+            seen.add(fl_domain)
+            seen.add(sliced_domain)
+            yield origin
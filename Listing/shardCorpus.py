@@ -0,0 +1,124 @@
+import argparse
+import glob
+import heapq
+import json
+import os
+import re
+import statistics
+from collections import defaultdict
+
+from tld import get_fld
+
+RANKED_CORPUS_FILE = 'Corpus-ranked'
+CRAWL_DATA_PATH = os.path.join('..', 'Analysis', 'Corpus-crawl')
+SHARD_FILE_FORMAT = '{0}.shard-{1}-of-{2}'
+# Cost of a site without any crawl history, as a multiple of the median cost of sites with one
+UNKNOWN_COST_FACTOR = 1.0
+
+RE_ANSI_ESCAPE = re.compile(r'\x1b\[[0-9;]*m')
+# Line logged by crawlerConductor.js after every page: 'Processing "https://www.example.com/" took 12.34s.'
+RE_PAGE_TIME = re.compile(r'Processing "([^"]+)" took ([0-9.]+)s\.')
+
+
+def get_site(url: str):
+    """Returns the first level domain of a URL, which crawl-cli uses to name the data-directory of a site."""
+    return get_fld(url, fail_silently=True) or url.split('//')[-1].split('/')[0]
+
+
+def read_crawl_history(crawl_dirs: [str]):
+    """
+    Collects per-site statistics from previous crawls: the number of visited pages in the admin-files, the total size
+    of the data-files and the wall time spent on the site's pages according to the crawl logs.
+    :param crawl_dirs: list of crawl output folders, each containing data.<site> directories and *.log files
+    :return: dict with key=site, value=dict with 'pages', 'bytes' and 'seconds' (each only present if known)
+    """
+    history = defaultdict(dict)
+    for crawl_dir in crawl_dirs:
+        for entry in os.scandir(crawl_dir):
+            if entry.is_dir() and entry.name.startswith('data.'):
+                site = entry.name[5:]
+                for data_file in os.scandir(entry.path):
+                    if data_file.name.startswith('admin.'):
+                        with open(data_file.path, 'r', encoding='utf-8') as admin:
+                            pages = len(json.load(admin).get('visited', {}))
+                        history[site]['pages'] = history[site].get('pages', 0) + pages
+                    elif data_file.name.endswith('.json') and not data_file.name.startswith(('links', 'metadata')):
+                        history[site]['bytes'] = history[site].get('bytes', 0) + data_file.stat().st_size
+            elif entry.is_file() and entry.name.endswith('.log'):
+                with open(entry.path, 'r', encoding='utf-8', errors='replace') as log:
+                    for line in log:
+                        match = RE_PAGE_TIME.search(RE_ANSI_ESCAPE.sub('', line))
+                        if match:
+                            site = get_site(match.group(1))
+                            history[site]['seconds'] = history[site].get('seconds', 0.0) + float(match.group(2))
+    return history
+
+
+def estimate_costs(sites: [str], history: dict):
+    """
+    Estimates the crawl time of every site in seconds. Logged wall time is used when available. Otherwise, the number
+    of visited pages or the size of the data-files is converted to seconds using the median rate of the sites for
+    which both are known. Sites without any history get the median cost times UNKNOWN_COST_FACTOR.
+    :return: dict with key=site, value=estimated cost
+    """
+    timed = [h for h in history.values() if h.get('seconds')]
+    seconds_per = {}
+    for measure in ['pages', 'bytes']:
+        rates = [h['seconds'] / h[measure] for h in timed if h.get(measure)]
+        seconds_per[measure] = statistics.median(rates) if rates else None
+    if seconds_per['pages'] is None:
+        seconds_per['pages'] = 1.0  # Without any logs, sites are balanced on the number of pages
+
+    costs = {}
+    for site in sites:
+        site_history = history.get(site, {})
+        if site_history.get('seconds'):
+            costs[site] = site_history['seconds']
+        elif site_history.get('pages'):
+            costs[site] = site_history['pages'] * seconds_per['pages']
+        elif site_history.get('bytes') and seconds_per['bytes'] is not None:
+            costs[site] = site_history['bytes'] * seconds_per['bytes']
+    default_cost = statistics.median(costs.values()) * UNKNOWN_COST_FACTOR if costs else 1.0
+    for site in sites:
+        costs.setdefault(site, default_cost)
+    return costs
+
+
+def shard_sites(costs: dict, nr_shards: int):
+    """
+    Divides sites over shards so that the total cost of every shard is about the same, using the longest processing
+    time first heuristic: the most expensive remaining site always goes to the shard with the lowest total so far.
+    :return: list of (total cost, set of sites) tuples, one per shard
+    """
+    heap = [(0.0, i) for i in range(nr_shards)]
+    shards = [set() for _ in range(nr_shards)]
+    totals = [0.0] * nr_shards
+    for site in sorted(costs, key=lambda s: (-costs[s], s)):
+        total, i = heapq.heappop(heap)
+        shards[i].add(site)
+        totals[i] = total + costs[site]
+        heapq.heappush(heap, (totals[i], i))
+    return list(zip(totals, shards))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Split the ranked corpus into shards with about equal crawl time.')
+    parser.add_argument('shards', type=int, help='number of shards, one per crawl node')
+    parser.add_argument('--corpus', default=RANKED_CORPUS_FILE, help='corpus with one origin per line')
+    parser.add_argument('--crawl-data', nargs='*', default=[CRAWL_DATA_PATH],
+                        help='output folders of previous crawls, used to estimate the cost of every site')
+    args = parser.parse_args()
+
+    with open(args.corpus, 'r') as inp:
+        corpus = [line.strip() for line in inp if line.strip()]
+    crawl_history = read_crawl_history([d for d in args.crawl_data if os.path.isdir(d)])
+    site_costs = estimate_costs(list({get_site(origin) for origin in corpus}), crawl_history)
+
+    for old_shard in glob.glob(SHARD_FILE_FORMAT.format(args.corpus, '*', '*')):
+        os.remove(old_shard)
+    for i, (shard_cost, sites_in_shard) in enumerate(shard_sites(site_costs, args.shards)):
+        shard_file = SHARD_FILE_FORMAT.format(args.corpus, i + 1, args.shards)
+        with open(shard_file, 'w') as out:
+            # Every shard keeps the rank order of the corpus
+            out.writelines(origin + '\n' for origin in corpus if get_site(origin) in sites_in_shard)
+        print(f'{shard_file}: {len(sites_in_shard)} sites, estimated {shard_cost / 3600:.1f}h')
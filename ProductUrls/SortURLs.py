@@ -1,18 +1,28 @@
 import json
 import numpy as np
-import pickle
 import glob
+import itertools
 import urllib.parse as parse
 import re
 import os
+import time
 import warnings
+from contextlib import contextmanager
+from urlCache import URLScoreCache, get_model_version
+from urlNormalisation import SeenSet, normalise_url
+from logRegModel import LogRegModel, load_model_file
+from linksReader import iter_internal_links
 warnings.filterwarnings('ignore', '.*SGDClassifier.*')
 
 DATA_FOLDER = os.path.join('sampledata')
 MODEL_PATH = os.path.join('models', 'log-reg-mod.pkl')
+EXPORTED_MODEL_PATH = os.path.join('models', 'log-reg-mod.json')
 
 ACCEPTABLE_PROBABILITY = 0.5
 NR_DESIRED_LINKS = 10
+USE_SCORE_CACHE = True
+SCORING_BATCH_SIZE = 10000
+MODEL: LogRegModel = None
 
 
 def get_url_path(url: str):
@@ -56,70 +66,175 @@ def get_url_features(url: str):
            contains_product, contains_category, longest_num
 
 
-def get_prod_likelihoods(urllist: [str]) -> dict:
+@contextmanager
+def timed_stage(stage_times: dict, stage: str):
+    """Adds the time spent in the with-block to stage_times[stage], if stage_times is given."""
+    if stage_times is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_times[stage] += time.perf_counter() - start
+
+
+def get_model_path():
+    """Returns the path of the model file load_model uses: the exported coefficients if present, the pickle otherwise."""
+    return EXPORTED_MODEL_PATH if os.path.exists(EXPORTED_MODEL_PATH) else MODEL_PATH
+
+
+def load_model():
+    """
+    Loads the URL classifier. Uses the exported coefficients (see exportModel.py) when available, so sklearn does
+    not need to be imported. Falls back to unpickling the sklearn model otherwise.
+    """
+    global MODEL
+    if MODEL is None:
+        model_path = get_model_path()
+        if model_path == EXPORTED_MODEL_PATH:
+            MODEL = load_model_file(model_path)
+        else:
+            import pickle
+            with open(model_path, 'rb') as model_file:
+                MODEL = pickle.load(model_file)
+    return MODEL
+
+
+def get_prod_likelihoods(urllist: [str], cache: URLScoreCache = None, stage_times: dict = None) -> dict:
     """
     Calculates probabilities of a URL being link to a product page, for a list of URLs
     :param urllist: List of URLs as strings
+    :param cache: optional URLScoreCache. URLs found in it are not scored again, newly scored URLs are added to it.
+    :param stage_times: optional defaultdict(float) to which time spent featurizing and predicting is added
     :return: A dict with key=url, value=probability
     """
-    feature_list = []
-    for url in urllist:
-        feature_list.append(get_url_features(url))
-    feature_array = np.asarray(feature_list)
-    model_path = MODEL_PATH
-    clf = pickle.load(open(model_path, 'rb'))
-    proba = clf.predict_proba(feature_array)
-    return dict(zip(urllist, proba[:, 1]))
-
-
-def write_log(text: str):
-    log_location = DATA_FOLDER
+    likelihoods = cache.get_many(urllist) if cache is not None else {}
+    to_score = [url for url in urllist if url not in likelihoods]
+    if to_score:
+        likelihoods.update(score_urls(to_score, cache, stage_times))
+    # Keep the order of urllist, so ties in probability are resolved the same way with and without a cache
+    return {url: likelihoods[url] for url in urllist}
+
+
+def score_urls(urllist: [str], cache: URLScoreCache = None, stage_times: dict = None) -> dict:
+    """Featurizes and scores the given URLs with the model, adding the results to cache if given."""
+    with timed_stage(stage_times, 'featurize'):
+        feature_list = []
+        for url in urllist:
+            feature_list.append(get_url_features(url))
+        feature_array = np.asarray(feature_list)
+    with timed_stage(stage_times, 'predict'):
+        clf = load_model()
+        proba = clf.predict_proba(feature_array)
+    scored = dict(zip(urllist, proba[:, 1]))
+    if cache is not None:
+        cache.put_many(dict(zip(urllist, feature_list)), scored)
+    return scored
+
+
+def write_log(text: str, log_location: str = DATA_FOLDER):
     log_path = glob.glob(os.path.join(log_location, '*.log'))[0]
     with open(log_path, 'a') as log:
         log.write(text)
 
 
-def rename_log():
-    log_location = DATA_FOLDER
+def rename_log(log_location: str = DATA_FOLDER):
     log_file_paths = glob.glob(os.path.join(log_location, '*.log'))
     log_path = [x for x in log_file_paths if not os.path.split(x)[1].startswith('_')][0]
     log_name = os.path.split(log_path)[1]
     os.rename(log_path, os.path.join(log_location, f'_{len(log_file_paths)}_{log_name}'))
 
 
-dataDirectories = [x for x in os.listdir(DATA_FOLDER) if x.startswith('data.')]
-files = []
-# For every links-file in every data-directory, get the list of scraped urls and get probabilities
-for directory in dataDirectories:
-    directory_path = os.path.join(DATA_FOLDER, directory)
-    prob_dicts = []
-    files = glob.glob(os.path.join(directory_path, 'links.*.json'))
-    for file in files:
-        with open(file, 'r') as inp:
-            url_list = list(set(json.load(inp)['internal']))
-            if not url_list:
-                continue
-            prob_dicts.append(get_prod_likelihoods(url_list))
-
-    # After tagging all gathered links in a specific data-directory, save the results to the admin-file
+def select_links(to_crawl: dict, number: int = NR_DESIRED_LINKS):
+    """
+    Selects the links with the highest probability. Of the links tied at the lowest selected probability, the ones
+    with the highest normalised URL are selected, so the selection does not depend on the order links were scraped in.
+    :param to_crawl: dict with key=link, value=probability
+    :param number: maximum number of links to select
+    :return: dict with key=link, value=probability of the selected links, in order of probability
+    """
+    to_crawl_sorted = sorted(to_crawl.items(), key=lambda x: x[1])
+    if len(to_crawl_sorted) <= number:
+        return dict(to_crawl_sorted)
+    # Only the links tied at the cutoff need their URL compared
+    cutoff = to_crawl_sorted[-number][1]
+    tied = sorted((x for x in to_crawl_sorted if x[1] == cutoff), key=lambda x: normalise_url(x[0]))
+    above = [x for x in to_crawl_sorted[-number:] if x[1] > cutoff]
+    return dict(tied[len(tied) - (number - len(above)):] + above)
+
+
+def process_directory(directory_path: str, cache: URLScoreCache = None, stage_times: dict = None):
+    """
+    Scores all links scraped into the links-files of a data-directory and saves the most likely product pages to
+    the 'tocrawl' list of its admin-file.
+    :param directory_path: path to the data-directory
+    :param cache: optional URLScoreCache used when scoring links
+    :param stage_times: optional defaultdict(float) to which time spent per stage of the pipeline is added
+    :return: number of links read from the links-files of this directory
+    """
+    nr_links = 0
     admin_file = glob.glob(os.path.join(directory_path, 'admin.*'))[0]
     with open(admin_file, 'r+') as admin:
-        administration: dict = json.load(admin)
+        with timed_stage(stage_times, 'json_load'):
+            administration: dict = json.load(admin)
         to_crawl: dict[str, int] = administration['tocrawl']
         visited: dict[str, int] = administration['visited']
 
-        for dictionary in prob_dicts:
-            for k in dictionary:
-                if k in visited.keys():
+        # Links that only differ in e.g. fragment or query-parameter order from a visited link, a link that is already
+        # to be crawled, or a link that was already seen in an earlier links-file of this directory, are not scored again.
+        seen_urls = SeenSet(capacity=len(visited) + len(to_crawl))
+        for k in itertools.chain(visited.keys(), to_crawl.keys()):
+            seen_urls.add(k)
+        files = glob.glob(os.path.join(directory_path, 'links.*.json'))
+        for file in files:
+            # Links are read and scored in fixed-size batches, so memory use does not grow with the size of the file
+            batches = iter_internal_links(file, SCORING_BATCH_SIZE)
+            while True:
+                with timed_stage(stage_times, 'json_load'):
+                    internal_links = next(batches, None)
+                if internal_links is None:
+                    break
+                nr_links += len(internal_links)
+                with timed_stage(stage_times, 'dedup'):
+                    # Exact duplicates are dropped first, as they are by far the most common and cheapest to find
+                    url_list = [u for u in map(normalise_url, dict.fromkeys(internal_links))
+                                if seen_urls.add(u, normalised=True)]
+                if not url_list:
                     continue
-                to_crawl.update({k: dictionary[k]})
-        to_crawl_sorted = sorted(list(to_crawl.items()), key=lambda x: x[1])
-        to_crawl = dict(to_crawl_sorted[-NR_DESIRED_LINKS:])
-        if len(to_crawl_sorted) < 10:
-            write_log(f'{os.path.split(admin_file)[1]} contains less than 10 links\n')
-
-        administration['tocrawl'] = to_crawl
-        admin.seek(0)
-        json.dump(administration, admin, indent=4)
-        admin.truncate()
-rename_log()
+                # Add the scored links of this batch to the admin data right away, instead of keeping all batches
+                for k, probability in get_prod_likelihoods(url_list, cache, stage_times).items():
+                    if k in visited.keys():
+                        continue
+                    to_crawl.update({k: probability})
+
+        # After tagging all gathered links in a specific data-directory, save the results to the admin-file
+        with timed_stage(stage_times, 'admin_write'):
+            nr_links_to_crawl = len(to_crawl)
+            to_crawl = select_links(to_crawl)
+            if nr_links_to_crawl < 10:
+                write_log(f'{os.path.split(admin_file)[1]} contains less than 10 links\n',
+                          os.path.dirname(directory_path))
+
+            administration['tocrawl'] = to_crawl
+            admin.seek(0)
+            json.dump(administration, admin, indent=4)
+            admin.truncate()
+    return nr_links
+
+
+def main():
+    """Selects the links to crawl next for every data-directory in DATA_FOLDER."""
+    dataDirectories = [x for x in os.listdir(DATA_FOLDER) if x.startswith('data.')]
+    score_cache = URLScoreCache(get_model_version(get_model_path())) if USE_SCORE_CACHE else None
+    # For every links-file in every data-directory, get the list of scraped urls and get probabilities
+    for directory in dataDirectories:
+        process_directory(os.path.join(DATA_FOLDER, directory), score_cache)
+    if score_cache is not None:
+        print(score_cache)
+        score_cache.close()
+    rename_log()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+import argparse
+import glob
+import json
+import math
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+
+import SortURLs
+from urlCache import URLScoreCache, get_model_version
+from urlNormalisation import canonicalise_url
+
+# The tocrawl lists of the sampledata as produced by the SortURLs.py from before the scoring pipeline was optimised,
+# so the optimised pipeline is checked against the original one and not against itself. The original was only changed
+# to select tied links like select_links and to skip scraped links with the canonical form of a link it already has.
+REFERENCE_PATH = os.path.join('models', 'benchmark-reference.json')
+# Probabilities may differ by rounding, as links are scored in batches of a different size than before
+PROBABILITY_TOLERANCE = 1e-9
+STAGES = ['json_load', 'dedup', 'featurize', 'predict', 'admin_write']
+
+
+def copy_sampledata(source: str, target: str, scale: int):
+    """
+    Copies all data-directories in source to target. With scale > 1, every data-directory is copied scale times,
+    with copies named 'data.<site>~<i>', to benchmark on a larger synthetic version of the sample data.
+    :return: dict with key=name of the copied directory, value=name of the directory it was copied from
+    """
+    copied = {}
+    for directory in sorted(x for x in os.listdir(source) if x.startswith('data.')):
+        for i in range(scale):
+            copy_name = directory if i == 0 else f'{directory}~{i}'
+            shutil.copytree(os.path.join(source, directory), os.path.join(target, copy_name))
+            copied[copy_name] = directory
+    # SortURLs logs sites with too few links to the crawl's log file, so the copy needs one
+    open(os.path.join(target, 'benchmark.log'), 'w').close()
+    return copied
+
+
+def get_tocrawl_lists(data_folder: str, copied: dict):
+    """Returns a dict with key=copied directory, value=the 'tocrawl' dict (link: probability) of its admin-file."""
+    tocrawl_lists = {}
+    for copy_name in copied:
+        admin_file = glob.glob(os.path.join(data_folder, copy_name, 'admin.*'))[0]
+        with open(admin_file, 'r') as admin:
+            tocrawl_lists[copy_name] = dict(sorted(json.load(admin)['tocrawl'].items()))
+    return tocrawl_lists
+
+
+def matches_reference(tocrawl: dict, reference: dict):
+    """
+    Checks whether a 'tocrawl' dict equals the reference: links may differ in form as long as they have the same
+    canonical form, and probabilities may differ by rounding. All links are compared, also the ones tied at the lowest
+    probability, as both pipelines break ties by URL (see SortURLs.select_links).
+    """
+    if len(tocrawl) != len(reference):
+        return False
+    canonical_tocrawl = {canonicalise_url(url): probability for url, probability in tocrawl.items()}
+    canonical_reference = {canonicalise_url(url): probability for url, probability in reference.items()}
+    return canonical_tocrawl.keys() == canonical_reference.keys() and \
+        all(math.isclose(probability, canonical_reference[url], rel_tol=PROBABILITY_TOLERANCE)
+            for url, probability in canonical_tocrawl.items())
+
+
+def run_benchmark(data_folder: str, copied: dict, use_cache: bool, trace_memory: bool):
+    """Runs the SortURLs pipeline over every copied data-directory and returns the measured statistics."""
+    stage_times = defaultdict(float)
+    cache = None
+    if use_cache:
+        cache = URLScoreCache(get_model_version(SortURLs.get_model_path()),
+                              path=os.path.join(data_folder, 'cache.sqlite'))
+    if trace_memory:
+        tracemalloc.start()
+    nr_links = 0
+    start = time.perf_counter()
+    for copy_name in copied:
+        nr_links += SortURLs.process_directory(os.path.join(data_folder, copy_name), cache, stage_times)
+    wall_time = time.perf_counter() - start
+    stats = {'directories': len(copied),
+             'links': nr_links,
+             'wall_time_s': round(wall_time, 3),
+             'links_per_s': round(nr_links / wall_time, 1) if wall_time else 0.0,
+             'stage_time_s': {stage: round(stage_times[stage], 3) for stage in STAGES},
+             'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+    if trace_memory:
+        stats['traced_peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 1)
+        tracemalloc.stop()
+    if cache is not None:
+        stats['cache'] = str(cache)
+        cache.close()
+    return stats
+
+
+def compare_to_reference(tocrawl_lists: dict, copied: dict, reference: dict):
+    """Returns a list of copied directories whose 'tocrawl' list differs from the reference of their original."""
+    return [copy_name for copy_name, original in copied.items()
+            if original in reference and not matches_reference(tocrawl_lists[copy_name], reference[original])]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the SortURLs scoring pipeline on a copy of sampledata.')
+    parser.add_argument('--source', default=SortURLs.DATA_FOLDER, help='folder containing the data-directories')
+    parser.add_argument('--scale', type=int, default=1, help='number of copies of every data-directory to score')
+    parser.add_argument('--cache', action='store_true', help='use a fresh URLScoreCache during the run')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='also report peak Python heap usage using tracemalloc (slows down the run)')
+    parser.add_argument('--reference', default=REFERENCE_PATH, help='file with the expected tocrawl lists')
+    parser.add_argument('--write-reference', metavar='PATH',
+                        help='save the tocrawl lists of this run to PATH instead of checking them, e.g. to compare '
+                             'two versions of the pipeline (refuses to overwrite the committed reference)')
+    parser.add_argument('--output', help='save the benchmark statistics as JSON to this file')
+    args = parser.parse_args()
+
+    if args.write_reference and os.path.abspath(args.write_reference) == os.path.abspath(REFERENCE_PATH):
+        sys.exit(f'{REFERENCE_PATH} holds the tocrawl lists of the original pipeline, write to another path')
+
+    with tempfile.TemporaryDirectory() as work_folder:
+        copied_dirs = copy_sampledata(args.source, work_folder, args.scale)
+        benchmark_stats = run_benchmark(work_folder, copied_dirs, args.cache, args.trace_memory)
+        result_lists = get_tocrawl_lists(work_folder, copied_dirs)
+
+    print(json.dumps(benchmark_stats, indent=4))
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(benchmark_stats, output, indent=4)
+
+    if args.write_reference:
+        with open(args.write_reference, 'w') as reference_file:
+            json.dump({k: v for k, v in result_lists.items() if k == copied_dirs[k]}, reference_file, indent=1)
+        print(f'Saved reference tocrawl lists to {args.write_reference}')
+    elif os.path.exists(args.reference):
+        with open(args.reference, 'r') as reference_file:
+            mismatches = compare_to_reference(result_lists, copied_dirs, json.load(reference_file))
+        if mismatches:
+            print(f'tocrawl lists differ from reference for {len(mismatches)} directories, e.g. {mismatches[:5]}')
+            sys.exit(1)
+        print('All tocrawl lists match the reference')
+    else:
+        print(f'No reference found at {args.reference}, create one with --write-reference PATH')
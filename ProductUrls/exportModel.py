@@ -0,0 +1,27 @@
+import hashlib
+import os
+import pickle
+import warnings
+
+import numpy as np
+
+from logRegModel import load_model_file, write_model_file
+warnings.filterwarnings('ignore', '.*SGDClassifier.*')
+
+MODEL_PATH = os.path.join('models', 'log-reg-mod.pkl')
+EXPORT_PATH = os.path.join('models', 'log-reg-mod.json')
+
+# Export the weights and bias of the pickled sklearn model, so SortURLs can score URLs without importing sklearn.
+with open(MODEL_PATH, 'rb') as model_file:
+    model_bytes = model_file.read()
+clf = pickle.loads(model_bytes)
+if clf.coef_.shape != (1, clf.n_features_in_) or len(clf.classes_) != 2:
+    raise ValueError(f'Only binary linear models can be exported, got coef_ of shape {clf.coef_.shape}')
+write_model_file(EXPORT_PATH, clf.coef_[0], clf.intercept_[0], clf.classes_, hashlib.sha256(model_bytes).hexdigest())
+
+# Check that the exported model gives the same probabilities as the original on a spread of feature vectors
+check_features = np.random.default_rng(0).integers(0, 200, size=(1000, clf.n_features_in_))
+if not np.allclose(clf.predict_proba(check_features), load_model_file(EXPORT_PATH).predict_proba(check_features),
+                   rtol=1e-12, atol=0):
+    raise ValueError('Exported model does not reproduce the probabilities of the pickled model')
+print(f'Exported {MODEL_PATH} to {EXPORT_PATH}')
@@ -0,0 +1,128 @@
+import json
+import re
+
+CHUNK_SIZE = 10000
+READ_SIZE = 1 << 16
+
+RE_NON_WHITESPACE = re.compile(r'\S')
+RE_STRUCTURAL_CHAR = re.compile(r'["\[\]{}]')
+# Any character that cannot be part of a JSON number, so a number followed by one of them is complete
+RE_NUMBER_END = re.compile(r'[^0-9.eE+\-]')
+
+
+class JSONStream:
+    """
+    Minimal incremental reader over a JSON text file. Only keeps the part of the file in memory that has not been
+    consumed yet, so single values can be read from files that are too large to json.load at once.
+    """
+    def __init__(self, file, read_size: int = READ_SIZE):
+        self.file = file
+        self.read_size = read_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def __read_more(self):
+        """Reads the next block of the file into the buffer, dropping everything that was already consumed."""
+        if self.eof:
+            raise ValueError('Unexpected end of JSON input')
+        block = self.file.read(self.read_size)
+        if not block:
+            self.eof = True
+        self.buffer = self.buffer[self.pos:] + block
+        self.pos = 0
+
+    def peek(self):
+        """Skips whitespace and returns the next character, without consuming it."""
+        while True:
+            match = RE_NON_WHITESPACE.search(self.buffer, self.pos)
+            if match:
+                self.pos = match.start()
+                return self.buffer[self.pos]
+            self.pos = len(self.buffer)
+            self.__read_more()
+
+    def expect(self, characters: str):
+        """Consumes the next character and returns it, raising a ValueError if it is not one of characters."""
+        char = self.peek()
+        if char not in characters:
+            raise ValueError(f'Expected one of {characters!r} but found {char!r}')
+        self.pos += 1
+        return char
+
+    def read_value(self):
+        """Reads and returns the next complete JSON value. Meant for small values such as strings and numbers."""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # A number that runs up to the end of the buffer may continue in the next block, e.g. '1.' of '1.5e10'
+                is_number = isinstance(value, (int, float)) and not isinstance(value, bool)
+                if self.eof or not is_number or RE_NUMBER_END.search(self.buffer, end):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                pass
+            self.__read_more()
+
+    def skip_value(self):
+        """Consumes the next JSON value without building it, using constant memory for arrays and objects."""
+        if self.peek() not in '[{':
+            self.read_value()
+            return
+        depth = 0
+        while True:
+            match = RE_STRUCTURAL_CHAR.search(self.buffer, self.pos)
+            if not match:
+                self.pos = len(self.buffer)
+                self.__read_more()
+                continue
+            self.pos = match.start()
+            char = match.group()
+            if char == '"':
+                self.read_value()
+                continue
+            self.pos += 1
+            depth += 1 if char in '[{' else -1
+            if depth == 0:
+                return
+
+
+def iter_internal_links(links_path: str, chunk_size: int = CHUNK_SIZE):
+    """
+    Streams the 'internal' list of a links-file in chunks, without loading the rest of the file into memory.
+    Reading stops as soon as the 'internal' list has been read, so the 'external' list is never parsed if it comes
+    after it, and is skipped in constant memory if it comes before it.
+    :param links_path: path to a links.*.json file
+    :param chunk_size: maximum number of links per yielded chunk
+    :return: generator of lists of links, as strings
+    """
+    with open(links_path, 'r') as links_file:
+        stream = JSONStream(links_file)
+        stream.expect('{')
+        if stream.peek() == '}':
+            return
+        while True:
+            key = stream.read_value()
+            stream.expect(':')
+            if key != 'internal':
+                stream.skip_value()
+            else:
+                stream.expect('[')
+                chunk = []
+                if stream.peek() != ']':
+                    while True:
+                        chunk.append(stream.read_value())
+                        if len(chunk) >= chunk_size:
+                            yield chunk
+                            chunk = []
+                        if stream.expect(',]') == ']':
+                            break
+                else:
+                    stream.expect(']')
+                if chunk:
+                    yield chunk
+                return
+            if stream.expect(',}') == '}':
+                return
@@ -0,0 +1,60 @@
+import json
+
+import numpy as np
+
+MODEL_FILE_FORMAT_VERSION = 1
+
+
+class LogRegModel:
+    """
+    Dependency-free stand-in for the pickled sklearn logistic regression (SGDClassifier with log loss), using only the
+    exported weights and bias. predict_proba gives the same probabilities as the sklearn model it was exported from.
+    """
+    def __init__(self, coef: [float], intercept: float, classes: [int] = (0, 1), version: str = ''):
+        self.coef_ = np.asarray(coef, dtype=np.float64)
+        self.intercept_ = float(intercept)
+        self.classes_ = np.asarray(classes)
+        self.version = version
+
+    def decision_function(self, feature_array):
+        return np.asarray(feature_array, dtype=np.float64) @ self.coef_ + self.intercept_
+
+    def predict_proba(self, feature_array):
+        """
+        Calculates class probabilities in the same way sklearn does for a binary linear classifier with log loss.
+        :param feature_array: 2D array-like with one row of features per URL
+        :return: 2D numpy array with columns P(class 0) and P(class 1)
+        """
+        prob = 1.0 / (1.0 + np.exp(-self.decision_function(feature_array)))
+        return np.vstack([1 - prob, prob]).T
+
+
+def write_model_file(path: str, coef: [float], intercept: float, classes: [int], source_sha256: str):
+    """
+    Writes the parameters of a binary linear model to a small versioned JSON file.
+    :param path: location of the output file
+    :param coef: list of feature weights
+    :param intercept: bias of the model
+    :param classes: class labels of the model
+    :param source_sha256: hash of the pickled model these parameters were exported from
+    :return: None
+    """
+    model_data = {'format_version': MODEL_FILE_FORMAT_VERSION,
+                  'model': 'SGDClassifier',
+                  'loss': 'log',
+                  'source_sha256': source_sha256,
+                  'classes': [int(c) for c in classes],
+                  'coef': [float(c) for c in coef],
+                  'intercept': float(intercept)}
+    with open(path, 'w') as model_file:
+        json.dump(model_data, model_file, indent=4)
+
+
+def load_model_file(path: str):
+    """Loads a LogRegModel from a file written by write_model_file."""
+    with open(path, 'r') as model_file:
+        model_data = json.load(model_file)
+    if model_data['format_version'] != MODEL_FILE_FORMAT_VERSION:
+        raise ValueError(f'Unsupported model file format version {model_data["format_version"]} in {path}')
+    return LogRegModel(model_data['coef'], model_data['intercept'], model_data['classes'],
+                       version=model_data['source_sha256'][:16])
@@ -0,0 +1,36 @@
+import unittest
+
+from urlNormalisation import canonicalise_url, normalise_url
+
+# URL: its form after `new URL(url).toString()` in the crawler (Node.js)
+WHATWG_URLS = {
+    'https://1xbet.com/itsatrap?': 'https://1xbet.com/itsatrap?',
+    'HTTP://WWW.Example.COM:80/a/./b/../c//d': 'http://www.example.com/a/c//d',
+    'http://a.com/p^q?x^y#z^w': 'http://a.com/p^q?x^y#z^w',
+    "http://a.com/it's?q='v'#'f'": "http://a.com/it's?q=%27v%27#'f'",
+    'http://a.com/p`q?x`y#z`w': 'http://a.com/p%60q?x`y#z%60w',
+    'http://a.com/a\\b/../c': 'http://a.com/a/c',
+    'http://[2001:DB8::1]/a': 'http://[2001:db8::1]/a',
+    'https://user:pw@[::1]:443/': 'https://user:pw@[::1]/',
+    'http://[1:0:0:2:0:0:0:3]:8080/': 'http://[1:0:0:2::3]:8080/',
+    'http://[::ffff:1.2.3.4]/': 'http://[::ffff:102:304]/',
+    'http://a.com/ é?é#é': 'http://a.com/%20%C3%A9?%C3%A9#%C3%A9',
+}
+
+
+class NormaliseUrlTest(unittest.TestCase):
+    def test_matches_whatwg_serialisation(self):
+        for url, expected in WHATWG_URLS.items():
+            with self.subTest(url=url):
+                self.assertEqual(normalise_url(url), expected)
+
+    def test_keeps_strings_without_host(self):
+        self.assertEqual(normalise_url('/relative/path'), '/relative/path')
+
+    def test_canonical_form(self):
+        self.assertEqual(canonicalise_url('http://a.com/p/?b=2&a=1#f'), 'http://a.com/p?a=1&b=2')
+        self.assertEqual(canonicalise_url('http://[::1]/p/'), 'http://[::1]/p')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+CACHE_PATH = os.path.join('models', 'url-score-cache.sqlite')
+MAX_CACHE_ENTRIES = 2000000
+# Newly cached scores are committed at most this many seconds apart, so a crash loses little work
+COMMIT_INTERVAL = 10
+
+
+def get_url_key(url: str):
+    """Returns a 64-bit integer hash of the given URL, used as key in the score cache."""
+    return int.from_bytes(hashlib.blake2b(url.encode('utf-8'), digest_size=8).digest(), 'big', signed=True)
+
+
+def get_model_version(model_path: str):
+    """
+    Returns a short hash of the contents of the model file, so scores of different models are never mixed up.
+    :param model_path: path of the model file that is used for scoring, i.e. the exported model if there is one
+    """
+    with open(model_path, 'rb') as model_file:
+        return hashlib.sha256(model_file.read()).hexdigest()[:16]
+
+
+class URLScoreCache:
+    """
+    Persistent cache of URL features and product-page probabilities, kept in an SQLite database across crawl rounds.
+    Entries are keyed by URL hash and model version. When the cache holds more than max_entries rows, the entries
+    that were used least recently are evicted.
+    """
+    def __init__(self, model_version: str, path: str = CACHE_PATH, max_entries: int = MAX_CACHE_ENTRIES,
+                 commit_interval: float = COMMIT_INTERVAL):
+        self.model_version = model_version
+        self.max_entries = max_entries
+        self.commit_interval = commit_interval
+        self.last_commit = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS scores ('
+                                'url_key INTEGER NOT NULL, model_version TEXT NOT NULL, '
+                                'features TEXT NOT NULL, probability REAL NOT NULL, last_used INTEGER NOT NULL, '
+                                'PRIMARY KEY (url_key, model_version)) WITHOUT ROWID')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS scores_last_used ON scores (last_used)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS stats ('
+                                'model_version TEXT PRIMARY KEY, hits INTEGER NOT NULL, misses INTEGER NOT NULL)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+        self.connection.execute("INSERT OR IGNORE INTO meta VALUES ('clock', 0)")
+        self.clock = self.connection.execute("SELECT value FROM meta WHERE name = 'clock'").fetchone()[0]
+        # Upper bound of the number of rows, only counted again when it exceeds max_entries
+        self.nr_entries = self.connection.execute('SELECT COUNT(*) FROM scores').fetchone()[0]
+
+    def __str__(self):
+        lookups = self.hits + self.misses
+        hit_rate = round(self.hits / lookups * 100, 1) if lookups else 0.0
+        return f'URL score cache: {self.hits} hits, {self.misses} misses ({hit_rate}% hit rate)'
+
+    def get_many(self, urls: [str]):
+        """
+        Looks up the given URLs in the cache.
+        :param urls: list of URLs as strings
+        :return: dict with key=url, value=probability, containing only the URLs that were found in the cache
+        """
+        self.clock += 1
+        keys = {get_url_key(url): url for url in urls}
+        found = {}
+        key_list = list(keys)
+        # SQLite limits the number of variables in a single statement, so look up keys in slices
+        for i in range(0, len(key_list), 500):
+            key_slice = key_list[i:i + 500]
+            rows = self.connection.execute(
+                f'SELECT url_key, probability FROM scores WHERE model_version = ? '
+                f'AND url_key IN ({",".join("?" * len(key_slice))})', [self.model_version] + key_slice)
+            for url_key, probability in rows:
+                found[keys[url_key]] = probability
+            self.connection.execute(
+                f'UPDATE scores SET last_used = ? WHERE model_version = ? '
+                f'AND url_key IN ({",".join("?" * len(key_slice))})', [self.clock, self.model_version] + key_slice)
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, features: dict, probabilities: dict):
+        """
+        Saves features and probabilities of newly scored URLs to the cache.
+        :param features: dict with key=url, value=tuple of features of that url
+        :param probabilities: dict with key=url, value=probability
+        :return: None
+        """
+        self.connection.executemany(
+            'INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?, ?)',
+            [(get_url_key(url), self.model_version, json.dumps([int(f) for f in features[url]]),
+              float(probabilities[url]), self.clock) for url in probabilities])
+        # Replaced rows are counted too, so this can overestimate, which evict corrects
+        self.nr_entries += len(probabilities)
+        self.evict()
+        if time.monotonic() - self.last_commit >= self.commit_interval:
+            self.commit()
+
+    def evict(self):
+        """Removes the least recently used entries until the cache contains at most max_entries rows."""
+        if self.nr_entries <= self.max_entries:
+            return
+        self.nr_entries = self.connection.execute('SELECT COUNT(*) FROM scores').fetchone()[0]
+        if self.nr_entries <= self.max_entries:
+            return
+        self.connection.execute('DELETE FROM scores WHERE (url_key, model_version) IN ('
+                                'SELECT url_key, model_version FROM scores ORDER BY last_used LIMIT ?)',
+                                (self.nr_entries - self.max_entries,))
+        self.nr_entries = self.max_entries
+
+    def commit(self):
+        """Commits the cached scores and the usage clock."""
+        self.connection.execute("UPDATE meta SET value = ? WHERE name = 'clock'", (self.clock,))
+        self.connection.commit()
+        self.last_commit = time.monotonic()
+
+    def close(self):
+        """Commits cached scores, adds this session's hits and misses to the stored stats and closes the cache."""
+        self.connection.execute('INSERT OR IGNORE INTO stats VALUES (?, 0, 0)', (self.model_version,))
+        self.connection.execute('UPDATE stats SET hits = hits + ?, misses = misses + ? WHERE model_version = ?',
+                                (self.hits, self.misses, self.model_version))
+        self.commit()
+        self.connection.close()
@@ -0,0 +1,145 @@
+import ipaddress
+import os
+import sys
+import urllib.parse as parse
+
+# The fingerprint set is shared with the deduplication of origins in Listing, through the shared package in the
+# root of the repository
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_PATH not in sys.path:
+    sys.path.append(REPO_PATH)
+from shared.fingerprintSet import FingerprintSet, get_fingerprint
+
+DEFAULT_PORTS = {'http': 80, 'https': 443, 'ws': 80, 'wss': 443, 'ftp': 21}
+SPECIAL_SCHEMES = {'http', 'https', 'ws', 'wss', 'ftp', 'file'}
+# Characters that the WHATWG URL parser leaves as-is in paths, queries and fragments of special URLs
+PATH_SAFE_CHARS = "/:@!$&'()*+,;=-._~%[]|^"
+QUERY_SAFE_CHARS = "/:@!$&()*+,;=-._~%[]|?{}^`\\"
+FRAGMENT_SAFE_CHARS = "/:@!$&'()*+,;=-._~%[]|?{}^\\#"
+
+
+def remove_dot_segments(path: str):
+    """
+    Resolves the '.' and '..' segments of a path starting with '/', like the WHATWG URL parser does. Empty segments,
+    as in '//', are kept.
+    """
+    segments = path.split('/')[1:]
+    output = []
+    for i, segment in enumerate(segments):
+        is_last = i == len(segments) - 1
+        segment_lower = segment.lower()
+        if segment_lower in ('.', '%2e'):
+            if is_last:
+                output.append('')
+        elif segment_lower in ('..', '.%2e', '%2e.', '%2e%2e'):
+            if output:
+                output.pop()
+            if is_last:
+                output.append('')
+        else:
+            output.append(segment)
+    return '/' + '/'.join(output)
+
+
+def serialise_ipv6(host: str):
+    """
+    Serialises an IPv6 address like the WHATWG URL parser does: lowercase hexadecimal pieces without leading zeros,
+    of which the first longest run of two or more zero pieces is compressed to '::'.
+    :raises ValueError: if host is not an IPv6 address
+    """
+    pieces = [int(piece, 16) for piece in ipaddress.IPv6Address(host).exploded.split(':')]
+    compress_start, compress_length = None, 1
+    run_start = None
+    for i, piece in enumerate(pieces + [1]):
+        if piece == 0 and run_start is None:
+            run_start = i
+        elif piece != 0 and run_start is not None:
+            if i - run_start > compress_length:
+                compress_start, compress_length = run_start, i - run_start
+            run_start = None
+    hex_pieces = [f'{piece:x}' for piece in pieces]
+    if compress_start is None:
+        return ':'.join(hex_pieces)
+    return ':'.join(hex_pieces[:compress_start]) + '::' + ':'.join(hex_pieces[compress_start + compress_length:])
+
+
+def normalise_url(url: str):
+    """
+    Normalises a URL the way the crawler does when it calls `new URL(k).toString()` on admin file entries:
+    lowercased scheme and host, punycoded host, IPv6 hosts in brackets and compressed, default port removed,
+    backslashes in the path of special URLs turned into slashes, dot-segments resolved, '/' for an empty path and
+    percent-encoding of characters that are not allowed in the path, query or fragment. Like there, an empty query or
+    fragment ('?' or '#' at the end) is kept.
+    :param url: a URL given as string
+    :return: the normalised URL. Strings without a host are returned unchanged.
+    """
+    stripped = url.strip()
+    parts = parse.urlsplit(stripped)
+    if not parts.netloc:
+        return url
+    scheme = parts.scheme.lower()
+    try:
+        if parts.hostname and ':' in parts.hostname:
+            host = f'[{serialise_ipv6(parts.hostname)}]'
+        else:
+            host = parts.hostname.encode('idna').decode('ascii') if parts.hostname else ''
+        port = parts.port
+    except (UnicodeError, ValueError):
+        return url
+    netloc = host
+    if port is not None and port != DEFAULT_PORTS.get(scheme):
+        netloc = f'{host}:{port}'
+    if parts.username is not None:
+        user_info = parts.username if parts.password is None else f'{parts.username}:{parts.password}'
+        netloc = f'{user_info}@{netloc}'
+
+    path = parts.path or '/'
+    if scheme in SPECIAL_SCHEMES:
+        path = path.replace('\\', '/')
+    if '.' in path or '%2e' in path.lower():
+        path = remove_dot_segments(path)
+    normalised = f'{scheme}://{netloc}{parse.quote(path, safe=PATH_SAFE_CHARS)}'
+    # urlsplit gives '' for both an empty and a missing query or fragment
+    if parts.query or '?' in stripped.split('#', 1)[0]:
+        # Only special URLs have the apostrophe in their query percent-encoded
+        query_safe_chars = QUERY_SAFE_CHARS if scheme in SPECIAL_SCHEMES else QUERY_SAFE_CHARS + "'"
+        normalised += '?' + parse.quote(parts.query, safe=query_safe_chars)
+    if parts.fragment or '#' in stripped:
+        normalised += '#' + parse.quote(parts.fragment, safe=FRAGMENT_SAFE_CHARS)
+    return normalised
+
+
+def canonicalise_url(url: str, normalised: bool = False):
+    """
+    Reduces a URL to the form used to decide whether two scraped links point to the same page. On top of
+    normalise_url, the fragment, an empty query and a trailing slash on the path are dropped and query parameters
+    are sorted.
+    :param url: a URL given as string
+    :param normalised: whether url was already normalised with normalise_url, which is then not done again
+    :return: canonical form of the URL
+    """
+    parts = parse.urlsplit(url if normalised else normalise_url(url))
+    path = parts.path
+    if len(path) > 1 and path.endswith('/'):
+        path = path.rstrip('/') or '/'
+    query = '&'.join(sorted(parts.query.split('&'))) if parts.query else ''
+    return parse.urlunsplit((parts.scheme, parts.netloc, path, query, ''))
+
+
+def get_url_fingerprint(url: str, normalised: bool = False):
+    """Returns the fingerprint of the canonical form of a URL (see canonicalise_url)."""
+    return get_fingerprint(canonicalise_url(url, normalised))
+
+
+class SeenSet(FingerprintSet):
+    """Set of URLs, of which only the fingerprints of their canonical forms are stored (see FingerprintSet)."""
+    def __contains__(self, url: str):
+        return super().__contains__(get_url_fingerprint(url))
+
+    def add(self, url: str, normalised: bool = False):
+        """
+        Adds a URL to the set.
+        :param normalised: whether url was already normalised with normalise_url, see canonicalise_url
+        :return: True if the URL (or a URL with the same canonical form) was not in the set yet, False otherwise
+        """
+        return super().add(get_url_fingerprint(url, normalised))
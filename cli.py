@@ -0,0 +1,48 @@
+import argparse
+import importlib
+import os
+import sys
+
+REPO_PATH = os.path.dirname(os.path.abspath(__file__))
+
+# Subcommand: (directory the script is run from, module of the script, whether it takes arguments, help)
+# Scripts are only imported when their subcommand runs, so starting the CLI does not import their dependencies.
+COMMANDS = {
+    'postprocess': ('Analysis', 'postProcessing', True, 'process the crawled data into the results files'),
+    'analyse': ('Analysis', 'analysis', True, 'analyse the results files and print the counters'),
+    'monitor': ('Analysis', 'crawlMonitor', True, 'monitor the throughput of a running crawl'),
+    'reset': ('Analysis', 'deleteResults', False, 'remove the results of postprocess'),
+    'score-urls': ('ProductUrls', 'SortURLs', False, 'select the links to crawl next from the scraped links'),
+}
+
+
+def run_command(command: str, argv: [str]):
+    """Runs the main function of the script of a subcommand from the directory of the script."""
+    directory, module_name, takes_arguments, _ = COMMANDS[command]
+    script_path = os.path.join(REPO_PATH, directory)
+    os.chdir(script_path)
+    sys.path.insert(0, script_path)
+    module = importlib.import_module(module_name)
+    if takes_arguments:
+        module.main(argv)
+    else:
+        module.main()
+
+
+def main(argv: [str] = None):
+    parser = argparse.ArgumentParser(description='Process and analyse the crawled data.')
+    subparsers = parser.add_subparsers(dest='command', required=True, metavar='command')
+    for command, (_, _, takes_arguments, help_text) in COMMANDS.items():
+        if takes_arguments:
+            # Arguments, including --help, are parsed by the script itself
+            subparsers.add_parser(command, help=f'{help_text} ({command} --help for its options)', add_help=False)
+        else:
+            subparsers.add_parser(command, help=help_text)
+    args, arguments = parser.parse_known_args(argv)
+    if arguments and not COMMANDS[args.command][2]:
+        parser.error(f'unrecognized arguments: {" ".join(arguments)}')
+    run_command(args.command, arguments)
+
+
+if __name__ == '__main__':
+    main()
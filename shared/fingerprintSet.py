@@ -0,0 +1,64 @@
+import hashlib
+from array import array
+
+
+def get_fingerprint(value: str):
+    """Returns a non-zero 64-bit fingerprint of a string."""
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big') or 1
+
+
+class FingerprintSet:
+    """
+    Memory-compact set of fingerprints (see get_fingerprint), stored in an open-addressing hash table backed by an
+    array. This takes 16 bytes per entry instead of a full string object.
+    """
+    def __init__(self, capacity: int = 1024):
+        size = 1
+        while size < capacity * 2:
+            size *= 2
+        self.table = array('Q', bytes(8 * size))
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, fingerprint: int):
+        return self.__find_slot(fingerprint)[1]
+
+    def __find_slot(self, fingerprint: int):
+        """Returns the slot in which fingerprint is or should be placed, and whether it is already there."""
+        mask = len(self.table) - 1
+        slot = fingerprint & mask
+        while True:
+            value = self.table[slot]
+            if value == 0:
+                return slot, False
+            if value == fingerprint:
+                return slot, True
+            slot = (slot + 1) & mask
+
+    def __grow(self):
+        old_table = self.table
+        self.table = array('Q', bytes(16 * len(old_table)))
+        mask = len(self.table) - 1
+        for fingerprint in old_table:
+            if fingerprint == 0:
+                continue
+            slot = fingerprint & mask
+            while self.table[slot] != 0:
+                slot = (slot + 1) & mask
+            self.table[slot] = fingerprint
+
+    def add(self, fingerprint: int):
+        """
+        Adds a fingerprint to the set.
+        :return: True if the fingerprint was not in the set yet, False otherwise
+        """
+        slot, found = self.__find_slot(fingerprint)
+        if found:
+            return False
+        self.table[slot] = fingerprint
+        self.size += 1
+        if self.size * 2 > len(self.table):
+            self.__grow()
+        return True